@@ -2,7 +2,7 @@ from django.http.response import HttpResponse
 from django.shortcuts import redirect, render
 from django.views.generic import ListView, DetailView
 from listings.choices import price_choices , bedroom_choices , state_choices
-from listings.models import Listing
+from listings.feed import homepage_feed, feed_timeout, feed_version
 from .models import Post, Categories, PostComment
 from django.db.models import Q
 from django.contrib.auth.decorators import login_required
@@ -12,8 +12,10 @@ from django.http import HttpResponseNotFound, Http404
 # Create your views here.
 
 def index(request):
-   listings = Listing.objects.order_by('-list_date').filter(is_published=True);
+   listings = homepage_feed()
    return render(request , 'pages/index.html',{'listings' : listings ,
+        'feed_timeout' : feed_timeout(),
+        'feed_version' : feed_version(),
         'state_choices' : state_choices,
         'bedroom_choices' : bedroom_choices,
         'price_choices' : price_choices,
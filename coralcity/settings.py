@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 """
 
 import os
+import sys
 import dj_database_url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -179,17 +180,141 @@ MEDIA_URL = '/media/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
+# Rendered pages and template fragments, the homepage feed, the search facet
+# counts and the map clusters go to the file-based "pages" cache so every worker
+# on the host shares them, together with the tag versions they are keyed on.
+# Pages are cached per language, path and query string for PAGE_CACHE_TIMEOUT
+# seconds and invalidated by the Listing and Realtor signals (see
+# listings/pagecache.py).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'page_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+PAGE_CACHE_TIMEOUT = 600
+
+# Number of latest listings shown on the homepage, and how long (seconds) the
+# feed and its rendered cards may be cached before they are rebuilt.
+HOMEPAGE_FEED_SIZE = 6
+HOMEPAGE_FEED_TIMEOUT = 300
+
+# Listings map: at zoom levels up to MAP_CLUSTER_MAX_ZOOM map_data returns
+# grid cluster aggregates (MAP_CLUSTER_GRID x MAP_CLUSTER_GRID cells per map
+# tile) instead of individual listings, cached for MAP_CLUSTER_TIMEOUT seconds.
+MAP_CLUSTER_MAX_ZOOM = 13
+MAP_CLUSTER_GRID = 4
+MAP_CLUSTER_TIMEOUT = 300
+
+# Precomputed map tiles (/listings/map-tiles/<z>/<x>/<y>): built up to
+# MAP_TILE_MAX_ZOOM, stored under MAP_TILE_ROOT, and cacheable by browsers and
+# CDNs for MAP_TILE_MAX_AGE seconds before they revalidate with the ETag.
+MAP_TILE_MAX_ZOOM = 16
+MAP_TILE_ROOT = os.path.join(BASE_DIR, 'map_tiles')
+MAP_TILE_MAX_AGE = 60
+
+# Geocoder used by the Listing signals and geocode_listings: "nominatim",
+# "stub" (a local geocode_stub_server) or a dotted path to a backend class,
+# constructed with GEOCODER_OPTIONS. GEOCODER_RATE caps the requests per second
+# across all geocode_listings workers (Nominatim allows one).
+GEOCODER_BACKEND = 'nominatim'
+GEOCODER_OPTIONS = {}
+GEOCODER_RATE = 1.0
+
+# Geocoder answers are cached in the database per normalized address: found
+# addresses for GEOCODE_CACHE_TTL seconds, "not found" answers for
+# GEOCODE_CACHE_NEGATIVE_TTL seconds.
+GEOCODE_CACHE_TTL = 90 * 24 * 3600
+GEOCODE_CACHE_NEGATIVE_TTL = 7 * 24 * 3600
+
+# Background jobs (listings/jobs.py), run by "manage.py run_workers" with
+# JOB_WORKERS threads polling every JOB_POLL_INTERVAL seconds. Failing jobs are
+# retried after JOB_RETRY_DELAY seconds, doubling each time, up to
+# JOB_MAX_ATTEMPTS attempts; jobs running for longer than JOB_LOCK_TIMEOUT
+# seconds are assumed abandoned and queued again.
+JOB_WORKERS = 2
+JOB_POLL_INTERVAL = 1.0
+JOB_RETRY_DELAY = 30
+JOB_MAX_ATTEMPTS = 5
+JOB_LOCK_TIMEOUT = 600
+
+# Rows fetched per database round trip by the streaming exports
+# (/exports/<dataset>/ and "manage.py export_data", see listings/export.py).
+EXPORT_CHUNK_SIZE = 2000
+
+# Resized variants of listing and realtor photos (listings/images.py): one per
+# width and format, written under MEDIA_ROOT/derivatives when a photo is
+# uploaded (by a background job) or by "manage.py build_image_derivatives".
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1280)
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'jpeg')
+IMAGE_DERIVATIVE_QUALITY = 80
+
+# On-demand thumbnails (/media-thumb/<width>/<path>, listings/thumbnails.py)
+# for photos without precomputed variants: resized to one of THUMBNAIL_SIZES
+# by THUMBNAIL_WORKERS processes and kept in THUMBNAIL_CACHE_ROOT, whose least
+# recently used files are deleted beyond THUMBNAIL_CACHE_MAX_BYTES. Only the
+# photos under THUMBNAIL_SOURCE_DIRS are served, never uploaded documents.
+# Browsers keep a thumbnail THUMBNAIL_MAX_AGE seconds, then revalidate it.
+THUMBNAIL_SOURCE_DIRS = ('photos',)
+THUMBNAIL_SIZES = (160, 320, 640, 1280)
+THUMBNAIL_WORKERS = 2
+THUMBNAIL_CACHE_ROOT = os.path.join(BASE_DIR, 'thumb_cache')
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+THUMBNAIL_MAX_AGE = 24 * 3600
+
+# Uploaded photos and documents are processed by a background job after the
+# save (listings/uploads.py): images are scaled down to fit
+# UPLOAD_MAX_DIMENSION and re-encoded without metadata at
+# UPLOAD_IMAGE_QUALITY, and every file is stored once under its content hash.
+# "manage.py process_uploads" processes the existing uploads.
+UPLOAD_PROCESSING = True
+UPLOAD_MAX_DIMENSION = 2560
+UPLOAD_IMAGE_QUALITY = 85
+
+# Fingerprinted CSS/JS bundles written to STATIC_ROOT/bundles by
+# "manage.py build_assets" (after collectstatic) and included with the
+# {% bundle %} tag (listings/assets.py). Without them, or while DEBUG is on,
+# the tag includes the source files one by one.
+ASSET_BUNDLES_ENABLED = not DEBUG
+
+# Static files with a content hash in their name (collectstatic's and the
+# bundles') are sent with "Cache-Control: immutable".
+WHITENOISE_IMMUTABLE_FILE_TEST = r'^.+\.[0-9a-f]{12}\..+$'
+
+# Keep an in-memory NumPy read model of the published listings in each worker
+# for search filtering, facet counts and map clusters (needs numpy).
+LISTING_READ_MODEL = True
+
+# The in-memory indexes (read model, similar listings) of each worker check the
+# shared IndexVersion table at most once per this many seconds for changes made
+# by other processes, and rebuild when there are some.
+LOCAL_INDEX_CHECK_INTERVAL = 1.0
+
+# Seconds the search page's facet counts are cached per filter set.
+SEARCH_FACETS_TIMEOUT = 300
+
+# Number of "similar properties" shown on the listing detail pages (needs numpy).
+SIMILAR_LISTINGS_COUNT = 4
+
 # Show Django Debug Toolbar locally when DEBUG is True
 if DEBUG:
     # Common local loopback addresses; helps when not using plain 127.0.0.1
     INTERNAL_IPS = ['127.0.0.1', 'localhost', '::1']
 
+    # "manage.py test" runs with DEBUG off; the toolbar stays out of its way.
+    RUNNING_TESTS = sys.argv[1:2] == ['test']
+
     # Ensure the toolbar shows whenever DEBUG is on, regardless of client IP
     def show_toolbar(request):
-        return True
+        return not RUNNING_TESTS
 
     DEBUG_TOOLBAR_CONFIG = {
         'SHOW_TOOLBAR_CALLBACK': show_toolbar,
+        'IS_RUNNING_TESTS': False,
     }
 
 
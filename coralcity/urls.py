@@ -37,6 +37,13 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     # The 'i18n/' path is where Django handles setting the language and should usually not be prefixed.
     path('i18n/', include('django.conf.urls.i18n')), 
+    # Map tiles hold no translated text; keeping them unprefixed lets browsers
+    # and CDNs share one cached copy across all languages.
+    path('listings/map-tiles/<int:z>/<int:x>/<int:y>', listing_views.map_tile, name='map_tile'),
+    # Resized media images, shared by all languages (see listings/thumbnails.py).
+    path('media-thumb/<int:size>/<path:path>', listing_views.media_thumbnail, name='media_thumbnail'),
+    # Staff data exports; no translated text either.
+    path('exports/<str:dataset>/', listing_views.export, name='export'),
     path('graphql/', GraphQLView.as_view(graphiql=True)), # You might keep this non-prefixed or put it inside i18n_patterns if you need translated GraphQL endpoints. Keeping outside for this example.
 ]
 
@@ -1,8 +1,15 @@
 from django.contrib import admin
 from import_export.admin import ImportExportModelAdmin
-from .models import Listing
+from .models import Listing, ListingPhoto
+
+class ListingPhotoInline(admin.TabularInline):
+	model = ListingPhoto
+	fields = ('image', 'position', 'width', 'height')
+	readonly_fields = ('width', 'height')
+	extra = 1
 
 class ListingAdmin(ImportExportModelAdmin):
+	inlines = [ListingPhotoInline]
 	list_display = ('id' , 'title' , 'is_published' , 'price' , 'list_date' ,'realtor')
 	list_display_links = ('id' , 'title')
 	list_filter = ('realtor', 'city','state' )
@@ -8,3 +8,5 @@ class ListingsConfig(AppConfig):
     def ready(self):
         # Import signal handlers
         from . import signals  # noqa: F401
+        # Register the background job tasks
+        from . import geocoding, images, uploads  # noqa: F401
@@ -0,0 +1,310 @@
+"""Fingerprinted, minified and precompressed bundles of the site's CSS and JS.
+
+A first page load fetched every stylesheet and script of ``base.html`` (and
+Leaflet and markercluster from unpkg on the map pages) separately. The
+``build_assets`` command concatenates the sources of each bundle in
+``ASSET_BUNDLES``, minifies it, and writes it under ``STATIC_ROOT`` with a
+content hash in its name, plus ``.gz`` (and ``.br``, with the ``brotli``
+package) copies that WhiteNoise sends to browsers accepting them::
+
+    bundles/site.3f2a9c01d4e5.css
+    bundles/site.3f2a9c01d4e5.css.gz
+    bundles/manifest.json
+
+Hashed names never change content, so WhiteNoise serves them ``immutable``
+(see ``WHITENOISE_IMMUTABLE_FILE_TEST``). Templates include a bundle with
+``{% bundle 'site.css' %}`` (the ``assets`` tags), which looks the name up
+in the manifest. Without a built bundle, or with ``ASSET_BUNDLES_ENABLED``
+off, the tag renders the sources one by one as before.
+
+A source is a static file path or an ``https://`` URL, which is fetched at
+build time and, given as ``(url, integrity)``, checked against its
+subresource integrity hash. Relative ``url()`` references in stylesheets are
+rewritten for the bundle's location, to the hashed static names where
+``collectstatic`` wrote a manifest.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import threading
+import urllib.request
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.html import format_html, format_html_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+BUNDLE_DIR = 'bundles'
+MANIFEST_NAME = f'{BUNDLE_DIR}/manifest.json'
+
+LEAFLET_CSS = (
+    'https://unpkg.com/leaflet@1.9.4/dist/leaflet.css',
+    'sha256-p4NxAoJBhIIN+hmNHrzRCf9tD/miZyoHS5obTRR9BMY=',
+)
+LEAFLET_JS = (
+    'https://unpkg.com/leaflet@1.9.4/dist/leaflet.js',
+    'sha256-20nQCchB9co0qIjJZRGuk2/Z9VM+kNiyxNV1lvTlZBo=',
+)
+
+# Sources of each bundle, in page order. Bootstrap 5 stays on its CDN:
+# the static files hold Bootstrap 4. jQuery is a bundle of its own because
+# base.html loads it before Bootstrap, and the rest of site.js after.
+BUNDLES = {
+    'site.css': [
+        'css/all.css',
+        'css/style.css',
+        'css/lightbox.min.css',
+        'css/language-switcher.css',
+    ],
+    'jquery.js': [
+        'js/jquery-3.3.1.min.js',
+    ],
+    'site.js': [
+        'js/main.js',
+        'js/lightbox.min.js',
+        'js/language-switcher.js',
+    ],
+    'map.css': [
+        LEAFLET_CSS,
+        'https://unpkg.com/leaflet.markercluster@1.5.3/dist/MarkerCluster.css',
+        'https://unpkg.com/leaflet.markercluster@1.5.3/dist/MarkerCluster.Default.css',
+    ],
+    'map.js': [
+        LEAFLET_JS,
+        'https://unpkg.com/leaflet.markercluster@1.5.3/dist/leaflet.markercluster.js',
+    ],
+}
+
+# Seconds to wait for a remote source.
+FETCH_TIMEOUT = 30
+
+_lock = threading.Lock()
+_manifest = {'mtime': None, 'bundles': {}}
+
+_STRING = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+_URL = re.compile(r'''url\(\s*(["']?)([^"')]+)\1\s*\)''')
+_SOURCE_MAP = re.compile(r'^\s*//[#@] sourceMappingURL=.*$', re.MULTILINE)
+
+
+class AssetError(Exception):
+    pass
+
+
+def bundles():
+    return getattr(settings, 'ASSET_BUNDLES', BUNDLES)
+
+
+def bundles_enabled():
+    return getattr(settings, 'ASSET_BUNDLES_ENABLED', not settings.DEBUG)
+
+
+def split_source(source):
+    """``(path or URL, integrity or None)`` of a bundle source."""
+    if isinstance(source, (tuple, list)):
+        return source[0], source[1]
+    return source, None
+
+
+def is_remote(path):
+    return path.startswith(('https://', 'http://', '//'))
+
+
+# --- Building ---------------------------------------------------------------
+
+def check_integrity(url, body, integrity):
+    algorithm, _, expected = integrity.partition('-')
+    digest = base64.b64encode(hashlib.new(algorithm, body).digest()).decode()
+    if digest != expected:
+        raise AssetError(f'{url} does not match its integrity hash {integrity}.')
+
+
+def read_source(source):
+    """The text of ``source``: a static file, or a remote file fetched now."""
+    path, integrity = split_source(source)
+    if is_remote(path):
+        url = f'https:{path}' if path.startswith('//') else path
+        try:
+            with urllib.request.urlopen(url, timeout=FETCH_TIMEOUT) as response:
+                body = response.read()
+        except OSError as e:
+            raise AssetError(f'Cannot fetch {url}: {e}')
+        if integrity:
+            check_integrity(url, body, integrity)
+        return body.decode('utf-8')
+    found = finders.find(path)
+    if not found:
+        raise AssetError(f'Static file {path!r} not found.')
+    with open(found, encoding='utf-8') as f:
+        return f.read()
+
+
+def static_url(path):
+    """URL of the static file ``path``, hashed when collectstatic's manifest has it."""
+    try:
+        return staticfiles_storage.url(path)
+    except ValueError:
+        return settings.STATIC_URL + path
+
+
+def rewrite_urls(css, source):
+    """``css`` with its relative ``url()`` references made absolute."""
+    path, _integrity = split_source(source)
+
+    def replace(match):
+        quote, reference = match.groups()
+        if reference.startswith(('data:', '#', '/', 'http:', 'https:')):
+            return match.group(0)
+        if is_remote(path):
+            return f'url({quote}{urljoin(path, reference)}{quote})'
+        target, suffix = re.match(r'([^?#]*)(.*)', reference).groups()
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(path), target))
+        return f'url({quote}{static_url(target)}{suffix}{quote})'
+
+    return _URL.sub(replace, css)
+
+
+def minify_css(css):
+    """Drop comments (but ``/*!`` licences) and the whitespace that does not matter."""
+    parts = _STRING.split(css)
+    for i in range(0, len(parts), 2):
+        code = re.sub(r'/\*(?!!).*?\*/', '', parts[i], flags=re.DOTALL)
+        code = re.sub(r'@charset[^;]*;', '', code)
+        code = re.sub(r'\s+', ' ', code)
+        code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+        parts[i] = code.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(js):
+    """``js`` minified by rjsmin when it is installed, without source map comments."""
+    js = _SOURCE_MAP.sub('', js)
+    if rjsmin is not None:
+        return rjsmin.jsmin(js, keep_bang_comments=True)
+    return js.strip()
+
+
+def build_bundle(name, sources):
+    """The minified contents of bundle ``name`` as bytes."""
+    texts = [read_source(source) for source in sources]
+    if name.endswith('.css'):
+        return '\n'.join(minify_css(rewrite_urls(text, source)) for text, source in zip(texts, sources)).encode()
+    # A script without a trailing semicolon must not run into the next one.
+    return ';\n'.join(minify_js(text) for text in texts).encode()
+
+
+def hashed_name(name, body):
+    """``bundles/<stem>.<12 hex digits>.<ext>``, the form WhiteNoise treats as immutable."""
+    stem, extension = os.path.splitext(name)
+    return f'{BUNDLE_DIR}/{stem}.{hashlib.sha256(body).hexdigest()[:12]}{extension}'
+
+
+def write_file(path, body):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def write_bundle(name, body, root=None):
+    """Write ``body`` and its compressed copies under its hashed name; returns the sizes."""
+    root = root or settings.STATIC_ROOT
+    path = os.path.join(root, hashed_name(name, body))
+    sizes = {'raw': len(body)}
+    write_file(path, body)
+    compressed = gzip.compress(body, compresslevel=9, mtime=0)
+    write_file(f'{path}.gz', compressed)
+    sizes['gzip'] = len(compressed)
+    if brotli is not None:
+        compressed = brotli.compress(body, quality=11)
+        write_file(f'{path}.br', compressed)
+        sizes['br'] = len(compressed)
+    return sizes
+
+
+def write_manifest(entries, root=None):
+    """Write the bundle name -> hashed name manifest (merged into the existing one)."""
+    root = root or settings.STATIC_ROOT
+    path = os.path.join(root, MANIFEST_NAME)
+    manifest = dict(read_manifest(path))
+    manifest.update(entries)
+    write_file(path, json.dumps(manifest, indent=2, sort_keys=True).encode())
+
+
+def stale_files(root=None):
+    """Bundle files no longer named in the manifest."""
+    root = root or settings.STATIC_ROOT
+    directory = os.path.join(root, BUNDLE_DIR)
+    current = {posixpath.basename(name) for name in read_manifest(os.path.join(root, MANIFEST_NAME)).values()}
+    current.add(posixpath.basename(MANIFEST_NAME))
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if re.sub(r'\.(gz|br)$', '', name) not in current
+    )
+
+
+# --- Templates --------------------------------------------------------------
+
+def read_manifest(path=None):
+    path = path or os.path.join(settings.STATIC_ROOT, MANIFEST_NAME)
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def manifest():
+    """The built bundles, reread when the manifest file changes."""
+    path = os.path.join(settings.STATIC_ROOT, MANIFEST_NAME)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime != _manifest['mtime']:
+        with _lock:
+            _manifest['bundles'] = read_manifest(path) if mtime is not None else {}
+            _manifest['mtime'] = mtime
+    return _manifest['bundles']
+
+
+def source_urls(name):
+    """``(url, integrity)`` of the tags that include bundle ``name``."""
+    built = manifest().get(name) if bundles_enabled() else None
+    if built:
+        return [(settings.STATIC_URL + built, None)]
+    urls = []
+    for source in bundles()[name]:
+        path, integrity = split_source(source)
+        urls.append((path if is_remote(path) else static_url(path), integrity))
+    return urls
+
+
+def render_tags(name):
+    if name not in bundles():
+        raise AssetError(f'Unknown asset bundle {name!r}.')
+    if name.endswith('.css'):
+        template = '<link rel="stylesheet" href="{}"{}>'
+    else:
+        template = '<script src="{}"{}></script>'
+    return format_html_join('\n', template, (
+        (url, format_html(' integrity="{}" crossorigin=""', integrity) if integrity else '')
+        for url, integrity in source_urls(name)
+    ))
@@ -0,0 +1,63 @@
+"""Index and cache upkeep after bulk writes, which bypass the Listing signals.
+
+``bulk_create()``, ``bulk_update()`` and ``update()`` send no post_save, so
+code that writes many listings at once calls ``listings_written()``
+afterwards. It brings the full-text and spatial indexes up to date in a
+few statements and, once the transaction commits, drops the in-memory
+indexes and the caches once, rather than once per listing. It also queues
+geocoding for the listings that have no coordinates.
+"""
+from django.db import transaction
+
+from . import fulltext, jobs, readmodel, similar, spatial, tiles
+from .clustering import invalidate_clusters
+from .facets import invalidate_facets
+from .feed import invalidate_feed
+from .models import ADDRESS_FIELDS
+from .pagecache import invalidate_tags
+
+# Past this many moved points dropping every stored tile is cheaper than
+# invalidating them point by point.
+TILE_INVALIDATION_LIMIT = 1000
+
+
+def listings_written(listings, created=False, geocode=True):
+    """Refresh everything derived from ``listings`` after they were written in bulk.
+
+    ``created`` skips the per-listing page tags, which no cached page can
+    use yet. The indexes are written in the current transaction; the caches
+    are dropped and geocoding queued once it commits, so no other process
+    rebuilds them from the rows as they were before.
+    """
+    listings = list(listings)
+    if not listings:
+        return
+    fulltext.index_listings(listings)
+    spatial.index_listings(listings)
+
+    points = [
+        (listing.latitude, listing.longitude) for listing in listings
+        if listing.latitude is not None and listing.longitude is not None
+    ]
+    tags = ['listings'] if created else ['listings', *['listing:%s' % listing.pk for listing in listings]]
+    to_geocode = [
+        listing.pk for listing in listings
+        if (listing.latitude is None or listing.longitude is None)
+        and any(getattr(listing, field) for field in ADDRESS_FIELDS)
+    ] if geocode else []
+
+    def refresh():
+        readmodel.invalidate()
+        similar.invalidate()
+        if len(points) > TILE_INVALIDATION_LIMIT:
+            tiles.clear_tiles()
+        else:
+            tiles.invalidate_points(points)
+        invalidate_feed()
+        invalidate_clusters()
+        invalidate_facets()
+        invalidate_tags(*tags)
+        if to_geocode:
+            jobs.enqueue_many('geocode_listing', [(str(pk), {'listing_id': pk}) for pk in to_geocode])
+
+    transaction.on_commit(refresh)
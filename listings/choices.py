@@ -73,3 +73,6 @@ state_choices = {
         'NG-YOB': 'Yobe',
         'NG-ZAM': 'Zamfara',
 }
+
+# Upper bounds of the price choices, ascending.
+PRICE_BOUNDS = sorted(int(key) for key in price_choices)
@@ -0,0 +1,156 @@
+"""Viewport filtering and zoom-aware grid clustering for the listings map.
+
+``map_data`` accepts ``bbox=west,south,east,north`` (Leaflet's
+``getBounds().toBBoxString()``) and ``zoom``. With a bbox only the listings
+inside the viewport are returned. At zoom levels up to
+``MAP_CLUSTER_MAX_ZOOM`` the listings are aggregated in the database into a
+grid of ``MAP_CLUSTER_GRID`` x ``MAP_CLUSTER_GRID`` cells per map tile and
+only the per-cell aggregates (count, centroid, min/max price) are sent, so
+the payload depends on the viewport rather than on the inventory.
+
+Aggregates are cached per zoom, grid-snapped bbox and filter set in the
+shared ``pages`` cache, under the version of the ``map_clusters`` tag (see
+``pagecache``), which the Listing signals bump on every save or delete.
+"""
+import hashlib
+import math
+
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max, Min, Q
+from django.db.models.functions import Floor
+
+from .pagecache import invalidate_tags, page_cache, tag_versions
+from .params import ParameterError, parse_float, parse_int
+
+CLUSTERS_TAG = 'map_clusters'
+
+MAX_ZOOM = 22
+
+
+def cluster_max_zoom():
+    return getattr(settings, 'MAP_CLUSTER_MAX_ZOOM', 13)
+
+
+def cluster_grid():
+    return getattr(settings, 'MAP_CLUSTER_GRID', 4)
+
+
+def parse_bbox(value):
+    """Parse ``west,south,east,north``; raise ``ParameterError`` if malformed."""
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ParameterError('bbox must be four numbers: west,south,east,north')
+    west, south, east, north = (parse_float(part, 'bbox') for part in parts)
+    south, north = max(south, -90.0), min(north, 90.0)
+    if south > north:
+        raise ParameterError('bbox south must not be greater than north')
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        # Leaflet reports longitudes past +/-180 after panning across the
+        # antimeridian; bring them back into range.
+        west = (west + 180) % 360 - 180
+        east = (east + 180) % 360 - 180
+    return west, south, east, north
+
+
+def parse_zoom(value):
+    zoom = parse_int(value, 'zoom')
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ParameterError(f'zoom must be between 0 and {MAX_ZOOM}')
+    return zoom
+
+
+def filter_bbox(queryset, bbox):
+    west, south, east, north = bbox
+    queryset = queryset.filter(latitude__gte=south, latitude__lte=north)
+    if west <= east:
+        return queryset.filter(longitude__gte=west, longitude__lte=east)
+    # The viewport spans the antimeridian.
+    return queryset.filter(Q(longitude__gte=west) | Q(longitude__lte=east))
+
+
+def cell_size(zoom):
+    """Grid cell edge in degrees at ``zoom``."""
+    return 360.0 / (2 ** zoom * cluster_grid())
+
+
+def snap_bbox(bbox, zoom):
+    """Grow ``bbox`` outwards to whole grid cells so cells are never cut."""
+    size = cell_size(zoom)
+    west, south, east, north = bbox
+    return (
+        max(math.floor(west / size) * size, -180.0),
+        max(math.floor(south / size) * size, -90.0),
+        min(math.ceil(east / size) * size, 180.0),
+        min(math.ceil(north / size) * size, 90.0),
+    )
+
+
+def cluster_rows(queryset, zoom):
+    """Aggregate ``queryset`` per grid cell in a single GROUP BY query."""
+    size = cell_size(zoom)
+    return (
+        queryset.order_by()
+        .annotate(
+            cell_x=Floor((F('longitude') + 180.0) / size),
+            cell_y=Floor((F('latitude') + 90.0) / size),
+        )
+        .values('cell_x', 'cell_y')
+        .annotate(
+            count=Count('id'),
+            latitude_avg=Avg('latitude'),
+            longitude_avg=Avg('longitude'),
+            min_price=Min('price'),
+            max_price=Max('price'),
+        )
+    )
+
+
+def cluster_features(queryset, zoom):
+    return [
+        {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [row['longitude_avg'], row['latitude_avg']],
+            },
+            'properties': {
+                'cluster': True,
+                'count': row['count'],
+                'min_price': row['min_price'],
+                'max_price': row['max_price'],
+            },
+        }
+        for row in cluster_rows(queryset, zoom)
+    ]
+
+
+def invalidate_clusters():
+    invalidate_tags(CLUSTERS_TAG)
+
+
+def cached_cluster_collection(queryset, zoom, bbox, fingerprint):
+    """The cluster FeatureCollection for ``bbox`` at ``zoom``, cached.
+
+    ``queryset`` must already carry the filters identified by
+    ``fingerprint`` (see ``queries.filter_fingerprint()``) but not the bbox;
+    the bbox is snapped to the grid and applied here.
+    """
+    if bbox is not None:
+        bbox = snap_bbox(bbox, zoom)
+    digest = hashlib.md5(f'{zoom}|{bbox}|{fingerprint}'.encode()).hexdigest()
+    version, = tag_versions([CLUSTERS_TAG])
+    key = f'listings:map_clusters:{version}:{digest}'
+
+    cache = page_cache()
+    collection = cache.get(key)
+    if collection is None:
+        if bbox is not None:
+            queryset = filter_bbox(queryset, bbox)
+        collection = {
+            'type': 'FeatureCollection',
+            'features': cluster_features(queryset, zoom),
+        }
+        cache.set(key, collection, getattr(settings, 'MAP_CLUSTER_TIMEOUT', 300))
+    return collection
@@ -0,0 +1,124 @@
+"""Conditional GET for the listing pages and ``map_data``.
+
+Validators are computed from ``Listing.updated_at`` with at most two small
+queries and before any template or JSON work, so a revalidation answered
+with 304 costs next to nothing:
+
+* the published collection is described by ``max(updated_at)`` plus the
+  number of published listings (the count catches deletions, which leave
+  the maximum alone); both come from the partial ``updated_at`` index;
+* a detail page adds that listing's own ``updated_at`` and its page-cache
+  tag version, which the Realtor signals bump when the realtor shown on
+  the page changes.
+
+HTML pages also vary by language and by the logged-in user (navbar,
+inquiry form), so both are part of their ETag and they are marked
+``private``. Responses carry ``Cache-Control: no-cache``: browsers keep
+them, but always revalidate first. Requests with pending flash messages
+skip conditional handling, since the page has to show the messages.
+"""
+import functools
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+
+from .models import Listing
+from .pagecache import tag_versions
+
+
+def collection_state(request):
+    """``(max(updated_at), count)`` of the published listings, once per request."""
+    state = getattr(request, '_listing_collection_state', None)
+    if state is None:
+        totals = Listing.objects.filter(is_published=True).aggregate(
+            last_modified=Max('updated_at'), count=Count('id'),
+        )
+        state = request._listing_collection_state = (totals['last_modified'], totals['count'])
+    return state
+
+
+def listing_updated_at(request, listing_id):
+    """``updated_at`` of one listing (None if there is no such listing), once per request."""
+    cached = getattr(request, '_listing_updated_at', None)
+    if cached is None or cached[0] != listing_id:
+        updated_at = Listing.objects.filter(pk=listing_id).values_list('updated_at', flat=True).first()
+        cached = request._listing_updated_at = (listing_id, updated_at)
+    return cached[1]
+
+
+def _hash(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _viewer(request):
+    user = getattr(request, 'user', None)
+    return get_language(), user.pk if user is not None and user.is_authenticated else None
+
+
+def _skip(request):
+    return bool(len(get_messages(request)))
+
+
+# --- Validators, in the (request, *args, **kwargs) form ``condition`` expects
+
+def collection_etag(request, *args, **kwargs):
+    if _skip(request):
+        return None
+    return _hash('collection', collection_state(request), _viewer(request))
+
+
+def collection_last_modified(request, *args, **kwargs):
+    if _skip(request):
+        return None
+    return collection_state(request)[0]
+
+
+def data_etag(request, *args, **kwargs):
+    # JSON is the same for every visitor and language; the query string is
+    # part of the URL the ETag belongs to.
+    return _hash('data', collection_state(request))
+
+
+def data_last_modified(request, *args, **kwargs):
+    return collection_state(request)[0]
+
+
+def listing_etag(request, listing_id, *args, **kwargs):
+    updated_at = listing_updated_at(request, listing_id)
+    if updated_at is None or _skip(request):
+        return None
+    return _hash(
+        'listing', listing_id, updated_at, tag_versions(['listing:%s' % listing_id]),
+        collection_state(request), _viewer(request),
+    )
+
+
+def listing_last_modified(request, listing_id, *args, **kwargs):
+    updated_at = listing_updated_at(request, listing_id)
+    if updated_at is None or _skip(request):
+        return None
+    # The similar-listings block depends on the other listings too.
+    collection_modified = collection_state(request)[0]
+    return max(updated_at, collection_modified) if collection_modified else updated_at
+
+
+def conditional(etag_func, last_modified_func, private=True):
+    """``condition()`` plus ``Cache-Control: no-cache`` so clients always revalidate."""
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code in (200, 304) and response.has_header('ETag'):
+                if private:
+                    patch_cache_control(response, private=True, no_cache=True)
+                else:
+                    patch_cache_control(response, public=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
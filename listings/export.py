@@ -0,0 +1,136 @@
+"""Streaming CSV and NDJSON exports of listings, realtors and contacts.
+
+The admin's import-export buttons build the whole tablib dataset in memory
+inside the request, which does not scale to the full catalogue. Here rows
+come from a ``values_list()`` projection read with ``iterator()`` (a
+server-side cursor where the database has one, chunked ``fetchmany``
+otherwise) and are encoded and written out in chunks, so memory stays flat
+however many rows are exported. Used by the ``export`` view and the
+``export_data`` command.
+
+Fields are the model's concrete fields (foreign keys by id, e.g.
+``realtor_id``), all of them by default. Filters are ``field`` or
+``field__lookup`` names with string values, as in a query string.
+"""
+import csv
+import io
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+
+DATASETS = {
+    'listings': 'listings.Listing',
+    'realtors': 'realtors.Realtor',
+    'contacts': 'contacts.Contact',
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+LOOKUPS = {'exact', 'iexact', 'contains', 'icontains', 'startswith', 'istartswith',
+           'gt', 'gte', 'lt', 'lte', 'in', 'isnull'}
+
+# Bytes buffered before a chunk is yielded.
+BUFFER_SIZE = 64 * 1024
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def chunk_size():
+    """Rows fetched from the database per round trip."""
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def get_model(dataset):
+    try:
+        return apps.get_model(DATASETS[dataset])
+    except KeyError:
+        raise ValueError(f"Unknown dataset {dataset!r}; expected one of {', '.join(DATASETS)}.")
+
+
+def field_names(model):
+    """Column names of ``model`` in declaration order (``attname``, so ``realtor_id``)."""
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def parse_fields(model, value):
+    """The comma-separated ``value`` as a list of field names, or all of them."""
+    available = field_names(model)
+    if not value:
+        return available
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}.")
+    return fields
+
+
+def parse_filters(model, params):
+    """``filter()`` keyword arguments from ``{'field__lookup': value}`` strings."""
+    available = set(field_names(model))
+    filters = {}
+    for key, value in params.items():
+        name, _, lookup = key.partition('__')
+        lookup = lookup or 'exact'
+        if name not in available or lookup not in LOOKUPS:
+            raise ValueError(f"Unsupported filter {key!r}.")
+        if lookup == 'in':
+            value = [item.strip() for item in value.split(',')]
+        elif lookup == 'isnull':
+            value = value.strip().lower() in {'1', 'true', 'yes'}
+        filters[f'{name}__{lookup}'] = value
+    return filters
+
+
+def export_rows(dataset, fields=None, filters=None):
+    """``(fields, rows)``: the selected columns and a streaming iterator over them, in id order."""
+    model = get_model(dataset)
+    fields = parse_fields(model, fields)
+    try:
+        queryset = model._default_manager.filter(**parse_filters(model, filters or {}))
+    except ValidationError as e:
+        raise ValueError(' '.join(e.messages))
+    rows = queryset.order_by('pk').values_list(*fields).iterator(chunk_size=chunk_size())
+    return fields, rows
+
+
+def _buffered(write_row, buffer, rows):
+    for row in rows:
+        write_row(row)
+        if buffer.tell() >= BUFFER_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_csv(fields, rows):
+    """Yield a CSV document (header line first) as a sequence of strings."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield from _buffered(writer.writerow, buffer, rows)
+
+
+def stream_ndjson(fields, rows):
+    """Yield one JSON object per row, newline-delimited, as a sequence of strings."""
+    buffer = io.StringIO()
+
+    def write_row(row):
+        buffer.write(_encoder.encode(dict(zip(fields, row))))
+        buffer.write('\n')
+
+    yield from _buffered(write_row, buffer, rows)
+
+
+def stream(fmt, fields, rows):
+    if fmt == 'csv':
+        return stream_csv(fields, rows)
+    if fmt == 'ndjson':
+        return stream_ndjson(fields, rows)
+    raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}.")
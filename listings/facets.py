@@ -0,0 +1,148 @@
+"""Result counts for the search form filters.
+
+For the current filter set the search page shows how many published
+listings there are per city, state, property type, bedroom choice and
+price choice. They are counted over the in-memory read model when it is
+enabled (see ``readmodel``); otherwise they all come from one ``GROUP BY``
+over ``(city, state, property_type, bedrooms, price bucket)`` whose few
+hundred groups are rolled up into the individual facets in Python, instead
+of running one ``COUNT`` per facet value.
+
+Bedrooms and price are "at most" filters (``bedrooms__lte``,
+``price__lte``), so their counts are cumulative: the count next to "3"
+is the number of listings with up to three bedrooms.
+
+Each facet is counted with every filter but its own (disjunctive
+faceting), so the counts tell what picking another value would give:
+with ``bedrooms=1`` the bedroom options still count the listings with
+two or three bedrooms. A filtered facet costs one more counting pass.
+
+Results are cached per filter fingerprint in the shared ``pages`` cache,
+under the version of the ``facets`` tag (see ``pagecache``), which the
+Listing signals bump on every save or delete.
+"""
+import hashlib
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from . import readmodel
+from .choices import PRICE_BOUNDS, bedroom_choices, price_choices, state_choices
+from .models import Listing
+from .pagecache import invalidate_tags, page_cache, tag_versions
+from .queries import FILTER_PARAMS, filter_fingerprint, filter_listings
+
+FACETS_TAG = 'facets'
+
+# Facets whose values are also a search filter of the same name.
+FILTERED_FACETS = ('city', 'state', 'bedrooms', 'price')
+
+def facets_timeout():
+    return getattr(settings, 'SEARCH_FACETS_TIMEOUT', 300)
+
+
+def _price_bucket():
+    """Index of the smallest price choice the listing fits under."""
+    return Case(
+        *[When(price__lte=bound, then=Value(i)) for i, bound in enumerate(PRICE_BOUNDS)],
+        default=Value(len(PRICE_BOUNDS)),
+        output_field=IntegerField(),
+    )
+
+
+def facet_groups(params):
+    """``(city, state, property_type, bedrooms, price_bucket, count)`` rows."""
+    queryset = filter_listings(Listing.objects.filter(is_published=True), params, rank=False)
+    return (
+        queryset.order_by()
+        .annotate(price_bucket=_price_bucket())
+        .values_list('city', 'state', 'property_type', 'bedrooms', 'price_bucket')
+        .annotate(count=Count('id'))
+    )
+
+
+def _values(counter, spellings):
+    return [(spellings[key], count) for key, count in counter.most_common() if key]
+
+
+def _cumulative(counter, choices):
+    """``(key, label, count)`` per choice, counting every value up to the key."""
+    options = []
+    for key, label in choices.items():
+        bound = int(key)
+        options.append((key, label, sum(count for value, count in counter.items() if value <= bound)))
+    return options
+
+
+def _group_counts(params):
+    """Fold the ``facet_groups()`` rows into per-facet counters."""
+    cities, states, types = Counter(), Counter(), Counter()
+    bedrooms, prices = Counter(), Counter()
+    spellings = {}
+    total = 0
+    for city, state, property_type, beds, bucket, count in facet_groups(params):
+        total += count
+        # city and state filters are case-insensitive; so are their facets.
+        for counter, value in ((cities, city), (states, state), (types, property_type)):
+            key = (value or '').strip().lower()
+            if key:
+                counter[key] += count
+                spellings.setdefault(key, value.strip())
+        bedrooms[beds] += count
+        if bucket < len(PRICE_BOUNDS):
+            prices[PRICE_BOUNDS[bucket]] += count
+    return {
+        'total': total,
+        'city': cities,
+        'state': states,
+        'property_type': types,
+        'spellings': spellings,
+        'bedrooms': bedrooms,
+        'price': prices,
+    }
+
+
+def _counts(params):
+    if readmodel.is_enabled():
+        return readmodel.get_model().facet_counts(params)
+    return _group_counts(params)
+
+
+def compute_facets(params):
+    counts = _counts(params)
+    spellings = counts['spellings']
+    for field in FILTERED_FACETS:
+        if params.get(field):
+            others = _counts({name: params.get(name) for name in FILTER_PARAMS if name != field})
+            counts[field] = others[field]
+            spellings.update(others['spellings'])
+    states = counts['state']
+    # The state filter matches the choice key, so that is what is counted.
+    state_options = [(key, label, states.get(key.lower(), 0)) for key, label in state_choices.items()]
+    return {
+        'total': counts['total'],
+        'city': _values(counts['city'], spellings),
+        'state': _values(states, spellings),
+        'property_type': _values(counts['property_type'], spellings),
+        'state_options': state_options,
+        'bedroom_options': _cumulative(counts['bedrooms'], bedroom_choices),
+        'price_options': _cumulative(counts['price'], price_choices),
+    }
+
+
+def invalidate_facets():
+    invalidate_tags(FACETS_TAG)
+
+
+def search_facets(params):
+    """Facet counts for the filters in ``params``, cached by fingerprint."""
+    digest = hashlib.md5(filter_fingerprint(params).encode()).hexdigest()
+    version, = tag_versions([FACETS_TAG])
+    key = f'listings:facets:{version}:{readmodel.version()}:{digest}'
+    cache = page_cache()
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(params)
+        cache.set(key, facets, facets_timeout())
+    return facets
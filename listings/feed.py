@@ -0,0 +1,45 @@
+"""Bounded "latest listings" feed for the homepage.
+
+The homepage used to render every published listing. It now shows the
+newest ``HOMEPAGE_FEED_SIZE`` listings; the list is cached, and
+``pages/index.html`` caches the rendered cards per language on top of it.
+Both live in the shared ``pages`` cache under the version of the ``feed``
+tag (see ``pagecache``), which the Listing signals bump whenever a listing
+is saved or deleted, so every worker drops them at once and the homepage
+costs the same at any catalogue size.
+"""
+from django.conf import settings
+
+from .pagecache import fragment_version, invalidate_tags, page_cache
+from .queries import published_listings
+
+FEED_CACHE_KEY = 'listings:homepage_feed:%s'
+FEED_TAG = 'feed'
+
+
+def feed_size():
+    return getattr(settings, 'HOMEPAGE_FEED_SIZE', 6)
+
+
+def feed_timeout():
+    return getattr(settings, 'HOMEPAGE_FEED_TIMEOUT', 300)
+
+
+def feed_version():
+    """Part of the feed's cache keys, including the ``homepage_feed`` fragment's."""
+    return fragment_version(FEED_TAG)
+
+
+def homepage_feed():
+    """The newest published listings, at most ``HOMEPAGE_FEED_SIZE`` of them."""
+    cache = page_cache()
+    key = FEED_CACHE_KEY % feed_version()
+    listings = cache.get(key)
+    if listings is None:
+        listings = list(published_listings().prefetch_related('photos')[:feed_size()])
+        cache.set(key, listings, feed_timeout())
+    return listings
+
+
+def invalidate_feed():
+    invalidate_tags(FEED_TAG)
@@ -0,0 +1,223 @@
+"""Full-text index over Listing title, description, address and city.
+
+The index lives in a side table, ``listings_listing_fts``, so the Listing
+schema stays the same on every backend:
+
+* SQLite (the default ``db.sqlite3``) uses an FTS5 virtual table whose
+  rowid is the listing id and ranks with ``bm25()``.
+* PostgreSQL (when ``DATABASE_URL`` is set) uses a plain table holding a
+  weighted ``tsvector`` behind a GIN index and ranks with ``ts_rank()``.
+
+Any other backend falls back to ``icontains`` over the same fields.
+The table is created by migration ``0003_listing_fulltext`` and kept in sync
+by the Listing signals in ``listings/signals.py``.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+FTS_TABLE = 'listings_listing_fts'
+FTS_FIELDS = ('title', 'description', 'address', 'city')
+
+# Postgres weights per field; title and city matter more than body text.
+_PG_WEIGHTS = {'title': 'A', 'city': 'B', 'address': 'B', 'description': 'C'}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported(conn=None):
+    conn = conn or connection
+    return conn.vendor in ('sqlite', 'postgresql')
+
+
+def tokenize(keywords):
+    return _TOKEN_RE.findall(keywords or '')
+
+
+# --- Schema ---------------------------------------------------------------
+
+def create_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{', '.join(FTS_FIELDS)}, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        elif conn.vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {FTS_TABLE} ("
+                "listing_id integer PRIMARY KEY, document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {FTS_TABLE}_document_gin "
+                f"ON {FTS_TABLE} USING GIN (document)"
+            )
+
+
+def drop_index(conn=None):
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+# --- Sync -----------------------------------------------------------------
+
+def _pg_document_sql():
+    parts = [
+        f"setweight(to_tsvector('simple', coalesce(%s, '')), '{_PG_WEIGHTS[field]}')"
+        for field in FTS_FIELDS
+    ]
+    return ' || '.join(parts)
+
+
+def _values(listing):
+    return [getattr(listing, field) or '' for field in FTS_FIELDS]
+
+
+def index_listing(listing, conn=None):
+    """Insert or replace the index row for a single listing."""
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [listing.pk])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_FIELDS)}) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [listing.pk] + _values(listing),
+            )
+        else:
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (listing_id, document) "
+                f"VALUES (%s, {_pg_document_sql()}) "
+                "ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document",
+                [listing.pk] + _values(listing),
+            )
+
+
+def index_listings(listings, conn=None):
+    """Insert or replace the index rows of many listings in a few statements."""
+    conn = conn or connection
+    if not is_supported(conn) or not listings:
+        return
+    rows = [[listing.pk] + _values(listing) for listing in listings]
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            for start in range(0, len(rows), 500):
+                ids = [row[0] for row in rows[start:start + 500]]
+                cursor.execute(
+                    f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(ids))})", ids,
+                )
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_FIELDS)}) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (listing_id, document) "
+                f"VALUES (%s, {_pg_document_sql()}) "
+                "ON CONFLICT (listing_id) DO UPDATE SET document = EXCLUDED.document",
+                rows,
+            )
+
+
+def unindex_listing(listing_id, conn=None):
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    column = 'rowid' if conn.vendor == 'sqlite' else 'listing_id'
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE {column} = %s", [listing_id])
+
+
+def rebuild_index(conn=None, listing_model=None):
+    """Repopulate the whole index from the Listing table in one statement."""
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    table = listing_model._meta.db_table if listing_model else 'listings_listing'
+    columns = ', '.join(FTS_FIELDS)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, {columns}) "
+                f"SELECT id, {columns} FROM {table}"
+            )
+        else:
+            document = ' || '.join(
+                f"setweight(to_tsvector('simple', coalesce({field}, '')), '{_PG_WEIGHTS[field]}')"
+                for field in FTS_FIELDS
+            )
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (listing_id, document) "
+                f"SELECT id, {document} FROM {table}"
+            )
+
+
+# --- Querying -------------------------------------------------------------
+
+def _sqlite_match(tokens):
+    # Quote every token so user input can never be parsed as FTS5 syntax,
+    # and allow prefix matches so "pool" finds "pools".
+    return ' '.join('"%s"*' % token.replace('"', '""') for token in tokens)
+
+
+def _pg_query(tokens):
+    return ' & '.join('%s:*' % token for token in tokens)
+
+
+def filter_queryset(queryset, keywords, rank=True):
+    """Restrict ``queryset`` to listings matching ``keywords``.
+
+    When ``rank`` is true the queryset is annotated with ``search_rank``
+    (lower is better on every backend) and ordered by it, best match first.
+    """
+    tokens = tokenize(keywords)
+    if not tokens:
+        return queryset
+
+    conn = connection
+    if not is_supported(conn):
+        q = Q()
+        for token in tokens:
+            token_q = Q()
+            for field in FTS_FIELDS:
+                token_q |= Q(**{f'{field}__icontains': token})
+            q &= token_q
+        return queryset.filter(q)
+
+    # Join the index table in directly: the engine drives the query from
+    # the MATCH and scores every hit in a single pass, instead of a
+    # correlated rank lookup per row.
+    table = queryset.model._meta.db_table
+    if conn.vendor == 'sqlite':
+        match = _sqlite_match(tokens)
+        where = [f"{FTS_TABLE} MATCH %s", f"{FTS_TABLE}.rowid = {table}.id"]
+        rank_sql = f"bm25({FTS_TABLE}, 10.0, 1.0, 4.0, 6.0)"
+    else:
+        match = _pg_query(tokens)
+        where = [
+            f"{FTS_TABLE}.document @@ to_tsquery('simple', %s)",
+            f"{FTS_TABLE}.listing_id = {table}.id",
+        ]
+        rank_sql = f"-ts_rank({FTS_TABLE}.document, to_tsquery('simple', %s))"
+
+    if not rank:
+        return queryset.extra(tables=[FTS_TABLE], where=where, params=[match])
+
+    order_by = ['search_rank', *queryset.query.order_by]
+    return queryset.extra(
+        select={'search_rank': rank_sql},
+        select_params=[match] if conn.vendor == 'postgresql' else [],
+        tables=[FTS_TABLE],
+        where=where,
+        params=[match],
+    ).order_by(*order_by)
@@ -0,0 +1,143 @@
+"""Persistent geocode cache keyed by normalized address.
+
+Every geocoder answer is stored in ``GeocodeCacheEntry`` under the SHA-1 of
+the normalized address, including "not found" answers (no coordinates),
+so listings at the same address, units in the same building, re-imports
+and address edits that are reverted cost no geocoder calls. Normalizing
+folds case, accents and punctuation, expands common street abbreviations
+and drops unit designators ("Apt 4B", "Suite 300", "Floor 2", "Daire 5",
+"#12"), which locate a unit within a building rather than the building.
+"Fl" is not one of them: it is as often Florida as a floor, and dropping it
+would take the zipcode after it along.
+
+Found addresses are kept for ``GEOCODE_CACHE_TTL`` seconds and "not
+found" answers for the shorter ``GEOCODE_CACHE_NEGATIVE_TTL``, since
+the geocoder's data improves over time. Each entry counts its hits, which
+the ``geocode_cache`` command sums up.
+"""
+import hashlib
+import re
+import unicodedata
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import GeocodeCacheEntry
+
+# Cached answer for "the geocoder does not know this address".
+NOT_FOUND = object()
+
+# Unit designators and the token that follows them.
+_UNIT_RE = re.compile(
+    r'(?:\b(?:apt|apartment|unit|suite|ste|flat|room|rm|floor|daire|kat)\b\.?\s*(?:no\b\.?)?\s*:?\s*|#\s*)[\w-]+',
+)
+
+_ABBREVIATIONS = {
+    'st': 'street',
+    'str': 'street',
+    'rd': 'road',
+    'ave': 'avenue',
+    'av': 'avenue',
+    'blvd': 'boulevard',
+    'dr': 'drive',
+    'ln': 'lane',
+    'cres': 'crescent',
+    'cl': 'close',
+    'hwy': 'highway',
+    'cad': 'caddesi',
+    'cd': 'caddesi',
+    'sk': 'sokak',
+    'sok': 'sokak',
+    'mah': 'mahallesi',
+    'mh': 'mahallesi',
+}
+
+# Letters NFKD does not decompose into an ASCII base letter.
+_TRANSLITERATIONS = str.maketrans({
+    'ı': 'i', 'İ': 'I', 'ø': 'o', 'Ø': 'O', 'ß': 'ss', 'æ': 'ae', 'Æ': 'AE', 'đ': 'd', 'Đ': 'D', 'ł': 'l', 'Ł': 'L',
+})
+
+def cache_ttl():
+    return getattr(settings, 'GEOCODE_CACHE_TTL', 90 * 24 * 3600)
+
+
+def negative_ttl():
+    return getattr(settings, 'GEOCODE_CACHE_NEGATIVE_TTL', 7 * 24 * 3600)
+
+
+def normalize(address):
+    """The form of ``address`` that equivalent spellings share."""
+    text = unicodedata.normalize('NFKD', address.translate(_TRANSLITERATIONS))
+    text = text.encode('ascii', 'ignore').decode().lower()
+    text = _UNIT_RE.sub(' ', text)
+    tokens = re.findall(r'[a-z0-9]+', text)
+    return ' '.join(_ABBREVIATIONS.get(token, token) for token in tokens)
+
+
+def cache_key(address):
+    return hashlib.sha1(normalize(address).encode()).hexdigest()
+
+
+def lookup_many(addresses):
+    """``{address: (lat, lng) or NOT_FOUND}`` for the cached, unexpired ``addresses``.
+
+    Addresses missing from the result are cache misses.
+    """
+    keys = {}
+    for address in addresses:
+        keys.setdefault(cache_key(address), []).append(address)
+    if not keys:
+        return {}
+    entries = GeocodeCacheEntry.objects.filter(
+        key__in=list(keys), expires_at__gt=timezone.now(),
+    ).values_list('key', 'latitude', 'longitude')
+
+    found = {}
+    hit_keys = {}
+    for key, latitude, longitude in entries:
+        answer = NOT_FOUND if latitude is None or longitude is None else (latitude, longitude)
+        for address in keys[key]:
+            found[address] = answer
+        hit_keys.setdefault(len(keys[key]), []).append(key)
+    for hits, hit_group in hit_keys.items():
+        GeocodeCacheEntry.objects.filter(key__in=hit_group).update(hits=F('hits') + hits)
+    return found
+
+
+def lookup(address):
+    """``(lat, lng)``, ``NOT_FOUND``, or None on a cache miss."""
+    return lookup_many([address]).get(address)
+
+
+def store_many(answers):
+    """Cache ``{address: (lat, lng) or None}`` geocoder answers."""
+    if not answers:
+        return
+    now = timezone.now()
+    entries = {}
+    for address, coordinates in answers.items():
+        ttl = cache_ttl() if coordinates else negative_ttl()
+        latitude, longitude = coordinates or (None, None)
+        key = cache_key(address)
+        entries[key] = GeocodeCacheEntry(
+            key=key, address=normalize(address), latitude=latitude, longitude=longitude,
+            fetched_at=now, expires_at=now + timedelta(seconds=ttl),
+        )
+    GeocodeCacheEntry.objects.bulk_create(
+        entries.values(),
+        update_conflicts=True,
+        unique_fields=['key'],
+        update_fields=['address', 'latitude', 'longitude', 'fetched_at', 'expires_at'],
+    )
+
+
+def store(address, coordinates):
+    store_many({address: coordinates})
+
+
+def purge_expired():
+    """Delete the expired entries; returns how many there were."""
+    deleted, _ = GeocodeCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,381 @@
+"""Address geocoding: pluggable backends and the batched geocode pipeline.
+
+A backend turns an address string into ``(latitude, longitude)``, or None
+when the address is unknown, and raises ``GeocodingError`` for failures
+worth retrying. ``GEOCODER_BACKEND`` names it, either by alias (see
+``BACKENDS``) or by dotted path, with ``GEOCODER_OPTIONS`` passed to its
+constructor:
+
+* ``nominatim``: OpenStreetMap's Nominatim through geopy (the default);
+* ``stub``: any server speaking Nominatim's ``/search`` JSON, such as the
+  ``geocode_stub_server`` command, for exercising the pipeline locally.
+
+Lookups go through the persistent geocode cache first (see ``geocache``).
+
+``geocode_pipeline()`` runs a backend from a thread pool. One shared
+``RateLimiter`` spaces the requests of all workers (Nominatim's usage
+policy allows one request per second), results are written with
+``bulk_update`` in batches, and after every batch the highest processed
+listing id is written to a checkpoint file so an interrupted run can
+resume where it stopped.
+"""
+import collections
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import geocache, jobs, readmodel, similar, spatial, tiles
+from .clustering import invalidate_clusters
+from .facets import invalidate_facets
+from .models import ADDRESS_FIELDS, Listing
+from .pagecache import invalidate_tags
+
+try:
+    from geopy.exc import GeocoderServiceError, GeocoderTimedOut
+    from geopy.geocoders import Nominatim
+except ImportError:
+    Nominatim = None
+
+BACKENDS = {
+    'nominatim': 'listings.geocoding.NominatimBackend',
+    'stub': 'listings.geocoding.StubBackend',
+}
+
+
+class GeocodingError(Exception):
+    """A failed lookup (timeout, service error) that may succeed if retried."""
+
+
+def geocoder_rate():
+    """Requests per second across all workers."""
+    return getattr(settings, 'GEOCODER_RATE', 1.0)
+
+
+def full_address(listing, country=''):
+    parts = [listing.address, listing.city, listing.state, listing.zipcode]
+    if country:
+        parts.append(country)
+    return ', '.join(part for part in parts if part)
+
+
+# --- Backends -------------------------------------------------------------
+
+class NominatimBackend:
+
+    def __init__(self, user_agent='coralcity_geocoder', domain=None, scheme=None, timeout=10):
+        if Nominatim is None:
+            raise ImproperlyConfigured('geopy is not installed. Install it with "pip install geopy".')
+        kwargs = {'user_agent': user_agent, 'timeout': timeout}
+        if domain:
+            kwargs['domain'] = domain
+        if scheme:
+            kwargs['scheme'] = scheme
+        self.geolocator = Nominatim(**kwargs)
+
+    def geocode(self, query):
+        try:
+            location = self.geolocator.geocode(query)
+        except (GeocoderTimedOut, GeocoderServiceError) as e:
+            raise GeocodingError(str(e)) from e
+        if location is None:
+            return None
+        return location.latitude, location.longitude
+
+
+class StubBackend:
+    """Queries a Nominatim-compatible ``/search`` endpoint with the standard library."""
+
+    def __init__(self, url='http://127.0.0.1:8765', timeout=10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def geocode(self, query):
+        url = f"{self.url}/search?{urlencode({'q': query, 'format': 'json', 'limit': 1})}"
+        try:
+            with urlopen(url, timeout=self.timeout) as response:
+                results = json.load(response)
+        except (URLError, OSError, ValueError) as e:
+            raise GeocodingError(str(e)) from e
+        if not results:
+            return None
+        return float(results[0]['lat']), float(results[0]['lon'])
+
+
+def get_backend(name=None, **options):
+    """Instantiate the backend ``name`` (alias or dotted path), or the configured one."""
+    if name is None:
+        name = getattr(settings, 'GEOCODER_BACKEND', 'nominatim')
+        options = {**getattr(settings, 'GEOCODER_OPTIONS', {}), **options}
+    return import_string(BACKENDS.get(name, name))(**options)
+
+
+def geocode(query, backend=None, limiter=None):
+    """Coordinates of ``query`` from the geocode cache, else from ``backend``.
+
+    The backend (the configured one by default) is only created, and
+    ``limiter`` only waited on, on a cache miss; the answer, found or not,
+    is cached. ``GeocodingError`` is raised and not cached.
+    """
+    answer = geocache.lookup(query)
+    if answer is geocache.NOT_FOUND:
+        return None
+    if answer is not None:
+        return answer
+    if limiter is not None:
+        limiter.wait()
+    coordinates = (backend or get_backend()).geocode(query)
+    geocache.store(query, coordinates)
+    return coordinates
+
+
+# --- Rate limiting and retries --------------------------------------------
+
+class RateLimiter:
+    """Hands out request slots at most ``rate`` per second, shared by all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def geocode_with_retries(backend, query, limiter, retries=2):
+    """``backend.geocode(query)``, retrying ``GeocodingError`` with backoff."""
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return backend.geocode(query)
+        except GeocodingError:
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+
+
+# --- Writing results ------------------------------------------------------
+
+def coordinates_updated(listings):
+    """Refresh what ``update()``/``bulk_update()`` of coordinates bypassed.
+
+    The post_save handlers are not run by either, so the spatial index,
+    the in-memory indexes and the map and page caches are updated here.
+    The map tiles at both the old position (still the loaded value) and the
+    new one are dropped. A batch rebuilds the in-memory indexes once rather
+    than patching them listing by listing.
+    """
+    if not listings:
+        return
+    spatial.index_listings(listings)
+    if len(listings) == 1:
+        similar.listing_changed(listings[0])
+        readmodel.listing_changed(listings[0])
+    else:
+        similar.invalidate()
+        readmodel.invalidate()
+    points = []
+    for listing in listings:
+        points.append((listing.loaded_value('latitude'), listing.loaded_value('longitude')))
+        points.append((listing.latitude, listing.longitude))
+    tiles.invalidate_points(points)
+    invalidate_clusters()
+    invalidate_facets()
+    invalidate_tags('listings', *['listing:%s' % listing.pk for listing in listings])
+
+
+def save_coordinates(listings):
+    """Write the new coordinates of ``listings`` in one ``bulk_update``."""
+    now = timezone.now()
+    for listing in listings:
+        listing.updated_at = now
+    Listing.objects.bulk_update(listings, ['latitude', 'longitude', 'updated_at'])
+    coordinates_updated(listings)
+
+
+# --- Background job -------------------------------------------------------
+
+# Shared by the run_workers threads of this process.
+_job_limiter = None
+_job_limiter_lock = threading.Lock()
+
+
+def job_limiter():
+    global _job_limiter
+    with _job_limiter_lock:
+        if _job_limiter is None:
+            _job_limiter = RateLimiter(geocoder_rate())
+        return _job_limiter
+
+
+
+@jobs.task('geocode_listing')
+def geocode_listing(listing_id):
+    """Geocode one listing that has no coordinates (queued by the Listing signals)."""
+    listing = Listing.objects.filter(pk=listing_id).first()
+    if listing is None or (listing.latitude is not None and listing.longitude is not None):
+        return
+    if not any(getattr(listing, field) for field in ADDRESS_FIELDS):
+        return
+    coordinates = geocode(full_address(listing), limiter=job_limiter())
+    if coordinates is None:
+        return
+    # Only if the address is still the one just geocoded and nobody set
+    # coordinates meanwhile.
+    updated_at = timezone.now()
+    updated = Listing.objects.filter(
+        pk=listing.pk, latitude__isnull=True,
+        **{field: getattr(listing, field) for field in ADDRESS_FIELDS},
+    ).update(latitude=coordinates[0], longitude=coordinates[1], updated_at=updated_at)
+    if updated:
+        listing.latitude, listing.longitude = coordinates
+        listing.updated_at = updated_at
+        coordinates_updated([listing])
+
+
+# --- Checkpoints ----------------------------------------------------------
+
+def read_checkpoint(path):
+    """The last listing id processed by an earlier run, or 0."""
+    try:
+        with open(path) as f:
+            return int(json.load(f)['last_id'])
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, last_id):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'last_id': last_id}, f)
+    os.replace(tmp_path, path)
+
+
+# --- Pipeline -------------------------------------------------------------
+
+Stats = collections.namedtuple('Stats', 'processed geocoded not_found failed cache_hits lookups elapsed')
+
+
+def _with_cached_answers(listings, country, chunk_size):
+    """``(listing, query, cached answer or None)``, consulting the cache a chunk at a time."""
+    chunk = []
+    for listing in itertools.chain(listings, [None]):
+        if listing is not None:
+            chunk.append(listing)
+            if len(chunk) < chunk_size:
+                continue
+        queries = [full_address(item, country) for item in chunk]
+        cached = geocache.lookup_many(queries)
+        for item, query in zip(chunk, queries):
+            yield item, query, cached.get(query)
+        chunk = []
+
+
+def _ordered(submit, items, window):
+    """``(item, future)`` in order, with at most ``window`` futures in flight."""
+    pending = collections.deque()
+    for item in items:
+        pending.append((item, submit(item)))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def _resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def geocode_pipeline(queryset, backend, rate=None, workers=4, batch_size=100, country='',
+                     checkpoint=None, retries=2, on_batch=None):
+    """Geocode every listing in ``queryset`` concurrently; returns ``Stats``.
+
+    Listings are processed in id order. Cached answers are used without a
+    request, and listings sharing a normalized address share one lookup.
+    Results are written every ``batch_size`` listings, together with the
+    new cache entries; then ``checkpoint`` (a file path, optional) records
+    the last id handed back and ``on_batch(stats)`` is called. Listings
+    whose lookups fail are left untouched and reported.
+    """
+    limiter = RateLimiter(geocoder_rate() if rate is None else rate)
+    started = time.perf_counter()
+    counts = collections.Counter()
+    batch = []
+    answers = {}
+    in_flight = {}
+    last_id = None
+
+    def lookup(query):
+        try:
+            return geocode_with_retries(backend, query, limiter, retries)
+        except GeocodingError as e:
+            return e
+
+    def submit(item):
+        _listing, query, cached = item
+        if cached is not None:
+            return _resolved(None if cached is geocache.NOT_FOUND else cached)
+        key = geocache.cache_key(query)
+        if key not in in_flight:
+            in_flight[key] = executor.submit(lookup, query)
+            counts['lookups'] += 1
+        return in_flight[key]
+
+    def stats():
+        return Stats(
+            counts['processed'], counts['geocoded'], counts['not_found'], counts['failed'],
+            counts['cache_hits'], counts['lookups'], time.perf_counter() - started,
+        )
+
+    def flush():
+        geocache.store_many(answers)
+        answers.clear()
+        if batch:
+            save_coordinates(batch)
+            batch.clear()
+        if checkpoint and last_id is not None:
+            write_checkpoint(checkpoint, last_id)
+        if on_batch:
+            on_batch(stats())
+
+    listings = queryset.order_by('pk').iterator(chunk_size=batch_size)
+    items = _with_cached_answers(listings, country, batch_size)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for (listing, query, cached), future in _ordered(submit, items, workers * 4):
+            result = future.result()
+            counts['processed'] += 1
+            last_id = listing.pk
+            if cached is not None:
+                counts['cache_hits'] += 1
+            elif not isinstance(result, GeocodingError):
+                answers[query] = result
+            if isinstance(result, GeocodingError):
+                counts['failed'] += 1
+            elif result is None:
+                counts['not_found'] += 1
+            else:
+                listing.latitude, listing.longitude = result
+                batch.append(listing)
+                counts['geocoded'] += 1
+            if counts['processed'] % batch_size == 0:
+                flush()
+        flush()
+    return stats()
@@ -0,0 +1,122 @@
+"""Streaming GeoJSON encoder for the listings map.
+
+``map_data`` used to load full Listing instances (including the large
+``description`` column), resolve seven ImageField URLs per row and build the
+whole FeatureCollection in memory before encoding it. Here the rows come
+from a single ``values_list()`` projection, the photos of each chunk of
+rows from one ``ListingPhoto`` query (with their stored URLs), and the
+collection is written out in chunks so memory stays flat however many
+listings are on the map.
+"""
+import itertools
+import json
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.encoding import filepath_to_uri
+
+from . import thumbnails
+from .images import derivative_name, derivative_widths, has_derivatives, srcset
+from .models import PHOTO_FIELDS, ListingPhoto  # noqa: F401 (PHOTO_FIELDS re-exported)
+
+MAP_FIELDS = (
+    'id', 'title', 'price', 'bedrooms', 'bathrooms', 'city', 'state', 'address',
+    'latitude', 'longitude',
+)
+
+# Features per yielded chunk: large enough to keep per-chunk overhead low,
+# small enough that the first bytes go out immediately.
+CHUNK_SIZE = 500
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def photo_url_builder(storage=default_storage):
+    """Return a function mapping a stored file name to its URL.
+
+    ``FileSystemStorage.url()`` goes through ``urljoin`` for every call,
+    which dominates the cost of a large map response; the base URL is a
+    plain prefix, so join it directly.
+    """
+    if isinstance(storage, FileSystemStorage):
+        base_url = storage.base_url
+        return lambda name: base_url + filepath_to_uri(name).lstrip('/')
+    return storage.url
+
+
+def feature(row, photo_url=None):
+    """Build one GeoJSON feature from a ``map_rows()`` row.
+
+    The row is a ``MAP_FIELDS`` tuple followed by the listing's photos as
+    ``(name, url)`` pairs.
+    """
+    photo_url = photo_url or photo_url_builder()
+    (pk, title, price, bedrooms, bathrooms, city, state, address,
+     latitude, longitude, photos) = row
+    properties = {
+        'id': pk,
+        'title': title,
+        'price': price,
+        'bedrooms': bedrooms,
+        'bathrooms': bathrooms,
+        'city': city,
+        'state': state,
+        'address': address,
+        'url': f'/listings/{pk}/',
+    }
+    photo_names = [name for name, _url in photos]
+    if photo_names:
+        properties['photos'] = [url or photo_url(name) for name, url in photos]
+        # Keep legacy single photo key for backward-compat
+        properties['photo_url'] = properties['photos'][0]
+        # srcsets parallel to ``photos``: the WebP variants, or the
+        # on-demand thumbnails of photos that have none yet.
+        widths = derivative_widths()
+        properties['srcsets'] = [
+            srcset(name, 'webp', photo_url) if has_derivatives(name) else thumbnails.srcset(name, widths)
+            for name in photo_names
+        ]
+        if has_derivatives(photo_names[0]):
+            properties['thumbnail'] = photo_url(derivative_name(photo_names[0], widths[0], 'webp'))
+        elif widths[0] in thumbnails.thumbnail_sizes():
+            properties['thumbnail'] = thumbnails.thumbnail_url(photo_names[0], widths[0])
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+        'properties': properties,
+    }
+
+
+def stream_feature_collection(rows, chunk_size=CHUNK_SIZE):
+    """Yield a FeatureCollection for ``rows`` as a sequence of JSON strings."""
+    yield '{"type":"FeatureCollection","features":['
+    photo_url = photo_url_builder()
+    buffer = []
+    first = True
+    for row in rows:
+        buffer.append(_encoder.encode(feature(row, photo_url)))
+        if len(buffer) >= chunk_size:
+            yield ('' if first else ',') + ','.join(buffer)
+            first = False
+            buffer = []
+    if buffer:
+        yield ('' if first else ',') + ','.join(buffer)
+    yield ']}'
+
+
+def map_rows(queryset, chunk_size=2000):
+    """``MAP_FIELDS`` rows of ``queryset`` plus their photos, read with a server-side cursor.
+
+    The photos of every ``chunk_size`` rows are fetched in one query.
+    """
+    rows = queryset.values_list(*MAP_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        photos = {}
+        for listing_id, name, url in ListingPhoto.objects.filter(
+            listing_id__in=[row[0] for row in chunk],
+        ).order_by('listing_id', 'position', 'id').values_list('listing_id', 'image', 'url'):
+            photos.setdefault(listing_id, []).append((name, url))
+        for row in chunk:
+            yield row + (photos.get(row[0], ()),)
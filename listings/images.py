@@ -0,0 +1,145 @@
+"""Resized WebP and JPEG variants ("derivatives") of listing and realtor photos.
+
+Cards and map popups used to load the full-size uploads. Every photo now
+also gets one variant per width in ``IMAGE_DERIVATIVE_WIDTHS`` and format
+in ``IMAGE_DERIVATIVE_FORMATS``, stored next to the media as::
+
+    derivatives/photos/2025/11/09/house.w640.webp
+
+The name of a variant follows from the name of its original, so templates
+(see the ``listing_images`` tags) and ``map_data`` build ``srcset`` values
+without a query. Variants are written by a ``image_derivatives`` job queued
+when a photo is uploaded, and for existing photos by the
+``build_image_derivatives`` command. Until they exist the original is
+served as before.
+"""
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from . import jobs
+from .models import PHOTO_FIELDS  # noqa: F401 (re-exported)
+from .thumbnails import encode, open_image, resize
+from .feed import invalidate_feed
+from .pagecache import invalidate_tags
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DERIVATIVE_ROOT = 'derivatives'
+
+# How long a "no variants yet" answer is trusted before looking again.
+MISSING_RECHECK = 60
+
+_lock = threading.Lock()
+_available = set()
+_missing = {}
+
+
+def derivative_widths():
+    return tuple(sorted(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (320, 640, 1280))))
+
+
+def derivative_formats():
+    return tuple(getattr(settings, 'IMAGE_DERIVATIVE_FORMATS', ('webp', 'jpeg')))
+
+
+def derivative_quality():
+    return getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80)
+
+
+def derivative_name(name, width, fmt):
+    """Storage name of the ``width`` pixels wide ``fmt`` variant of ``name``."""
+    stem = os.path.splitext(name)[0]
+    extension = 'jpg' if fmt == 'jpeg' else fmt
+    return f'{DERIVATIVE_ROOT}/{stem}.w{width}.{extension}'
+
+
+def has_derivatives(name, storage=default_storage):
+    """Whether the variants of ``name`` were generated (the largest one exists)."""
+    if not name:
+        return False
+    if name in _available:
+        return True
+    checked = _missing.get(name)
+    if checked is not None and time.monotonic() - checked < MISSING_RECHECK:
+        return False
+    exists = storage.exists(derivative_name(name, derivative_widths()[-1], derivative_formats()[-1]))
+    with _lock:
+        if exists:
+            _available.add(name)
+            _missing.pop(name, None)
+        else:
+            _missing[name] = time.monotonic()
+    return exists
+
+
+def srcset(name, fmt='webp', url=None):
+    """``srcset`` value listing every width of the ``fmt`` variants of ``name``."""
+    url = url or default_storage.url
+    return ', '.join(f'{url(derivative_name(name, width, fmt))} {width}w' for width in derivative_widths())
+
+
+def generate_derivatives(name, storage=default_storage, force=False):
+    """Write the missing variants of ``name`` (all of them with ``force``); returns how many.
+
+    Widths above the original's are written at the original size: the
+    browser gets a smaller file than the ``srcset`` promises, never a
+    blown-up one.
+    """
+    if Image is None:
+        raise RuntimeError('Pillow is not installed. Install it with "pip install Pillow".')
+    wanted = [
+        (width, fmt) for width in derivative_widths() for fmt in derivative_formats()
+        if force or not storage.exists(derivative_name(name, width, fmt))
+    ]
+    if not wanted:
+        return 0
+    with storage.open(name, 'rb') as f:
+        original = open_image(f)
+
+    written = 0
+    resized = {}
+    for width, fmt in wanted:
+        if width not in resized:
+            resized[width] = resize(original, width)
+        target = derivative_name(name, width, fmt)
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(encode(resized[width], fmt, derivative_quality())))
+        written += 1
+    with _lock:
+        _available.add(name)
+        _missing.pop(name, None)
+    return written
+
+
+def invalidate_pages(listing_ids=(), realtor_ids=()):
+    """Drop the cached pages, map tiles and feed showing these listings' or realtors' photos."""
+    from . import tiles
+    from .models import Listing
+
+    if listing_ids:
+        tiles.invalidate_points(Listing.objects.filter(pk__in=listing_ids).values_list('latitude', 'longitude'))
+        invalidate_feed()
+        invalidate_tags('listings', *['listing:%s' % pk for pk in listing_ids])
+    if realtor_ids:
+        listing_ids = Listing.objects.filter(realtor_id__in=realtor_ids).values_list('id', flat=True)
+        invalidate_tags('realtors', *['listing:%s' % pk for pk in listing_ids])
+
+
+@jobs.task('image_derivatives')
+def build_derivatives(names, listing_id=None, realtor_id=None):
+    """Generate the variants of freshly uploaded photos and drop the pages showing them."""
+    written = sum(generate_derivatives(name) for name in names if default_storage.exists(name))
+    if written:
+        invalidate_pages(
+            [listing_id] if listing_id is not None else (),
+            [realtor_id] if realtor_id is not None else (),
+        )
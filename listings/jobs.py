@@ -0,0 +1,207 @@
+"""A small job queue stored in the ``Job`` table.
+
+Slow side effects (geocoding, for one) should not run inside a request or
+a ``save()``. They are registered as tasks and queued instead::
+
+    @jobs.task('geocode_listing')
+    def geocode_listing(listing_id):
+        ...
+
+    jobs.enqueue('geocode_listing', key=str(listing.pk), listing_id=listing.pk)
+
+The job row is written in the caller's transaction, so it exists exactly
+when the change that queued it was committed. A non-empty ``key`` keeps at
+most one job of that kind and key waiting; enqueueing again while it waits
+is a no-op.
+
+``run_workers`` runs a pool of worker threads; it is the ``worker``
+process of the Procfile, next to ``web``, and without it nothing is
+geocoded and uploads stay unprocessed. Each thread claims the oldest due
+job with a conditional ``UPDATE`` (so two workers never run the same job,
+on any database), runs it, and deletes it on success. A failing job is
+retried after an exponentially growing delay until ``JOB_MAX_ATTEMPTS``
+and then kept as ``failed`` with its traceback. A job whose worker died is
+queued again once it has been running longer than ``JOB_LOCK_TIMEOUT``.
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+_tasks = {}
+
+
+def max_attempts():
+    return getattr(settings, 'JOB_MAX_ATTEMPTS', 5)
+
+
+def retry_delay():
+    """Seconds before the first retry; doubled for every further attempt."""
+    return getattr(settings, 'JOB_RETRY_DELAY', 30)
+
+
+def lock_timeout():
+    return getattr(settings, 'JOB_LOCK_TIMEOUT', 600)
+
+
+def poll_interval():
+    return getattr(settings, 'JOB_POLL_INTERVAL', 1.0)
+
+
+def worker_count():
+    return getattr(settings, 'JOB_WORKERS', 2)
+
+
+def task(kind):
+    """Register the decorated function as the task run for jobs of ``kind``."""
+    def decorator(func):
+        _tasks[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, key='', delay=0, **payload):
+    """Queue ``kind(**payload)``; returns the job, or None if ``key`` is already waiting."""
+    if kind not in _tasks:
+        raise ValueError(f'Unknown job kind: {kind}')
+    run_at = timezone.now() + timedelta(seconds=delay)
+    try:
+        with transaction.atomic():
+            return Job.objects.create(kind=kind, key=key, payload=payload, run_at=run_at)
+    except IntegrityError:
+        if not key:
+            raise
+        return None
+
+
+def enqueue_many(kind, jobs, batch_size=1000):
+    """Queue ``(key, payload)`` pairs in bulk; keys already waiting are skipped."""
+    if kind not in _tasks:
+        raise ValueError(f'Unknown job kind: {kind}')
+    now = timezone.now()
+    Job.objects.bulk_create(
+        [Job(kind=kind, key=key, payload=payload, run_at=now) for key, payload in jobs],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+
+
+def requeue_stale():
+    """Queue the jobs whose worker stopped without finishing them."""
+    cutoff = timezone.now() - timedelta(seconds=lock_timeout())
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff)
+    requeued = 0
+    for job in stale:
+        try:
+            with transaction.atomic():
+                requeued += Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+                    status=Job.QUEUED, locked_at=None, locked_by='',
+                )
+        except IntegrityError:
+            # The same key was queued again meanwhile; that job covers it.
+            Job.objects.filter(pk=job.pk).delete()
+    return requeued
+
+
+def retry(job):
+    """Queue a failed job again with a fresh set of attempts; True if it was."""
+    try:
+        with transaction.atomic():
+            return bool(Job.objects.filter(pk=job.pk, status=Job.FAILED).update(
+                status=Job.QUEUED, attempts=0, run_at=timezone.now(),
+            ))
+    except IntegrityError:
+        Job.objects.filter(pk=job.pk).delete()
+        return False
+
+
+def claim(worker):
+    """Mark the oldest due job as run by ``worker`` and return it, or None."""
+    candidates = Job.objects.filter(status=Job.QUEUED, run_at__lte=timezone.now()).order_by('run_at', 'id')
+    for pk in candidates.values_list('pk', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, locked_at=timezone.now(), locked_by=worker, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job; True if it succeeded."""
+    func = _tasks.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f'No task registered for job kind {job.kind!r}')
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed on attempt %s', job.pk, job.kind, job.attempts, exc_info=True)
+        if job.attempts >= max_attempts():
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error=error, locked_at=None)
+        else:
+            run_at = timezone.now() + timedelta(seconds=retry_delay() * 2 ** (job.attempts - 1))
+            try:
+                with transaction.atomic():
+                    Job.objects.filter(pk=job.pk).update(
+                        status=Job.QUEUED, run_at=run_at, last_error=error, locked_at=None, locked_by='',
+                    )
+            except IntegrityError:
+                # Queued again while it ran; the newer job will do the work.
+                Job.objects.filter(pk=job.pk).delete()
+        return False
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def worker_name(index):
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
+
+
+def work(worker, stop, burst=False, on_job=None):
+    """Claim and run jobs until ``stop`` is set (or, with ``burst``, the queue is empty)."""
+    while not stop.is_set():
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            requeue_stale()
+            stop.wait(poll_interval())
+            continue
+        succeeded = run_job(job)
+        if on_job:
+            on_job(job, succeeded)
+    connection.close()
+
+
+def run_workers(count=None, burst=False, on_job=None):
+    """Run ``count`` worker threads until interrupted (or, with ``burst``, done)."""
+    stop = threading.Event()
+    requeue_stale()
+    threads = [
+        threading.Thread(target=work, args=(worker_name(i), stop, burst, on_job), daemon=True)
+        for i in range(count or worker_count())
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=0.5)
+    except KeyboardInterrupt:
+        # Let the running jobs finish; nothing new is claimed.
+        stop.set()
+        for thread in threads:
+            thread.join()
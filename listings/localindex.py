@@ -0,0 +1,102 @@
+"""Per-process in-memory indexes kept current by the Listing signals.
+
+An index (the similar-listings matrix, the read model) is built on first
+use in each worker process. When a listing is saved or deleted, the process
+that did it applies the change to its own copy and bumps a counter in the
+``IndexVersion`` table; every other process (web workers, ``run_workers``,
+``import_listings``) notices the new counter value on its next lookup and
+rebuilds from the database. The counter is read at most once every
+``LOCAL_INDEX_CHECK_INTERVAL`` seconds per process, so a change made
+elsewhere shows up after that long at most.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import IndexVersion
+
+
+def check_interval():
+    return getattr(settings, 'LOCAL_INDEX_CHECK_INTERVAL', 1.0)
+
+
+def shared_version(key):
+    """The current value of the counter ``key``; 0 until it is first bumped."""
+    version = IndexVersion.objects.filter(key=key).values_list('version', flat=True).first()
+    return version or 0
+
+
+def bump_version(key):
+    """Increment the counter ``key`` for every process; returns the new value."""
+    with transaction.atomic():
+        if not IndexVersion.objects.filter(key=key).update(version=F('version') + 1):
+            try:
+                with transaction.atomic():
+                    IndexVersion.objects.create(key=key, version=1)
+            except IntegrityError:
+                # Created by another process meanwhile.
+                IndexVersion.objects.filter(key=key).update(version=F('version') + 1)
+        return shared_version(key)
+
+
+class LocalIndex:
+    """Holds one process's copy of an index built by ``build()``."""
+
+    def __init__(self, version_key, build):
+        self.version_key = version_key
+        self.build = build
+        self._index = None
+        self._version = None
+        self._shared = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _shared_version(self):
+        now = time.monotonic()
+        if self._shared is None or now - self._checked >= check_interval():
+            self._shared = shared_version(self.version_key)
+            self._checked = now
+        return self._shared
+
+    def _bump(self):
+        version = bump_version(self.version_key)
+        self._shared = version
+        self._checked = time.monotonic()
+        return version
+
+    def version(self):
+        """The shared version this process's index is built from, or is about to be."""
+        return self._shared_version()
+
+    def get(self):
+        """This process's index, rebuilt if another process changed a listing."""
+        version = self._shared_version()
+        if self._index is None or self._version != version:
+            with self._lock:
+                if self._index is None or self._version != version:
+                    self._index = self.build()
+                    self._version = version
+        return self._index
+
+    def apply(self, change):
+        """Run ``change(index)`` on the local index if it is otherwise current.
+
+        Bumps the shared version either way. If another process changed
+        listings since this index was built, or ``change`` returns False,
+        the index is dropped and rebuilt on the next lookup instead.
+        """
+        previous = self._version
+        version = self._bump()
+        index = self._index
+        if index is None or previous is None or version != previous + 1 or change(index) is False:
+            self._index = None
+            return
+        self._version = version
+
+    def invalidate(self):
+        """Drop every process's copy, e.g. after a bulk write."""
+        self._bump()
+        self._index = None
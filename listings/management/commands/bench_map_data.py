@@ -0,0 +1,152 @@
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import JsonResponse
+from django.test import RequestFactory
+from django.utils import timezone
+
+from listings import geojson
+from listings.models import Listing, ListingPhoto
+from listings.queries import mapped_listings
+from listings.views import map_data
+from realtors.models import Realtor
+
+
+def legacy_map_data(request):
+    """The pre-streaming implementation: full instances, one in-memory JSON body."""
+    features = []
+    for obj in mapped_listings(request.GET):
+        photos = [getattr(obj, field).url for field in geojson.PHOTO_FIELDS if getattr(obj, field)]
+        properties = {
+            "id": obj.id, "title": obj.title, "price": obj.price,
+            "bedrooms": obj.bedrooms, "bathrooms": obj.bathrooms,
+            "city": obj.city, "state": obj.state, "address": obj.address,
+            "url": f"/listings/{obj.id}/",
+        }
+        if photos:
+            properties["photos"] = photos
+            properties["photo_url"] = photos[0]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [obj.longitude, obj.latitude]},
+            "properties": properties,
+        })
+    return JsonResponse({"type": "FeatureCollection", "features": features})
+
+
+def consume(response):
+    """Read the whole body; return (seconds to first chunk, body bytes)."""
+    started = time.perf_counter()
+    if not response.streaming:
+        return 0.0, len(response.content)
+    first_chunk = None
+    size = 0
+    for chunk in response.streaming_content:
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - started
+        size += len(chunk)
+    return first_chunk or 0.0, size
+
+
+def measure(view, request):
+    """Return (seconds to first byte, total seconds, body bytes, peak traced bytes).
+
+    Latency and memory are measured in separate runs because tracemalloc
+    slows allocation-heavy code down several times over.
+    """
+    started = time.perf_counter()
+    response = view(request)
+    built = time.perf_counter() - started
+    first_chunk, size = consume(response)
+    total = time.perf_counter() - started
+
+    tracemalloc.start()
+    consume(view(request))
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return built + first_chunk, total, size, peak
+
+
+def seed_listings(count):
+    """Insert ``count`` synthetic mapped listings around Istanbul."""
+    realtor = Realtor.objects.first() or Realtor.objects.create(
+        name='Benchmark Realtor', photo='photos/benchmark.jpg', phone='0', email='bench@example.com',
+    )
+    rng = random.Random(42)
+    now = timezone.now()
+    description = 'Spacious apartment with sea view. ' * 40
+    batch = []
+    for i in range(count):
+        batch.append(Listing(
+            realtor=realtor,
+            title=f'Benchmark listing {i}',
+            address=f'{i} Benchmark Street',
+            city='Istanbul',
+            state='Istanbul',
+            zipcode='34000',
+            latitude=40.8 + rng.random() * 0.5,
+            longitude=28.6 + rng.random() * 0.8,
+            description=description,
+            price=rng.randrange(1_000_000, 50_000_000),
+            bedrooms=rng.randrange(1, 6),
+            property_type='Apartment',
+            bathrooms=rng.randrange(1, 4),
+            sqft=rng.randrange(500, 3000),
+            lot_size=Decimal('0.0'),
+            list_date=now - timedelta(minutes=i),
+            photo_main=f'photos/2025/11/09/bench_{i}.jpg',
+            photo_1=f'photos/2025/11/09/bench_{i}_1.jpg',
+        ))
+        if len(batch) == 5000:
+            create_listings(batch)
+            batch = []
+    if batch:
+        create_listings(batch)
+
+
+def create_listings(batch):
+    """``bulk_create`` the listings and the ListingPhoto rows their signals would add."""
+    Listing.objects.bulk_create(batch)
+    ListingPhoto.objects.bulk_create([
+        ListingPhoto(
+            listing=listing, image=getattr(listing, field).name, position=position,
+            url=getattr(listing, field).url, field=field,
+        )
+        for listing in batch
+        for position, field in enumerate(geojson.PHOTO_FIELDS) if getattr(listing, field)
+    ])
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark map_data against N synthetic mapped listings. The listings are "
+        "inserted inside a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50000, help='Number of synthetic listings (default 50000).')
+        parser.add_argument('--compare', action='store_true', help='Also measure the legacy instance-based serializer.')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        request = RequestFactory().get('/listings/map-data/')
+
+        with transaction.atomic():
+            seed_listings(count)
+            runs = [('streaming values_list', map_data)]
+            if options['compare']:
+                runs.append(('legacy instances + JsonResponse', legacy_map_data))
+
+            for name, view in runs:
+                first_byte, total, size, peak = measure(view, request)
+                self.stdout.write(
+                    f"{name:32} first byte {first_byte * 1000:8.1f} ms | total {total * 1000:8.1f} ms | "
+                    f"body {size / 1e6:6.2f} MB | peak Python memory {peak / 1e6:7.2f} MB"
+                )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from listings import clustering, facets, readmodel
+from listings.management.commands.bench_map_data import seed_listings
+from listings.queries import mapped_listings, search_listings
+
+# Filter sets measured against both the read model and the database.
+PARAMS = [
+    ('no filters', {}),
+    ('city + price', {'city': 'Istanbul', 'price': '20000000'}),
+    ('bedrooms + price', {'bedrooms': '3', 'price': '10000000'}),
+    ('near 5 km', {'lat': '41.0', 'lng': '29.0', 'radius': '5'}),
+]
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the in-memory listing read model against the database queries "
+        "it replaces, on N synthetic listings inserted in a rolled-back transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help='Number of synthetic listings (default 100000).')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement; the best is reported.')
+
+    def handle(self, *args, **options):
+        if not readmodel.is_enabled():
+            raise CommandError("The read model needs numpy and LISTING_READ_MODEL = True.")
+
+        with transaction.atomic():
+            seed_listings(options['count'])
+
+            started = time.perf_counter()
+            model = readmodel.build_model()
+            built = time.perf_counter() - started
+            self.stdout.write(
+                f"built {len(model)} rows in {built * 1000:.0f} ms | "
+                f"{model.nbytes / 1e6:.1f} MB ({model.nbytes / max(len(model), 1):.0f} bytes per listing)"
+            )
+
+            repeat = options['repeat']
+            for name, params in PARAMS:
+                in_memory = best_of(lambda: model.search_ids(params), repeat)
+                database = best_of(lambda: list(search_listings(params).values_list('id', flat=True)), 3)
+                self.stdout.write(
+                    f"search {name:18} read model {in_memory * 1000:8.2f} ms | database {database * 1000:8.1f} ms"
+                )
+
+            for name, params in PARAMS:
+                in_memory = best_of(lambda: model.facet_counts(params), repeat)
+                database = best_of(lambda: facets._group_counts(params), 3)
+                self.stdout.write(
+                    f"facets {name:18} read model {in_memory * 1000:8.2f} ms | database {database * 1000:8.1f} ms"
+                )
+
+            in_memory = best_of(lambda: model.cluster_features({}, 10), repeat)
+            database = best_of(lambda: clustering.cluster_features(mapped_listings({}), 10), 3)
+            self.stdout.write(
+                f"clusters zoom 10{'':10} read model {in_memory * 1000:8.2f} ms | database {database * 1000:8.1f} ms"
+            )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,61 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from listings import assets
+
+
+class Command(BaseCommand):
+    help = (
+        "Concatenate, minify and fingerprint the CSS/JS bundles (ASSET_BUNDLES) into "
+        "STATIC_ROOT/bundles with gzip (and brotli) copies, for the {% bundle %} tag. "
+        "Run it after collectstatic, so stylesheets point at the hashed static files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bundle', action='append', dest='names', metavar='NAME',
+            help='Build only this bundle (repeatable; default: all).',
+        )
+        parser.add_argument('--clean', action='store_true', help='Delete bundle files the manifest no longer names.')
+
+    def handle(self, *args, **options):
+        available = assets.bundles()
+        names = options['names'] or list(available)
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise CommandError(f"Unknown bundles: {', '.join(unknown)}. Available: {', '.join(available)}.")
+
+        built = {}
+        failed = []
+        for name in names:
+            started = time.perf_counter()
+            try:
+                body = assets.build_bundle(name, available[name])
+            except (assets.AssetError, UnicodeDecodeError) as e:
+                # The {% bundle %} tag keeps including the sources.
+                self.stderr.write(self.style.WARNING(f"{name}: {e}"))
+                failed.append(name)
+                continue
+            sizes = assets.write_bundle(name, body)
+            built[name] = assets.hashed_name(name, body)
+            self.stdout.write(
+                f"{built[name]}: {len(available[name])} files, "
+                + ', '.join(f"{kind} {size / 1024:.1f} KB" for kind, size in sizes.items())
+                + f" ({time.perf_counter() - started:.2f}s)"
+            )
+
+        if built:
+            assets.write_manifest(built)
+        if options['clean']:
+            stale = assets.stale_files()
+            for path in stale:
+                os.remove(path)
+            directory = os.path.join(settings.STATIC_ROOT, assets.BUNDLE_DIR)
+            self.stdout.write(f"Deleted {len(stale)} stale bundle files from {directory}.")
+
+        if failed:
+            raise CommandError(f"{len(built)} bundles built; failed: {', '.join(failed)}.")
+        self.stdout.write(self.style.SUCCESS(f"{len(built)} bundles built."))
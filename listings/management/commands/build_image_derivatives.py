@@ -0,0 +1,68 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from listings import images, tiles
+from listings.feed import invalidate_feed
+from listings.models import ListingPhoto
+from listings.pagecache import invalidate_tags
+from realtors.models import Realtor
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the resized WebP/JPEG variants of every listing and realtor photo "
+        "(IMAGE_DERIVATIVE_WIDTHS x IMAGE_DERIVATIVE_FORMATS). Existing variants are kept "
+        "unless --force is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that already exist.')
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Photos processed concurrently (default 4; Pillow releases the GIL while resizing).',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+        if images.Image is None:
+            raise CommandError('Pillow is not installed. Install it with "pip install Pillow".')
+
+        names = set(ListingPhoto.objects.values_list('image', flat=True).iterator(chunk_size=2000))
+        names.update(name for name in Realtor.objects.values_list('photo', flat=True) if name)
+        names = sorted(names)
+
+        started = time.perf_counter()
+        counts = {'photos': 0, 'written': 0, 'missing': 0, 'failed': 0}
+
+        def build(name):
+            if not default_storage.exists(name):
+                return 'missing', 0
+            try:
+                return 'photos', images.generate_derivatives(name, force=options['force'])
+            except (OSError, ValueError) as e:
+                # Unreadable or truncated upload; report it and carry on.
+                self.stderr.write(self.style.WARNING(f"{name}: {e}"))
+                return 'failed', 0
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for done, (outcome, written) in enumerate(executor.map(build, names), start=1):
+                counts[outcome] += 1
+                counts['written'] += written
+                if options['verbosity'] >= 2 and done % 100 == 0:
+                    self.stdout.write(f"{done}/{len(names)} photos")
+
+        if counts['written']:
+            # Cached pages, cards and map tiles were built without the variants.
+            invalidate_feed()
+            invalidate_tags('listings', 'realtors')
+            tiles.clear_tiles()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['photos']} photos, {counts['written']} variants written in {elapsed:.1f}s; "
+            f"{counts['missing']} missing files, {counts['failed']} unreadable."
+        ))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from listings import tiles
+
+
+class Command(BaseCommand):
+    help = (
+        "Prebuild the map tiles that contain listings, so the first visitor of "
+        "a tile does not pay for building it. Empty tiles are built on demand."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-zoom', type=int, default=None,
+            help='Highest zoom level to build (default MAP_TILE_MAX_ZOOM).',
+        )
+        parser.add_argument('--clear', action='store_true', help='Remove all stored tiles first.')
+
+    def handle(self, *args, **options):
+        max_zoom = options['max_zoom']
+        if max_zoom is None:
+            max_zoom = tiles.tile_max_zoom()
+        if not 0 <= max_zoom <= tiles.tile_max_zoom():
+            raise CommandError(f"--max-zoom must be between 0 and {tiles.tile_max_zoom()}.")
+
+        if options['clear']:
+            tiles.clear_tiles()
+
+        started = time.perf_counter()
+        occupied = tiles.occupied_tiles(max_zoom)
+        for z, x, y in occupied:
+            tiles.write_tile(z, x, y, tiles.build_tile(z, x, y))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {len(occupied)} tiles up to zoom {max_zoom} in {elapsed:.1f}s into {tiles.tile_root()}."
+        ))
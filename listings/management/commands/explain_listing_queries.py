@@ -0,0 +1,89 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from listings import clustering, facets
+from listings.models import Listing
+from listings.pagination import NEXT, KeysetPaginator
+from listings.queries import published_listings, search_listings, mapped_listings
+
+
+# Query shapes issued by the public listing views, with representative
+# search parameters.
+QUERIES = [
+    ('published listings (index, new_properties, pages.index, financing, blog.index)',
+     lambda: published_listings()),
+    ('keyset page (index, new_properties ?cursor=)', lambda: keyset_page_query()),
+    ('search: city', lambda: search_listings({'city': 'Istanbul'})),
+    ('search: state', lambda: search_listings({'state': 'Istanbul'})),
+    ('search: city + price', lambda: search_listings({'city': 'Istanbul', 'price': '1000000'})),
+    ('search: state + price', lambda: search_listings({'state': 'Istanbul', 'price': '1000000'})),
+    ('search: price', lambda: search_listings({'price': '1000000'})),
+    ('search: bedrooms', lambda: search_listings({'bedrooms': '3'})),
+    ('search: keywords', lambda: search_listings({'keywords': 'pool'})),
+    ('search: near', lambda: search_listings({'lat': '41.0', 'lng': '29.0', 'radius': '5'})),
+    ('search: near, sort=distance',
+     lambda: search_listings({'lat': '41.0', 'lng': '29.0', 'radius': '5', 'sort': 'distance'})),
+    ('search facets', lambda: facets.facet_groups({})),
+    ('search facets: city + price', lambda: facets.facet_groups({'city': 'Istanbul', 'price': '1000000'})),
+    ('map_data', lambda: mapped_listings({})),
+    ('map_data: city', lambda: mapped_listings({'city': 'Istanbul'})),
+    ('map_data: bbox', lambda: clustering.filter_bbox(mapped_listings({}), (28.5, 40.8, 29.5, 41.3))),
+    ('map_data: near', lambda: mapped_listings({'lat': '41.0', 'lng': '29.0', 'radius': '5'})),
+    ('map_data: clusters in bbox',
+     lambda: clustering.cluster_rows(clustering.filter_bbox(mapped_listings({}), (28.5, 40.8, 29.5, 41.3)), 10)),
+]
+
+
+def keyset_page_query():
+    key = (timezone.now(), 1, NEXT)
+    return KeysetPaginator(published_listings(), 6).page_queryset(key)
+
+
+def full_scans(plan, vendor, table):
+    """Return the lines of ``plan`` that read ``table`` without an index."""
+    if vendor == 'sqlite':
+        pattern = re.compile(rf'\bSCAN {table}\b(?! USING (COVERING )?INDEX)')
+    elif vendor == 'postgresql':
+        pattern = re.compile(rf'Seq Scan on {table}\b')
+    else:
+        return []
+    return [line.strip() for line in plan.splitlines() if pattern.search(line)]
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the listing view queries and fail if any of them does a full table scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the full plan of every query.')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        table = Listing._meta.db_table
+        if vendor not in ('sqlite', 'postgresql'):
+            self.stderr.write(self.style.WARNING(f"Plan checks are not implemented for '{vendor}'."))
+            return
+
+        if vendor == 'postgresql':
+            # Small tables are cheaper to seq-scan, which would hide a missing
+            # index; make the planner show us the path it would take at scale.
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+        failures = []
+        for name, build in QUERIES:
+            plan = build().explain()
+            scans = full_scans(plan, vendor, table)
+            if options['verbose_plans']:
+                self.stdout.write(f"-- {name}\n{plan}\n")
+            if scans:
+                failures.append(name)
+                self.stderr.write(self.style.ERROR(f"FULL SCAN  {name}: {'; '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok         {name}"))
+
+        if failures:
+            raise CommandError(f"{len(failures)} listing queries fall back to a full scan of {table}.")
+        self.stdout.write(self.style.SUCCESS(f"All {len(QUERIES)} listing queries use an index."))
@@ -0,0 +1,46 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from listings import export
+
+
+class Command(BaseCommand):
+    help = (
+        "Export listings, realtors or contacts as CSV or NDJSON, streamed from the "
+        "database in chunks so memory stays flat for any table size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(export.DATASETS), help='What to export.')
+        parser.add_argument('--format', choices=sorted(export.FORMATS), default='csv', help='Output format (default csv).')
+        parser.add_argument('--fields', default=None, help='Comma-separated field names (default all).')
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='FIELD[__LOOKUP]=VALUE',
+            help='Only export matching rows, e.g. --filter city=Istanbul --filter price__gte=1000000. Repeatable.',
+        )
+        parser.add_argument('--output', '-o', default=None, help='File to write (default stdout).')
+
+    def handle(self, *args, **options):
+        filters = {}
+        for item in options['filter']:
+            key, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f"Filters look like field=value or field__lookup=value, not {item!r}.")
+            filters[key.strip()] = value
+        try:
+            fields, rows = export.export_rows(options['dataset'], options['fields'], filters)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        started = time.perf_counter()
+        output = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for chunk in export.stream(options['format'], fields, rows):
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stderr.write(f"Exported to {options['output']} in {time.perf_counter() - started:.1f}s.")
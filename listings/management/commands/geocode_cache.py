@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from listings import geocache
+from listings.models import GeocodeCacheEntry
+
+
+class Command(BaseCommand):
+    help = "Show geocode cache statistics, or purge expired or all entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purge-expired', action='store_true', help='Delete the expired entries.')
+        parser.add_argument('--clear', action='store_true', help='Delete every entry.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, _ = GeocodeCacheEntry.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} geocode cache entries."))
+            return
+        if options['purge_expired']:
+            self.stdout.write(self.style.SUCCESS(f"Deleted {geocache.purge_expired()} expired entries."))
+
+        totals = GeocodeCacheEntry.objects.aggregate(
+            entries=Count('id'),
+            not_found=Count('id', filter=Q(latitude__isnull=True)),
+            expired=Count('id', filter=Q(expires_at__lte=timezone.now())),
+            hits=Sum('hits'),
+        )
+        entries, hits = totals['entries'], totals['hits'] or 0
+        self.stdout.write(
+            f"{entries} entries ({entries - totals['not_found']} found, {totals['not_found']} not found, "
+            f"{totals['expired']} expired)"
+        )
+        # Every entry stands for one geocoder call; every hit for one saved.
+        lookups = hits + entries
+        self.stdout.write(f"{hits} hits, {entries} misses: {hits / lookups if lookups else 0:.0%} hit rate")
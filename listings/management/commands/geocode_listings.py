@@ -1,66 +1,97 @@
-import time
-from django.core.management.base import BaseCommand
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Q
-from listings.models import Listing
 
-try:
-    from geopy.geocoders import Nominatim
-    from geopy.extra.rate_limiter import RateLimiter
-except Exception:  # geopy may not be installed yet
-    Nominatim = None
-    RateLimiter = None
+from listings import geocoding
+from listings.models import Listing
 
 
 class Command(BaseCommand):
-    help = "Geocode listings without coordinates using Nominatim (OpenStreetMap)."
+    help = (
+        "Geocode listings without coordinates. Lookups run concurrently within a "
+        "global rate limit and are written in batches; use --checkpoint to be able "
+        "to resume an interrupted run."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('--all', action='store_true', help='Geocode all listings (overwrite existing lat/lng).')
         parser.add_argument('--country', default='', help='Optional country to append to queries (e.g., "Nigeria").')
-        parser.add_argument('--sleep', type=float, default=1.1, help='Seconds to sleep between requests (rate limiting).')
+        parser.add_argument(
+            '--backend', default=None,
+            help='Geocoder backend: "nominatim", "stub" or a dotted path (default GEOCODER_BACKEND).',
+        )
+        parser.add_argument(
+            '--url', default=None,
+            help='Server URL for the stub backend (default http://127.0.0.1:8765).',
+        )
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help='Requests per second across all workers (default GEOCODER_RATE, 1.0).',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=None,
+            help='Seconds between requests across all workers; the inverse of --rate.',
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent lookups (default 4).')
+        parser.add_argument('--batch-size', type=int, default=100, help='Listings written per bulk update (default 100).')
+        parser.add_argument('--checkpoint', default=None, help='File recording the last processed listing id.')
+        parser.add_argument('--resume', action='store_true', help='Skip listings up to the id in --checkpoint.')
 
     def handle(self, *args, **options):
-        if Nominatim is None:
-            self.stderr.write(self.style.ERROR('geopy is not installed. Install it with "pip install geopy".'))
-            return
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--workers and --batch-size must be at least 1.")
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError("--resume needs --checkpoint.")
+
+        rate = options['rate']
+        if options['sleep'] is not None:
+            rate = 1.0 / options['sleep'] if options['sleep'] > 0 else 0
+
+        backend_options = {'url': options['url']} if options['url'] else {}
+        try:
+            backend = geocoding.get_backend(options['backend'], **backend_options)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
 
         qs = Listing.objects.all()
         if not options['all']:
             qs = qs.filter(Q(latitude__isnull=True) | Q(longitude__isnull=True))
+        if options['resume']:
+            last_id = geocoding.read_checkpoint(options['checkpoint'])
+            qs = qs.filter(pk__gt=last_id)
+            self.stdout.write(f"Resuming after id={last_id}.")
 
         count = qs.count()
         if count == 0:
             self.stdout.write(self.style.SUCCESS('No listings need geocoding.'))
             return
 
-        geolocator = Nominatim(user_agent='coralcity_geocoder')
-        geocode = RateLimiter(geolocator.geocode, min_delay_seconds=options['sleep'])
-
-        processed = 0
-        for listing in qs.iterator():
-            query = ", ".join(filter(None, [
-                listing.address,
-                listing.city,
-                listing.state,
-                listing.zipcode,
-                options['country'],
-            ]))
-
-            try:
-                location = geocode(query)
-            except Exception as e:
-                self.stderr.write(self.style.WARNING(f"Geocoding error for id={listing.id}: {e}"))
-                continue
-
-            if location is None:
-                self.stderr.write(self.style.WARNING(f"No result for id={listing.id} | query='{query}'"))
-                continue
-
-            listing.latitude = location.latitude
-            listing.longitude = location.longitude
-            listing.save(update_fields=['latitude', 'longitude'])
-            processed += 1
-            self.stdout.write(self.style.SUCCESS(f"Geocoded id={listing.id} -> ({listing.latitude}, {listing.longitude})"))
+        def report(stats):
+            per_second = stats.processed / stats.elapsed if stats.elapsed else 0.0
+            remaining = (count - stats.processed) / per_second if per_second else 0.0
+            self.stdout.write(
+                f"{stats.processed}/{count} processed | {stats.geocoded} geocoded, "
+                f"{stats.not_found} not found, {stats.failed} failed | "
+                f"{stats.cache_hits} cache hits, {stats.lookups} lookups | "
+                f"{per_second:.2f} listings/s | ~{remaining:.0f}s left"
+            )
 
-        self.stdout.write(self.style.SUCCESS(f"Done. Geocoded {processed}/{count} listings."))
+        stats = geocoding.geocode_pipeline(
+            qs, backend,
+            rate=rate,
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            country=options['country'],
+            checkpoint=options['checkpoint'],
+            on_batch=report,
+        )
 
+        if stats.failed:
+            self.stderr.write(self.style.WARNING(
+                f"{stats.failed} lookups failed; run again to retry the listings still missing coordinates."
+            ))
+        per_second = stats.processed / stats.elapsed if stats.elapsed else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. Geocoded {stats.geocoded}/{count} listings in {stats.elapsed:.1f}s ({per_second:.2f} listings/s); "
+            f"{stats.cache_hits} answered from the geocode cache, {stats.lookups} geocoder lookups."
+        ))
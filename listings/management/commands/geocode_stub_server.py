@@ -0,0 +1,77 @@
+import hashlib
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def stub_location(query, bbox, miss_rate):
+    """Deterministic coordinates inside ``bbox`` for ``query``, or None for a simulated miss."""
+    digest = hashlib.sha1(query.strip().lower().encode()).digest()
+    if int.from_bytes(digest[:2], 'big') / 0xFFFF < miss_rate:
+        return None
+    west, south, east, north = bbox
+    x = int.from_bytes(digest[2:6], 'big') / 0xFFFFFFFF
+    y = int.from_bytes(digest[6:10], 'big') / 0xFFFFFFFF
+    return south + y * (north - south), west + x * (east - west)
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local Nominatim-compatible /search endpoint with deterministic "
+        "fake coordinates, for running geocode_listings --backend stub without "
+        "touching the real service."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds each lookup takes (default 0.2).')
+        parser.add_argument('--miss-rate', type=float, default=0.05, help='Share of queries with no result (default 0.05).')
+        parser.add_argument(
+            '--bbox', default='28.5,40.8,29.5,41.3',
+            help='west,south,east,north area the fake coordinates fall in.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            bbox = [float(part) for part in options['bbox'].split(',')]
+        except ValueError:
+            bbox = []
+        if len(bbox) != 4:
+            raise CommandError("--bbox must be west,south,east,north.")
+        latency, miss_rate = options['latency'], options['miss_rate']
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.rstrip('/') != '/search':
+                    self.send_error(404)
+                    return
+                query = parse_qs(url.query).get('q', [''])[0]
+                time.sleep(latency)
+                location = stub_location(query, bbox, miss_rate)
+                results = [] if location is None else [
+                    {'lat': str(location[0]), 'lon': str(location[1]), 'display_name': query},
+                ]
+                body = json.dumps(results).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((options['host'], options['port']), Handler)
+        self.stdout.write(f"Stub geocoder listening on http://{options['host']}:{options['port']}/search")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
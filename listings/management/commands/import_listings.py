@@ -1,10 +1,14 @@
 import csv
+import hashlib
+import time
 from decimal import Decimal, InvalidOperation
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 
-from listings.models import Listing
+from listings.bulk import listings_written
+from listings.models import ADDRESS_FIELDS, Listing
 from realtors.models import Realtor
 
 
@@ -33,8 +37,80 @@ def to_bool(value):
     return s in {"1", "true", "yes", "y"}
 
 
+REQUIRED_HEADERS = [
+    "realtor",
+    "title",
+    "address",
+    "city",
+    "state",
+    "zipcode",
+    "description",
+    "price",
+    "bedrooms",
+    "property_type",
+    "bathrooms",
+    "garage",
+    "sqft",
+    "lot_size",
+    "is_published",
+]
+
+# Fields an existing listing takes from its feed row in --sync mode. The
+# realtor is copied by id: reading ``realtor`` would load it, one query per row.
+SYNC_FIELDS = [
+    "realtor_id",
+    "title",
+    "address",
+    "city",
+    "state",
+    "zipcode",
+    "description",
+    "price",
+    "bedrooms",
+    "property_type",
+    "bathrooms",
+    "garage",
+    "sqft",
+    "lot_size",
+    "is_published",
+    "content_hash",
+]
+
+
+def row_hash(row):
+    """SHA-1 of the imported columns of ``row``; equal rows import to equal listings."""
+    values = "\x1f".join((row.get(h) or "").strip() for h in REQUIRED_HEADERS)
+    return hashlib.sha1(values.encode("utf-8")).hexdigest()
+
+
+def build_listing(row, realtor_id, **extra):
+    return Listing(
+        realtor_id=realtor_id,
+        external_id=(row.get("external_id") or "").strip(),
+        content_hash=row_hash(row),
+        title=(row.get("title") or "").strip(),
+        address=(row.get("address") or "").strip(),
+        city=(row.get("city") or "").strip(),
+        state=(row.get("state") or "").strip(),
+        zipcode=(row.get("zipcode") or "").strip(),
+        description=(row.get("description") or "").strip(),
+        price=to_int(row.get("price"), "price") or 0,
+        bedrooms=to_int(row.get("bedrooms"), "bedrooms") or 0,
+        property_type=(row.get("property_type") or "").strip(),
+        bathrooms=to_int(row.get("bathrooms"), "bathrooms") or 0,
+        garage=to_int(row.get("garage"), "garage") or 0,
+        sqft=to_int(row.get("sqft"), "sqft") or 0,
+        lot_size=to_decimal(row.get("lot_size"), "lot_size") or Decimal("0.0"),
+        is_published=to_bool(row.get("is_published")),
+        **extra,
+    )
+
+
 class Command(BaseCommand):
-    help = "Import listings from a CSV file. Headers must match the sample file."
+    help = (
+        "Import listings from a CSV file. Headers must match the sample file; an optional "
+        "external_id column identifies listings across imports (required by --sync)."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("csv_path", type=str, help="Path to the CSV file")
@@ -43,84 +119,142 @@ class Command(BaseCommand):
             action="store_true",
             help="Validate and show summary without writing to the database",
         )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Insert with bulk_create in batches, skipping per-row signals; "
+                 "indexes are refreshed and geocoding is queued once per batch",
+        )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="Treat the CSV as the full feed: insert new external ids, update the "
+                 "listings whose row changed and unpublish those missing from the feed, "
+                 "in batches. Unchanged rows are not written.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Rows per batch with --bulk or --sync (default 1000)",
+        )
 
     @transaction.atomic
     def handle(self, *args, **options):
         csv_path = options["csv_path"]
         dry_run = options["dry_run"]
+        bulk = options["bulk"]
+        sync = options["sync"]
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        if bulk and sync:
+            raise CommandError("--bulk and --sync cannot be combined")
 
-        required_headers = [
-            "realtor",
-            "title",
-            "address",
-            "city",
-            "state",
-            "zipcode",
-            "description",
-            "price",
-            "bedrooms",
-            "property_type",
-            "bathrooms",
-            "garage",
-            "sqft",
-            "lot_size",
-            "is_published",
-        ]
-
-        created = 0
+        self.verbosity = options["verbosity"]
+        self.dry_run = dry_run
+        self.started = time.perf_counter()
+        self.counts = {"created": 0, "updated": 0, "unchanged": 0, "unpublished": 0}
         skipped = 0
         missing_realtor_rows = []
+        # One query for every realtor id instead of one per row.
+        realtor_ids = set(Realtor.objects.values_list("id", flat=True))
+        self.list_date = timezone.now()
+        # In --sync mode: {external_id: (pk, content_hash)} of the stored
+        # listings, and the external ids found in the feed.
+        known = {}
+        seen = set()
+        if sync:
+            known = {
+                external_id: (pk, content_hash)
+                for external_id, pk, content_hash in Listing.objects.exclude(external_id="").values_list(
+                    "external_id", "pk", "content_hash"
+                )
+            }
+        to_create = []
+        to_update = []
 
         try:
             with open(csv_path, newline="", encoding="utf-8") as f:
                 reader = csv.DictReader(f)
                 headers = reader.fieldnames or []
-                missing_headers = [h for h in required_headers if h not in headers]
+                missing_headers = [h for h in REQUIRED_HEADERS if h not in headers]
+                if sync and "external_id" not in headers:
+                    missing_headers.append("external_id")
                 if missing_headers:
                     raise CommandError(
                         f"CSV is missing required headers: {', '.join(missing_headers)}"
                     )
 
                 for idx, row in enumerate(reader, start=2):  # start=2 to account for header line
+                    if sync:
+                        external_id = (row.get("external_id") or "").strip()
+                        if not external_id:
+                            self.stdout.write(self.style.WARNING(f"Row {idx}: missing external_id, skipping"))
+                            skipped += 1
+                            continue
+                        if external_id in seen:
+                            self.stdout.write(self.style.WARNING(
+                                f"Row {idx}: duplicate external_id {external_id!r}, skipping"
+                            ))
+                            skipped += 1
+                            continue
+                        # Seen even if the row is skipped below, so a bad row
+                        # does not unpublish its listing.
+                        seen.add(external_id)
+
                     realtor_id = to_int(row.get("realtor"), "realtor")
                     if realtor_id is None:
                         self.stdout.write(self.style.WARNING(f"Row {idx}: missing realtor id, skipping"))
                         skipped += 1
                         continue
 
-                    realtor = Realtor.objects.filter(id=realtor_id).first()
-                    if not realtor:
+                    if realtor_id not in realtor_ids:
                         missing_realtor_rows.append(idx)
                         skipped += 1
                         continue
 
-                    listing = Listing(
-                        realtor=realtor,
-                        title=(row.get("title") or "").strip(),
-                        address=(row.get("address") or "").strip(),
-                        city=(row.get("city") or "").strip(),
-                        state=(row.get("state") or "").strip(),
-                        zipcode=(row.get("zipcode") or "").strip(),
-                        description=(row.get("description") or "").strip(),
-                        price=to_int(row.get("price"), "price") or 0,
-                        bedrooms=to_int(row.get("bedrooms"), "bedrooms") or 0,
-                        property_type=(row.get("property_type") or "").strip(),
-                        bathrooms=to_int(row.get("bathrooms"), "bathrooms") or 0,
-                        garage=to_int(row.get("garage"), "garage") or 0,
-                        sqft=to_int(row.get("sqft"), "sqft") or 0,
-                        lot_size=to_decimal(row.get("lot_size"), "lot_size") or Decimal("0.0"),
-                        is_published=to_bool(row.get("is_published")),
-                    )
+                    if sync:
+                        stored = known.get(external_id)
+                        if stored is None:
+                            to_create.append(build_listing(row, realtor_id, list_date=self.list_date))
+                        elif stored[1] != row_hash(row):
+                            to_update.append((stored[0], build_listing(row, realtor_id)))
+                        else:
+                            self.counts["unchanged"] += 1
+                        if len(to_create) + len(to_update) >= batch_size:
+                            self.create_batch(to_create)
+                            self.update_batch(to_update)
+                        continue
+
+                    if bulk:
+                        to_create.append(build_listing(row, realtor_id, list_date=self.list_date))
+                        if len(to_create) >= batch_size:
+                            self.create_batch(to_create)
+                        continue
+
+                    listing = build_listing(row, realtor_id)
 
                     if dry_run:
                         # Validate by attempting to clean fields where applicable
                         pass
                     else:
                         listing.save()
-                        created += 1
+                        self.counts["created"] += 1
+                self.create_batch(to_create)
+                self.update_batch(to_update)
+
+                if sync:
+                    missing = [pk for external_id, (pk, _hash) in known.items() if external_id not in seen]
+                    for start in range(0, len(missing), batch_size):
+                        self.unpublish_batch(missing[start:start + batch_size])
 
         except FileNotFoundError:
             raise CommandError(f"CSV file not found: {csv_path}")
+        except IntegrityError as e:
+            raise CommandError(
+                f"Could not import: {e}. Rows whose external_id is already imported need --sync."
+            )
 
         if dry_run:
             transaction.set_rollback(True)
@@ -132,5 +266,82 @@ class Command(BaseCommand):
                 )
             )
 
-        self.stdout.write(self.style.SUCCESS(f"Created {created} listings. Skipped {skipped} rows."))
+        counts = self.counts
+        elapsed = time.perf_counter() - self.started
+        rows = counts["created"] + counts["updated"] + counts["unchanged"] + skipped
+        rate = rows / elapsed if elapsed else 0.0
+        if sync:
+            summary = (
+                f"Created {counts['created']}, updated {counts['updated']}, "
+                f"unpublished {counts['unpublished']} listings; {counts['unchanged']} unchanged. "
+                f"Skipped {skipped} rows."
+            )
+        else:
+            summary = f"Created {counts['created']} listings. Skipped {skipped} rows."
+        self.stdout.write(self.style.SUCCESS(f"{summary} {elapsed:.1f}s, {rate:.0f} rows/s."))
+
+    def progress(self):
+        if self.verbosity >= 2:
+            counts = self.counts
+            done = counts["created"] + counts["updated"] + counts["unchanged"]
+            elapsed = time.perf_counter() - self.started
+            self.stdout.write(
+                f"{done} rows imported ({counts['created']} created, {counts['updated']} updated) "
+                f"({done / elapsed:.0f} rows/s)"
+            )
+
+    def create_batch(self, listings):
+        if not listings:
+            return
+        if not self.dry_run:
+            Listing.objects.bulk_create(listings)
+            listings_written(listings, created=True)
+        self.counts["created"] += len(listings)
+        listings.clear()
+        self.progress()
+
+    def update_batch(self, rows):
+        """Apply ``(pk, incoming listing)`` pairs to the stored listings in one ``bulk_update``."""
+        if not rows:
+            return
+        stored = Listing.objects.in_bulk([pk for pk, _incoming in rows])
+        now = timezone.now()
+        changed = []
+        fields = {"updated_at"}
+        for pk, incoming in rows:
+            listing = stored.get(pk)
+            if listing is None:
+                continue
+            for field in SYNC_FIELDS:
+                setattr(listing, field, getattr(incoming, field))
+            listing_fields = listing.changed_fields()
+            if listing_fields & set(ADDRESS_FIELDS):
+                # As in Listing.save(): the coordinates belong to the old
+                # address and listings_written() queues geocoding of the new one.
+                listing.latitude = listing.longitude = None
+                listing_fields |= {"latitude", "longitude"}
+            listing.updated_at = now
+            fields |= listing_fields
+            changed.append(listing)
+        if changed and not self.dry_run:
+            Listing.objects.bulk_update(changed, sorted(fields))
+            listings_written(changed)
+        self.counts["updated"] += len(changed)
+        rows.clear()
+        self.progress()
 
+    def unpublish_batch(self, pks):
+        """Unpublish the listings ``pks``, which are no longer in the feed."""
+        listings = list(Listing.objects.filter(pk__in=pks, is_published=True))
+        if not listings:
+            return
+        now = timezone.now()
+        for listing in listings:
+            listing.is_published = False
+            # Forget the row, so the listing is updated if it comes back.
+            listing.content_hash = ""
+            listing.updated_at = now
+        if not self.dry_run:
+            Listing.objects.bulk_update(listings, ["is_published", "content_hash", "updated_at"])
+            listings_written(listings, geocode=False)
+        self.counts["unpublished"] += len(listings)
@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from listings import tiles, uploads
+from listings.feed import invalidate_feed
+from listings.pagecache import invalidate_tags
+
+
+class Command(BaseCommand):
+    help = (
+        "Process the existing uploads like fresh ones (see listings/uploads.py): scale images "
+        "down to UPLOAD_MAX_DIMENSION, strip their metadata, store every file once under its "
+        "content hash and point the models at it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefix', default='photos/',
+            help="Only uploads whose name starts with this (default 'photos/'; '' for every upload).",
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Files processed concurrently (default 4; Pillow releases the GIL while encoding).',
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+
+        names = uploads.referenced_names(options['prefix'])
+        started = time.perf_counter()
+        counts = {'files': 0, 'deduplicated': 0, 'missing': 0, 'failed': 0}
+        sizes = {'before': 0, 'after': 0}
+        changed = False
+        replaced = []
+
+        def process(name):
+            if not default_storage.exists(name):
+                return name, 'missing', None
+            try:
+                return name, 'files', uploads.store(name, variants=names[name])
+            except (OSError, ValueError) as e:
+                self.stderr.write(self.style.WARNING(f"{name}: {e}"))
+                return name, 'failed', None
+
+        # Files are processed in the pool; the rows are updated here, one
+        # file at a time, so the workers never wait on database locks.
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for done, (name, outcome, stored) in enumerate(executor.map(process, sorted(names)), start=1):
+                counts[outcome] += 1
+                if stored is not None:
+                    counts['deduplicated'] += stored.deduplicated
+                    sizes['before'] += stored.original_size
+                    if not stored.deduplicated:
+                        sizes['after'] += stored.size
+                    listing_ids, realtor_ids = uploads.replace_references(name, stored)
+                    changed = changed or bool(listing_ids or realtor_ids)
+                    replaced.append(name)
+                if options['verbosity'] >= 2 and done % 100 == 0:
+                    self.stdout.write(f"{done}/{len(names)} files")
+
+        if changed:
+            # Cached pages, cards and map tiles link to the replaced files.
+            invalidate_feed()
+            invalidate_tags('listings', 'realtors')
+            tiles.clear_tiles()
+        for name in replaced:
+            uploads.remove_upload(name)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts['files']} files ({counts['deduplicated']} duplicates) processed in {elapsed:.1f}s: "
+            f"{sizes['before'] / 1024 / 1024:.1f} MB -> {sizes['after'] / 1024 / 1024:.1f} MB; "
+            f"{counts['missing']} missing files, {counts['failed']} unreadable."
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from listings import fulltext, spatial
+from listings.models import Listing
+
+
+class Command(BaseCommand):
+    help = "Rebuild the listing full-text and spatial search indexes from the Listing table."
+
+    def handle(self, *args, **options):
+        if spatial.is_supported():
+            with transaction.atomic():
+                spatial.create_index()
+                spatial.rebuild_index(listing_model=Listing)
+
+        if not fulltext.is_supported():
+            self.stderr.write(self.style.WARNING(
+                f"Full-text index is not supported on '{connection.vendor}'; search falls back to icontains."
+            ))
+            return
+
+        with transaction.atomic():
+            fulltext.create_index()
+            fulltext.rebuild_index(listing_model=Listing)
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {Listing.objects.count()} listings."))
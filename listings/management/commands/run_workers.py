@@ -0,0 +1,50 @@
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from listings import jobs
+from listings.models import Job
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs (geocoding and other slow side effects) from the "
+        "job queue with a pool of worker threads. Stop with Ctrl+C."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Number of worker threads (default JOB_WORKERS, 2).',
+        )
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due instead of waiting for more.')
+        parser.add_argument('--retry-failed', action='store_true', help='Queue the failed jobs again first.')
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or jobs.worker_count()
+        if workers < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        if options['retry_failed']:
+            retried = 0
+            for job in Job.objects.filter(status=Job.FAILED):
+                retried += jobs.retry(job)
+            self.stdout.write(f"Queued {retried} failed jobs again.")
+
+        lock = threading.Lock()
+        done = {'succeeded': 0, 'failed': 0}
+
+        def on_job(job, succeeded):
+            with lock:
+                done['succeeded' if succeeded else 'failed'] += 1
+            if succeeded:
+                self.stdout.write(f"[{job.locked_by}] {job.kind} #{job.pk} done")
+            else:
+                self.stderr.write(self.style.WARNING(f"[{job.locked_by}] {job.kind} #{job.pk} failed (attempt {job.attempts})"))
+
+        queued = Job.objects.filter(status=Job.QUEUED).count()
+        self.stdout.write(f"Starting {workers} workers; {queued} jobs queued.")
+        jobs.run_workers(workers, burst=options['burst'], on_job=on_job)
+        self.stdout.write(self.style.SUCCESS(
+            f"Stopped. {done['succeeded']} jobs succeeded, {done['failed']} failed."
+        ))
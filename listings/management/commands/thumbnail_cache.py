@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from listings import thumbnails
+
+
+class Command(BaseCommand):
+    help = "Show on-demand thumbnail cache usage, or evict down to the size cap, or clear it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Delete least recently used files beyond the cap.')
+        parser.add_argument('--clear', action='store_true', help='Delete every cached thumbnail.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            thumbnails.clear()
+            self.stdout.write(self.style.SUCCESS("Cleared the thumbnail cache."))
+            return
+        if options['evict']:
+            self.stdout.write(self.style.SUCCESS(f"Evicted {thumbnails.evict()} thumbnails."))
+
+        files, size = thumbnails.cache_usage()
+        limit = thumbnails.cache_max_bytes()
+        self.stdout.write(
+            f"{files} thumbnails, {size / 1024 / 1024:.1f} MB of {limit / 1024 / 1024:.0f} MB "
+            f"({size / limit if limit else 0:.0%}) in {thumbnails.cache_root()}"
+        )
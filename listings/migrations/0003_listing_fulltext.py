@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from listings import fulltext
+
+
+def create_fulltext_index(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    fulltext.create_index(schema_editor.connection)
+    fulltext.rebuild_index(schema_editor.connection, Listing)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    fulltext.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0002_listing_lat_lng'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.26 on 2026-10-18 09:34
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0003_listing_fulltext'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-list_date'], name='listing_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(django.db.models.functions.text.Lower('city'), models.F('price'), condition=models.Q(('is_published', True)), name='listing_city_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(django.db.models.functions.text.Lower('state'), models.F('price'), condition=models.Q(('is_published', True)), name='listing_state_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['price'], name='listing_pub_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['bedrooms'], name='listing_pub_bedrooms_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.26 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0005_listing_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['latitude', 'longitude'], name='listing_pub_lat_lng_idx'),
+        ),
+    ]
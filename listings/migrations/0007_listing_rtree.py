@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from listings import spatial
+
+
+def create_spatial_index(apps, schema_editor):
+    Listing = apps.get_model('listings', 'Listing')
+    spatial.create_index(schema_editor.connection)
+    spatial.rebuild_index(schema_editor.connection, Listing)
+
+
+def drop_spatial_index(apps, schema_editor):
+    spatial.drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0006_listing_lat_lng_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_spatial_index, drop_spatial_index),
+    ]
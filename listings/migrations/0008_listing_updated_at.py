@@ -0,0 +1,29 @@
+# Generated by Django 4.2.26 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+def backfill_updated_at(apps, schema_editor):
+    # Existing listings get their list date rather than the time of the migration.
+    Listing = apps.get_model('listings', 'Listing')
+    Listing.objects.update(updated_at=models.F('list_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0007_listing_rtree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['updated_at'], name='listing_pub_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.26 on 2026-10-18 10:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+import listings.models
+
+PHOTO_FIELDS = ('photo_main', 'photo_1', 'photo_2', 'photo_3', 'photo_4', 'photo_5', 'photo_6')
+
+
+def copy_photo_columns(apps, schema_editor):
+    # One ListingPhoto per filled photo column, with its URL and dimensions.
+    from django.core.files.images import get_image_dimensions
+    from django.core.files.storage import default_storage
+
+    Listing = apps.get_model('listings', 'Listing')
+    ListingPhoto = apps.get_model('listings', 'ListingPhoto')
+    batch = []
+    for row in Listing.objects.values_list('id', *PHOTO_FIELDS).iterator(chunk_size=2000):
+        listing_id, names = row[0], row[1:]
+        for position, (field, name) in enumerate(zip(PHOTO_FIELDS, names)):
+            if not name:
+                continue
+            try:
+                with default_storage.open(name) as f:
+                    width, height = get_image_dimensions(f)
+            except OSError:
+                width = height = None
+            batch.append(ListingPhoto(
+                listing_id=listing_id, image=name, position=position, field=field,
+                url=default_storage.url(name), width=width, height=height,
+            ))
+        if len(batch) >= 2000:
+            ListingPhoto.objects.bulk_create(batch)
+            batch = []
+    ListingPhoto.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0011_listing_external_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingPhoto',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='photos/%Y/%m/%d/')),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('width', models.PositiveIntegerField(blank=True, editable=False, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, editable=False, null=True)),
+                ('url', models.CharField(blank=True, editable=False, max_length=300)),
+                ('field', models.CharField(blank=True, editable=False, max_length=20)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photos', to='listings.listing')),
+            ],
+            options={
+                'ordering': ['position', 'id'],
+                'indexes': [models.Index(fields=['listing', 'position', 'id'], name='listing_photo_position_idx')],
+            },
+            bases=(listings.models.ChangeTrackingMixin, models.Model),
+        ),
+        migrations.AddConstraint(
+            model_name='listingphoto',
+            constraint=models.UniqueConstraint(condition=models.Q(('field', ''), _negated=True), fields=('listing', 'field'), name='listing_photo_unique_field'),
+        ),
+        migrations.RunPython(copy_photo_columns, migrations.RunPython.noop),
+    ]
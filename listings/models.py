@@ -1,15 +1,109 @@
 from django.db import models
+from django.db.models import Q
+from django.db.models.functions import Lower
 from datetime import datetime
-from django.utils.timezone import timezone
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-import time
+from django.utils.timezone import now, timezone
+from django.core.exceptions import ImproperlyConfigured
 
 from realtors.models import Realtor
 
 # Create your models here.
 
-class Listing(models.Model):
+ADDRESS_FIELDS = ('address', 'city', 'state', 'zipcode')
+
+# The fixed photo columns of Listing, mirrored into ListingPhoto rows.
+PHOTO_FIELDS = ('photo_main', 'photo_1', 'photo_2', 'photo_3', 'photo_4', 'photo_5', 'photo_6')
+
+
+class ChangeTrackingMixin:
+    """Remembers the field values an instance was loaded with.
+
+    ``from_db`` keeps a snapshot of the loaded values, so ``changed_fields()``
+    and ``has_changed()`` tell what was modified since, without a query, and
+    ``save_changes()`` writes only those fields. The snapshot follows every
+    ``save()``. Instances that were not loaded from the database (built with
+    a primary key by hand) fetch their stored values once, when first asked.
+    """
+
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _snapshot(self, field_names=None):
+        attnames = [
+            field.attname for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+            and (field_names is None or field.name in field_names or field.attname in field_names)
+        ]
+        values = {attname: self.__dict__[attname] for attname in attnames}
+        if field_names is None or self._loaded_values is None:
+            self._loaded_values = values
+        else:
+            self._loaded_values = {**self._loaded_values, **values}
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot(fields)
+
+    def _original_values(self):
+        if self._loaded_values is None and not self._state.adding and self.pk is not None:
+            stored = type(self)._base_manager.filter(pk=self.pk).values(
+                *[field.attname for field in self._meta.concrete_fields]
+            ).first()
+            self._loaded_values = stored or {}
+        return self._loaded_values
+
+    def loaded_value(self, attname, default=None):
+        """The value of ``attname`` as last loaded or saved."""
+        return (self._original_values() or {}).get(attname, default)
+
+    def changed_fields(self):
+        """Names of the concrete fields modified since the last load or save.
+
+        Every field of an instance that is not in the database yet.
+        """
+        original = self._original_values()
+        if self._state.adding or original is None:
+            return {field.name for field in self._meta.concrete_fields}
+        changed = set()
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue  # deferred and never set
+            if field.attname not in original or self.__dict__[field.attname] != original[field.attname]:
+                changed.add(field.name)
+        return changed
+
+    def has_changed(self, *field_names):
+        """Whether any of ``field_names`` (every field by default) was modified."""
+        changed = self.changed_fields()
+        return bool(changed & set(field_names)) if field_names else bool(changed)
+
+    def save(self, *args, **kwargs):
+        if self._loaded_values is None and self._state.adding:
+            # Nothing stored yet: during the post_save signals every field
+            # counts as changed.
+            self._loaded_values = {}
+        super().save(*args, **kwargs)
+        self._snapshot(kwargs.get('update_fields'))
+
+    def save_changes(self, **kwargs):
+        """Save only the modified fields (all of them for a new instance).
+
+        Returns the saved field names; nothing is written if nothing changed.
+        """
+        changed = self.changed_fields()
+        if self._state.adding:
+            self.save(**kwargs)
+        elif changed:
+            self.save(update_fields=changed, **kwargs)
+        return changed
+
+
+class Listing(ChangeTrackingMixin, models.Model):
     realtor = models.ForeignKey(Realtor, on_delete=models.DO_NOTHING, blank=True)
     title = models.CharField(max_length=200)
     address = models.CharField(max_length=200)
@@ -35,40 +129,176 @@ class Listing(models.Model):
     photo_6 = models.ImageField(upload_to='photos/%Y/%m/%d/', blank=True)
     is_published = models.BooleanField(default=True)
     list_date = models.DateTimeField(default=datetime.now, blank=True)
+    # Bumped on every save; the conditional GET validators are built from it.
+    updated_at = models.DateTimeField(auto_now=True)
+    # Identity of the listing in an imported feed and a hash of the feed row
+    # it was last imported from (see ``import_listings --sync``).
+    external_id = models.CharField(max_length=100, blank=True)
+    content_hash = models.CharField(max_length=40, blank=True)
+
+    class Meta:
+        # Access paths of the public listing pages (see listings/queries.py).
+        # Every public query filters on is_published, so the indexes are
+        # partial: they only hold published rows and SQLite can use them for
+        # Django's bare ``WHERE "is_published"`` condition.
+        indexes = [
+            models.Index(fields=['-list_date', '-id'], name='listing_pub_date_idx', condition=Q(is_published=True)),
+            models.Index(Lower('city'), 'price', name='listing_city_price_idx', condition=Q(is_published=True)),
+            models.Index(Lower('state'), 'price', name='listing_state_price_idx', condition=Q(is_published=True)),
+            models.Index(fields=['price'], name='listing_pub_price_idx', condition=Q(is_published=True)),
+            models.Index(fields=['bedrooms'], name='listing_pub_bedrooms_idx', condition=Q(is_published=True)),
+            models.Index(fields=['latitude', 'longitude'], name='listing_pub_lat_lng_idx', condition=Q(is_published=True)),
+            models.Index(fields=['updated_at'], name='listing_pub_updated_idx', condition=Q(is_published=True)),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['external_id'], name='listing_unique_external_id', condition=~Q(external_id=''),
+            ),
+        ]
+
+    @property
+    def main_photo(self):
+        """The first ``ListingPhoto``, or None (prefetch ``photos`` for lists)."""
+        photos = self.photos.all()
+        return photos[0] if photos else None
 
     def geocode_address(self):
-        """Geocode the address using Nominatim"""
+        """Geocode the address, through the geocode cache (see listings/geocache.py).
+
+        Saving a listing no longer calls this; the Listing signals queue a
+        ``geocode_listing`` job instead (see listings/jobs.py).
+        """
         if not any([self.address, self.city, self.state]):
             return
-            
-        # Construct the full address
-        address_parts = [
-            self.address,
-            self.city,
-            self.state,
-            self.zipcode
-        ]
-        full_address = ", ".join(filter(None, address_parts))
-        
+
+        from .geocoding import GeocodingError, full_address, geocode
+
         try:
-            geolocator = Nominatim(user_agent="coralcity_property")
-            location = geolocator.geocode(full_address)
-            if location:
-                self.latitude = location.latitude
-                self.longitude = location.longitude
-                # Don't save here - it will be saved in save() method
-        except (GeocoderTimedOut, GeocoderServiceError):
+            coordinates = geocode(full_address(self))
+        except (GeocodingError, ImproperlyConfigured):
             # If geocoding fails, we'll just leave coordinates as they are
-            pass
+            return
+        if coordinates:
+            # Don't save here - it will be saved in save() method
+            self.latitude, self.longitude = coordinates
 
     def save(self, *args, **kwargs):
-        # Check if address-related fields have changed
-        if not self.pk or any([
-            self._state.adding,
-            hasattr(self, '_address_changed') and self._address_changed
-        ]):
-            self.geocode_address()
+        update_fields = kwargs.get('update_fields')
+        if (
+            not self._state.adding
+            and self.has_changed(*ADDRESS_FIELDS)
+            and not self.has_changed('latitude', 'longitude')
+        ):
+            # The coordinates belong to the old address; the Listing signals
+            # queue geocoding of the new one.
+            self.latitude = None
+            self.longitude = None
+            if update_fields is not None:
+                update_fields = {*update_fields, 'latitude', 'longitude'}
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+
+class ListingPhoto(ChangeTrackingMixin, models.Model):
+    """One photo of a listing; ``listing.photos`` lists them in ``position`` order.
+
+    ``url``, ``width`` and ``height`` are filled in when the image changes,
+    so pages and map markers listing many photos make no storage calls.
+    The fixed ``photo_main`` ... ``photo_6`` columns of Listing are mirrored
+    into rows marked with the column name in ``field`` (see the Listing
+    signals); photos added beyond them have no ``field``.
+    """
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='photos')
+    image = models.ImageField(upload_to='photos/%Y/%m/%d/')
+    position = models.PositiveSmallIntegerField(default=0)
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    url = models.CharField(max_length=300, blank=True, editable=False)
+    field = models.CharField(max_length=20, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['listing', 'position', 'id'], name='listing_photo_position_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['listing', 'field'], name='listing_photo_unique_field', condition=~Q(field=''),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.has_changed('image') or not self.url:
+            self.url = self.image.url if self.image else ''
+            try:
+                self.width, self.height = self.image.width, self.image.height
+            except (OSError, ValueError, TypeError):
+                # Missing or unreadable file; the dimensions stay unknown.
+                self.width = self.height = None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'url', 'width', 'height'}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.image.name
+
+
+class GeocodeCacheEntry(models.Model):
+    """A geocoder answer for a normalized address; no coordinates means "not found"."""
+    key = models.CharField(max_length=40, unique=True)
+    address = models.TextField()
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    hits = models.PositiveIntegerField(default=0)
+    fetched_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.address
+
+
+class Job(models.Model):
+    """A queued call of a registered task, run by the ``run_workers`` command."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=100)
+    # Jobs with the same kind and a non-empty key are queued at most once.
+    key = models.CharField(max_length=100, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_at', 'id'], name='job_queued_idx', condition=Q(status='queued')),
+            models.Index(fields=['locked_at'], name='job_running_idx', condition=Q(status='running')),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'key'], name='job_unique_queued_key', condition=Q(status='queued') & ~Q(key=''),
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.key or self.payload}'
+
+
+class IndexVersion(models.Model):
+    """Change counter of a per-process index (see ``localindex``), shared by every process."""
+    key = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.key} v{self.version}'
@@ -0,0 +1,148 @@
+"""Per-language response and fragment cache for the public listing pages.
+
+Pages are cached per language, path and query string in the ``pages``
+cache (file based, so every worker on the host shares it). Each cached page
+declares tags such as ``listings`` or ``listing:42``; every tag has a
+version counter that is part of the cache key, and the Listing and Realtor
+signals bump exactly the tags a change affects, so stale pages are never
+served again and everything else stays cached.
+
+Whole responses are only cached for anonymous requests without pending
+flash messages; every anonymous visitor sees the same page. Every page
+carries a CSRF token (the language switcher), so the token is replaced
+by a placeholder before a response is stored and a fresh one for the
+current visitor is put back on each hit. Authenticated users get the
+uncached page, with the costly parts cached as template fragments keyed
+by the same tag versions (see ``fragment_version()``).
+
+A page is only as fresh as what it was rendered from. Everything it reads
+from a cache is keyed on the same shared tag versions; a page rendered from
+a per-process index (the read model, the similar listings) also carries the
+version of that index in its key (``cache_page(versions=...)``), since a
+worker notices a change made elsewhere up to a second late. Tags bumped in
+a transaction are bumped again once it commits: until then other workers
+still render the old rows, and would cache them under the new version.
+"""
+import functools
+import hashlib
+import re
+import time
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils.translation import get_language
+
+TAG_VERSION_KEY = 'pagecache:tag:%s'
+
+# The {% csrf_token %} tag renders exactly this input.
+_CSRF_INPUT_RE = re.compile(rb'(<input type="hidden" name="csrfmiddlewaretoken" value=")[^"]*(">)')
+_CSRF_PLACEHOLDER = b'__PAGE_CACHE_CSRF_TOKEN__'
+
+
+def page_cache():
+    return caches[getattr(settings, 'PAGE_CACHE_ALIAS', 'pages')]
+
+
+def page_cache_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+
+
+# --- Tags -----------------------------------------------------------------
+
+def _initial_version():
+    # Versions start from the clock rather than 0, so a tag whose counter was
+    # culled from the cache can never come back to a version some old page
+    # is still stored under.
+    return int(time.time() * 1000)
+
+
+def tag_versions(tags):
+    """The current version of each tag, in order."""
+    cache = page_cache()
+    keys = [TAG_VERSION_KEY % tag for tag in tags]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _initial_version(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def now_and_on_commit(invalidate):
+    """Run ``invalidate()`` now and, inside a transaction, again once it commits."""
+    invalidate()
+    if connection.in_atomic_block:
+        transaction.on_commit(invalidate)
+
+
+def _bump(tags):
+    cache = page_cache()
+    for tag in tags:
+        key = TAG_VERSION_KEY % tag
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+
+
+def invalidate_tags(*tags):
+    """Bump the version of every tag, orphaning the pages cached under it."""
+    now_and_on_commit(functools.partial(_bump, tags))
+
+
+def fragment_version(*tags):
+    """A string for ``{% cache %}`` fragment keys that changes with any of ``tags``."""
+    return '.'.join(str(version) for version in tag_versions(tags))
+
+
+# --- Responses ------------------------------------------------------------
+
+def _is_cacheable_request(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return False
+    # Pages render (and consume) pending flash messages.
+    return not len(get_messages(request))
+
+
+def _page_key(request, tags, extra):
+    versions = tag_versions(tags)
+    raw = f'{request.get_full_path()}|{tags}|{versions}|{extra}'
+    return f'pagecache:page:{get_language()}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+def cache_page(*tags, versions=()):
+    """Cache a view's responses under ``tags``.
+
+    Tags may use the view's keyword arguments, e.g. ``'listing:{listing_id}'``.
+    ``versions`` are callables whose results are part of the key too, e.g.
+    ``readmodel.version`` for a view rendered from the read model.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            tag_names = [tag.format(**kwargs) for tag in tags]
+            key = _page_key(request, tag_names, [version() for version in versions])
+            cached = page_cache().get(key)
+            if cached is not None:
+                content_type, body = cached
+                if _CSRF_PLACEHOLDER in body:
+                    body = body.replace(_CSRF_PLACEHOLDER, get_token(request).encode())
+                return HttpResponse(body, content_type=content_type)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                body = _CSRF_INPUT_RE.sub(rb'\1' + _CSRF_PLACEHOLDER + rb'\2', response.content)
+                page_cache().set(key, (response['Content-Type'], body), page_cache_timeout())
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,128 @@
+"""Keyset (cursor) pagination for the listing index pages.
+
+Django's ``Paginator`` runs a ``COUNT(*)`` per request and then an
+``OFFSET`` query whose cost grows with the page number. ``KeysetPaginator``
+instead seeks straight to the row after (or before) the last one shown,
+using the ``(list_date, id)`` pair as the key, so every page costs the same
+index range scan as the first one.
+
+Cursors are opaque URL-safe strings; callers should not parse them.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.paginator import Paginator
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(listing, direction):
+    payload = json.dumps(
+        {'d': listing.list_date.isoformat(), 'i': listing.pk, 'r': direction},
+        separators=(',', ':'),
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return ``(list_date, id, direction)`` or ``None`` if ``cursor`` is invalid."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        direction = payload['r']
+        if direction not in (NEXT, PREVIOUS):
+            return None
+        return datetime.fromisoformat(payload['d']), int(payload['i']), direction
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return None
+
+
+class KeysetPage:
+    """A page of results with the subset of the ``Page`` API the templates use."""
+
+    is_keyset = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """Paginate a queryset ordered newest first by ``(list_date, id)``."""
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+
+    def page_queryset(self, key=None):
+        """The query for the page after or before ``key``, plus one look-ahead row.
+
+        ``key`` is a decoded cursor; ``None`` selects the first page.
+        """
+        if key is None:
+            return self.queryset.order_by('-list_date', '-pk')[:self.per_page + 1]
+
+        # Written as a range on list_date minus the tie-breaker, rather than
+        # an OR of two conditions, so the list_date index drives the scan.
+        list_date, pk, direction = key
+        if direction == NEXT:
+            queryset = self.queryset.filter(list_date__lte=list_date).exclude(list_date=list_date, pk__gte=pk)
+            queryset = queryset.order_by('-list_date', '-pk')
+        else:
+            queryset = self.queryset.filter(list_date__gte=list_date).exclude(list_date=list_date, pk__lte=pk)
+            queryset = queryset.order_by('list_date', 'pk')
+        return queryset[:self.per_page + 1]
+
+    def get_page(self, cursor=None):
+        key = decode_cursor(cursor)
+        rows = list(self.page_queryset(key))
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if key is None:
+            return self._build(rows, has_next=has_more, has_previous=False)
+        if key[2] == NEXT:
+            return self._build(rows, has_next=has_more, has_previous=True)
+        return self._build(rows[::-1], has_next=True, has_previous=has_more)
+
+    def _build(self, rows, has_next, has_previous):
+        next_cursor = encode_cursor(rows[-1], NEXT) if rows and has_next else None
+        previous_cursor = encode_cursor(rows[0], PREVIOUS) if rows and has_previous else None
+        return KeysetPage(rows, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+
+def paginate_listings(request, queryset, per_page):
+    """Paginate ``queryset`` for a listing index view.
+
+    ``?page=N`` URLs keep working through Django's ``Paginator``; everything
+    else, including the first page, is served by ``KeysetPaginator``.
+    """
+    if 'page' in request.GET:
+        return Paginator(queryset, per_page).get_page(request.GET.get('page'))
+    return KeysetPaginator(queryset, per_page).get_page(request.GET.get('cursor'))
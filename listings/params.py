@@ -0,0 +1,30 @@
+"""Parsing of the search and map request parameters.
+
+Malformed values raise ``ParameterError``, a ``ValueError`` whose message is
+written for the visitor: the views send it back with their 400 responses, so
+it never carries Python's own text (``invalid literal for int() ...``).
+"""
+import math
+
+
+class ParameterError(ValueError):
+    pass
+
+
+def parse_int(value, name):
+    """``value`` as an integer; raise ``ParameterError`` naming ``name`` otherwise."""
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ParameterError(f'{name} must be a whole number') from None
+
+
+def parse_float(value, name):
+    """``value`` as a finite float; raise ``ParameterError`` naming ``name`` otherwise."""
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number):
+        raise ParameterError(f'{name} must be a number')
+    return number
@@ -0,0 +1,95 @@
+"""Shared querysets for the public listing pages.
+
+Every view that lists listings builds its queryset here so the access paths
+stay in line with the indexes declared on ``Listing.Meta`` and can be
+checked with ``python manage.py explain_listing_queries``.
+"""
+from django.db.models import QuerySet, Value, prefetch_related_objects
+from django.db.models.functions import Lower
+
+from . import fulltext, readmodel, spatial
+from .models import Listing
+from .params import parse_int
+
+# Request parameters that select listings (see ``filter_listings()``).
+FILTER_PARAMS = ('keywords', 'city', 'state', 'bedrooms', 'price', 'lat', 'lng', 'radius')
+
+
+def published_listings():
+    """Published listings, newest first (uses ``listing_pub_date_idx``)."""
+    return Listing.objects.filter(is_published=True).order_by('-list_date', '-id')
+
+
+def with_photos(listings):
+    """``listings`` (a queryset or a list) with their photos loaded in one query."""
+    if isinstance(listings, QuerySet):
+        return listings.prefetch_related('photos')
+    prefetch_related_objects(listings, 'photos')
+    return listings
+
+
+def filter_listings(queryset, params, rank=True):
+    """Apply the search form filters in ``params`` (a QueryDict or dict).
+
+    City and state are compared as ``LOWER(column) = LOWER(value)`` rather
+    than with ``__iexact`` so the lookups can use the ``lower(city)`` /
+    ``lower(state)`` expression indexes on both SQLite and Postgres.
+
+    Raises ``ParameterError`` for malformed values.
+    """
+    keywords = params.get('keywords')
+    if keywords:
+        queryset = fulltext.filter_queryset(queryset, keywords, rank=rank)
+
+    city = params.get('city')
+    if city:
+        queryset = queryset.alias(city_lower=Lower('city')).filter(city_lower=Lower(Value(city)))
+
+    state = params.get('state')
+    if state:
+        queryset = queryset.alias(state_lower=Lower('state')).filter(state_lower=Lower(Value(state)))
+
+    bedrooms = params.get('bedrooms')
+    if bedrooms:
+        queryset = queryset.filter(bedrooms__lte=parse_int(bedrooms, 'bedrooms'))
+
+    price = params.get('price')
+    if price:
+        queryset = queryset.filter(price__lte=parse_int(price, 'price'))
+
+    near = spatial.parse_near(params)
+    if near:
+        queryset = spatial.filter_near(queryset, near, sort=params.get('sort') == 'distance')
+
+    return queryset
+
+
+def filter_fingerprint(params):
+    """A stable string identifying the filter set in ``params``, for cache keys."""
+    return '&'.join(f'{name}={str(params.get(name) or "").strip()}' for name in FILTER_PARAMS)
+
+
+def search_listings(params):
+    return filter_listings(published_listings().prefetch_related('photos'), params)
+
+
+def search_results(params):
+    """Listings for the search page.
+
+    Filtered on the in-memory read model when it is enabled and no keywords
+    are given (keyword results keep their full-text ranking); then only the
+    matching rows are loaded, by primary key. A listing unpublished since the
+    read model was last refreshed is left out.
+    """
+    if not readmodel.is_enabled() or fulltext.tokenize(params.get('keywords')):
+        return search_listings(params)
+    ids = readmodel.get_model().search_ids(params).tolist()
+    found = Listing.objects.filter(is_published=True).prefetch_related('photos').in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def mapped_listings(params):
+    """Published listings with coordinates, filtered like the search page."""
+    queryset = Listing.objects.filter(is_published=True)
+    queryset = filter_listings(queryset, params, rank=False)
+    return queryset.exclude(latitude__isnull=True).exclude(longitude__isnull=True)
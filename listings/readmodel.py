@@ -0,0 +1,347 @@
+"""Compact in-memory read model of the published listings.
+
+Each worker process holds the filterable fields of every published
+listing as contiguous NumPy columns, about 60 bytes per listing, with
+city, state and property type stored as integer codes into interned string
+tables. The rows are kept in ``published_listings()`` order (newest
+first), so a filter is a handful of vectorized comparisons producing a
+boolean mask, and the selected ids come out already ordered: around a
+millisecond for 100k listings.
+
+It serves the search page's filtering, the facet counts and the map's
+cluster aggregates. Keyword search still goes through the full-text index,
+whose matching ids become one more mask; the search page itself keeps the
+database path when keywords are given so results stay ranked. Individual
+map markers need titles, addresses and photos, which the read model
+deliberately does not hold, so they are still streamed from the database.
+
+The columns are refreshed incrementally by the Listing signals (see
+``localindex``). Set ``LISTING_READ_MODEL = False``, or leave NumPy
+uninstalled, to run everything against the database.
+"""
+import bisect
+import math
+from collections import Counter
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import fulltext, spatial
+from .choices import PRICE_BOUNDS
+from .clustering import cell_size, snap_bbox
+from .localindex import LocalIndex
+from .models import Listing
+from .params import parse_int
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+READ_MODEL_VERSION_KEY = 'listings:read_model:version'
+
+FIELDS = (
+    'id', 'list_date', 'price', 'bedrooms', 'bathrooms', 'sqft',
+    'latitude', 'longitude', 'city', 'state', 'property_type',
+)
+
+STRING_FIELDS = ('city', 'state', 'property_type')
+
+if np is not None:
+    DTYPE = np.dtype([
+        ('id', np.int64),
+        ('list_date', np.int64),   # microseconds since the epoch
+        ('price', np.int64),
+        ('price_bucket', np.int8),  # index of the smallest PRICE_BOUNDS >= price
+        ('bedrooms', np.int16),
+        ('bathrooms', np.int16),
+        ('sqft', np.int32),
+        ('latitude', np.float64),  # NaN when not geocoded
+        ('longitude', np.float64),
+        ('city', np.int32),        # codes into StringTable
+        ('state', np.int32),
+        ('property_type', np.int32),
+    ])
+
+
+def is_enabled():
+    return np is not None and getattr(settings, 'LISTING_READ_MODEL', True)
+
+
+class StringTable:
+    """Interns strings under their lowercased form, as the filters compare them."""
+
+    def __init__(self):
+        self.codes = {}
+        self.labels = []
+
+    @staticmethod
+    def key(value):
+        return (value or '').strip().lower()
+
+    def code(self, value):
+        key = self.key(value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.labels)
+            self.labels.append((key, (value or '').strip()))
+        return code
+
+    def lookup(self, value):
+        """The code of ``value``, or -1 if no listing has it."""
+        return self.codes.get(self.key(value), -1)
+
+
+def _timestamp(value):
+    if value is None:
+        return 0
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return int(value.timestamp() * 1_000_000)
+
+
+def _float(value):
+    return math.nan if value is None else value
+
+
+def keyword_ids(keywords):
+    """Ids of the published listings matching ``keywords`` in the full-text index."""
+    queryset = fulltext.filter_queryset(Listing.objects.filter(is_published=True), keywords, rank=False)
+    return np.fromiter(queryset.values_list('id', flat=True).iterator(), dtype=np.int64)
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(latitudes)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * np.cos(lat2) * np.sin((np.radians(longitudes) - math.radians(longitude)) / 2) ** 2
+    )
+    return 2 * spatial.EARTH_RADIUS_KM * np.arcsin(np.minimum(np.sqrt(a), 1.0))
+
+
+class ReadModel:
+
+    def __init__(self, rows):
+        self.strings = {field: StringTable() for field in STRING_FIELDS}
+        records = np.array([self._record(row) for row in rows], dtype=DTYPE)
+        self.columns = self._sorted({name: records[name] for name in DTYPE.names})
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def _record(self, row):
+        (pk, list_date, price, bedrooms, bathrooms, sqft,
+         latitude, longitude, city, state, property_type) = row
+        return (
+            pk, _timestamp(list_date), price, bisect.bisect_left(PRICE_BOUNDS, price),
+            bedrooms, bathrooms, sqft,
+            _float(latitude), _float(longitude),
+            self.strings['city'].code(city),
+            self.strings['state'].code(state),
+            self.strings['property_type'].code(property_type),
+        )
+
+    @staticmethod
+    def _sorted(columns):
+        # Newest first, like published_listings(): list_date desc, id desc.
+        # Every column is copied out contiguous, which keeps the masks fast.
+        order = np.lexsort((columns['id'], columns['list_date']))[::-1]
+        return {name: np.ascontiguousarray(column[order]) for name, column in columns.items()}
+
+    # --- Incremental updates (copy-on-write, so readers never see a half-applied change)
+
+    def upsert(self, row):
+        record = np.array([self._record(row)], dtype=DTYPE)
+        keep = self.columns['id'] != record['id'][0]
+        self.columns = self._sorted({
+            name: np.concatenate([column[keep], record[name]]) for name, column in self.columns.items()
+        })
+
+    def remove(self, pk):
+        keep = self.columns['id'] != pk
+        self.columns = {name: column[keep] for name, column in self.columns.items()}
+
+    # --- Filtering
+
+    def mask(self, params, mapped=False):
+        """Boolean mask of the rows matching the search filters in ``params``.
+
+        Mirrors ``queries.filter_listings()``; raises ``ParameterError`` for
+        malformed values.
+        """
+        columns = self.columns
+        mask = np.ones(len(self), dtype=bool)
+
+        keywords = params.get('keywords')
+        if keywords and fulltext.tokenize(keywords):
+            mask &= np.isin(columns['id'], keyword_ids(keywords))
+
+        for field in ('city', 'state'):
+            value = params.get(field)
+            if value:
+                mask &= columns[field] == self.strings[field].lookup(value)
+
+        bedrooms = params.get('bedrooms')
+        if bedrooms:
+            mask &= columns['bedrooms'] <= parse_int(bedrooms, 'bedrooms')
+
+        price = params.get('price')
+        if price:
+            mask &= columns['price'] <= parse_int(price, 'price')
+
+        near = spatial.parse_near(params)
+        if near:
+            latitude, longitude, radius = near
+            # Cheap bounding-box comparisons first; the exact distance only
+            # for the rows inside it.
+            mask &= self._bbox_mask(spatial.bounding_box(latitude, longitude, radius))
+            candidates = np.flatnonzero(mask)
+            distances = haversine_km(
+                latitude, longitude, columns['latitude'][candidates], columns['longitude'][candidates],
+            )
+            mask[candidates[distances > radius]] = False
+        elif mapped:
+            mask &= ~np.isnan(columns['latitude']) & ~np.isnan(columns['longitude'])
+
+        return mask
+
+    def _bbox_mask(self, bbox):
+        """Rows inside ``(west, south, east, north)``; NaN coordinates never match."""
+        west, south, east, north = bbox
+        latitudes, longitudes = self.columns['latitude'], self.columns['longitude']
+        mask = (latitudes >= south) & (latitudes <= north)
+        if west <= east:
+            return mask & (longitudes >= west) & (longitudes <= east)
+        # The box spans the antimeridian.
+        return mask & ((longitudes >= west) | (longitudes <= east))
+
+    def search_ids(self, params):
+        """Ids of the matching listings, newest first or (``sort=distance``) nearest first."""
+        mask = self.mask(params)
+        ids = self.columns['id'][mask]
+        near = spatial.parse_near(params)
+        if near and params.get('sort') == 'distance':
+            distances = haversine_km(
+                near[0], near[1], self.columns['latitude'][mask], self.columns['longitude'][mask],
+            )
+            ids = ids[np.argsort(distances, kind='stable')]
+        return ids
+
+    def facet_counts(self, params):
+        """Per-value counts of the matching listings, for ``facets``."""
+        mask = self.mask(params)
+        columns = self.columns
+        counts = {}
+        spellings = {}
+        for field in STRING_FIELDS:
+            labels = self.strings[field].labels
+            per_code = np.bincount(columns[field][mask], minlength=len(labels))
+            counts[field] = Counter({labels[code][0]: int(per_code[code]) for code in np.flatnonzero(per_code)})
+            spellings.update(labels)
+        bedrooms = columns['bedrooms'][mask]
+        lowest = int(bedrooms.min()) if len(bedrooms) else 0
+        per_bed = np.bincount(bedrooms - lowest)
+        per_bucket = np.bincount(columns['price_bucket'][mask], minlength=len(PRICE_BOUNDS) + 1)
+        return {
+            'total': int(np.count_nonzero(mask)),
+            'city': counts['city'],
+            'state': counts['state'],
+            'property_type': counts['property_type'],
+            'spellings': spellings,
+            'bedrooms': Counter({int(beds) + lowest: int(per_bed[beds]) for beds in np.flatnonzero(per_bed)}),
+            'price': Counter({bound: int(per_bucket[i]) for i, bound in enumerate(PRICE_BOUNDS) if per_bucket[i]}),
+        }
+
+    def cluster_features(self, params, zoom, bbox=None):
+        """Grid cluster features, identical in shape to ``clustering.cluster_features()``."""
+        mask = self.mask(params, mapped=True)
+        if bbox is not None:
+            mask &= self._bbox_mask(snap_bbox(bbox, zoom))
+        latitudes = self.columns['latitude'][mask]
+        longitudes = self.columns['longitude'][mask]
+        prices = self.columns['price'][mask]
+        if not len(prices):
+            return []
+
+        size = cell_size(zoom)
+        cell_x = np.floor((longitudes + 180.0) / size).astype(np.int64)
+        cell_y = np.floor((latitudes + 90.0) / size).astype(np.int64)
+        # Number the occupied part of the grid densely so the per-cell sums
+        # are plain bincounts.
+        cell_x -= cell_x.min()
+        cell_y -= cell_y.min()
+        keys = cell_x * (int(cell_y.max()) + 1) + cell_y
+        cells, keys = np.unique(keys, return_inverse=True)
+        counts = np.bincount(keys, minlength=len(cells))
+        latitude_avg = np.bincount(keys, weights=latitudes, minlength=len(cells)) / counts
+        longitude_avg = np.bincount(keys, weights=longitudes, minlength=len(cells)) / counts
+        min_price = np.full(len(cells), np.iinfo(np.int64).max)
+        max_price = np.full(len(cells), np.iinfo(np.int64).min)
+        np.minimum.at(min_price, keys, prices)
+        np.maximum.at(max_price, keys, prices)
+        return [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [lng, lat]},
+                'properties': {
+                    'cluster': True,
+                    'count': count,
+                    'min_price': low,
+                    'max_price': high,
+                },
+            }
+            for lng, lat, count, low, high in zip(
+                longitude_avg.tolist(), latitude_avg.tolist(), counts.tolist(),
+                min_price.tolist(), max_price.tolist(),
+            )
+        ]
+
+
+def build_model():
+    rows = Listing.objects.filter(is_published=True).values_list(*FIELDS).iterator(chunk_size=2000)
+    return ReadModel(rows)
+
+
+_local = LocalIndex(READ_MODEL_VERSION_KEY, build_model)
+
+
+def get_model():
+    return _local.get()
+
+
+def version():
+    """What cached results computed from the read model are keyed on (see ``pagecache``)."""
+    return _local.version() if is_enabled() else None
+
+
+def _row(listing):
+    return tuple(getattr(listing, field) for field in FIELDS)
+
+
+def listing_changed(listing):
+    if not is_enabled():
+        return
+
+    def change(model):
+        if listing.is_published:
+            model.upsert(_row(listing))
+        else:
+            model.remove(listing.pk)
+
+    _local.apply(change)
+
+
+def listing_deleted(listing_id):
+    if not is_enabled():
+        return
+    _local.apply(lambda model: model.remove(listing_id))
+
+
+def invalidate():
+    """Rebuild from the database on next use, in every process (after bulk writes)."""
+    _local.invalidate()
@@ -1,68 +1,199 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.conf import settings
 
-from .models import Listing
+from . import fulltext, images, jobs, readmodel, similar, spatial, tiles, uploads
+from .clustering import invalidate_clusters
+from .facets import invalidate_facets
+from .feed import invalidate_feed
+from .models import ADDRESS_FIELDS, PHOTO_FIELDS, Listing, ListingPhoto
+from .pagecache import invalidate_tags
+from Ages.models import AgesVerification
+from realtors.models import Realtor
 
-try:
-    from geopy.geocoders import Nominatim
-    from geopy.extra.rate_limiter import RateLimiter
-except Exception:
-    Nominatim = None
-    RateLimiter = None
 
+def _unchanged_save(instance: Listing, kwargs):
+    """A post_save of a listing none of whose fields changed (post_delete: False)."""
+    if 'created' not in kwargs or kwargs['created']:
+        return False
+    return not instance.changed_fields() - {'updated_at'}
 
-def _full_address(instance: Listing, country_hint: str = "") -> str:
-    parts = [instance.address, instance.city, instance.state, instance.zipcode]
-    if country_hint:
-        parts.append(country_hint)
-    return ", ".join([p for p in parts if p])
 
+def _changed(instance: Listing, created, fields):
+    return created or instance.has_changed(*fields)
 
-@receiver(pre_save, sender=Listing)
-def clear_coords_on_address_change(sender, instance: Listing, **kwargs):
-    if not instance.pk:
+
+@receiver(post_save, sender=Listing)
+def geocode_if_missing(sender, instance: Listing, created, **kwargs):
+    if instance.latitude is not None and instance.longitude is not None:
+        return
+
+    # Basic guard: need enough address info
+    if not any([instance.address, instance.city, instance.state, instance.zipcode]):
         return
-    try:
-        old = Listing.objects.get(pk=instance.pk)
-    except Listing.DoesNotExist:
+    # Only a new address (or cleared coordinates) needs a new lookup.
+    if not _changed(instance, created, ADDRESS_FIELDS + ('latitude', 'longitude')):
         return
-    addr_changed = any([
-        old.address != instance.address,
-        old.city != instance.city,
-        old.state != instance.state,
-        old.zipcode != instance.zipcode,
-    ])
-    if addr_changed:
-        instance.latitude = None
-        instance.longitude = None
+
+    # Geocoding waits on the network; a run_workers process does it.
+    jobs.enqueue('geocode_listing', key=str(instance.pk), listing_id=instance.pk)
 
 
 @receiver(post_save, sender=Listing)
-def geocode_if_missing(sender, instance: Listing, created, **kwargs):
-    if instance.latitude is not None and instance.longitude is not None:
+def mirror_photo_columns(sender, instance: Listing, created, **kwargs):
+    # Keep the ListingPhoto rows of the photo_main ... photo_6 columns in step.
+    for position, field in enumerate(PHOTO_FIELDS):
+        if not (created or instance.has_changed(field)):
+            continue
+        image = getattr(instance, field)
+        if image:
+            photo = ListingPhoto.objects.filter(listing=instance, field=field).first()
+            if photo is None:
+                photo = ListingPhoto(listing=instance, field=field, position=position)
+            photo.image = image.name
+            photo.save_changes()
+        elif not created:
+            ListingPhoto.objects.filter(listing=instance, field=field).delete()
+
+
+@receiver(post_save, sender=Listing)
+def update_search_index(sender, instance: Listing, created, **kwargs):
+    if not _changed(instance, created, fulltext.FTS_FIELDS):
+        return
+    fulltext.index_listing(instance)
+
+
+@receiver(post_delete, sender=Listing)
+def remove_from_search_index(sender, instance: Listing, **kwargs):
+    fulltext.unindex_listing(instance.pk)
+
+
+@receiver(post_save, sender=Listing)
+def update_spatial_index(sender, instance: Listing, created, **kwargs):
+    if not _changed(instance, created, ('latitude', 'longitude')):
         return
+    spatial.index_listing(instance)
 
-    # Only attempt when geopy is available
-    if Nominatim is None:
+
+@receiver(post_delete, sender=Listing)
+def remove_from_spatial_index(sender, instance: Listing, **kwargs):
+    spatial.unindex_listing(instance.pk)
+
+
+@receiver(post_save, sender=Listing)
+def update_read_model(sender, instance: Listing, created, **kwargs):
+    if not _changed(instance, created, readmodel.FIELDS + ('is_published',)):
         return
+    readmodel.listing_changed(instance)
 
-    # Basic guard: need enough address info
-    if not any([instance.address, instance.city, instance.state, instance.zipcode]):
+
+@receiver(post_delete, sender=Listing)
+def remove_from_read_model(sender, instance: Listing, **kwargs):
+    readmodel.listing_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Listing)
+def update_similar_index(sender, instance: Listing, created, **kwargs):
+    if not _changed(instance, created, similar.FIELDS + ('is_published',)):
         return
+    similar.listing_changed(instance)
 
-    try:
-        geolocator = Nominatim(user_agent='coralcity_geocoder_signal')
-        geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1.0)
-        query = _full_address(instance)
-        location = geocode(query)
-        if location is None:
-            return
-        Listing.objects.filter(pk=instance.pk).update(
-            latitude=location.latitude,
-            longitude=location.longitude,
-        )
-    except Exception:
-        # Swallow errors to avoid breaking save paths
+
+@receiver(post_delete, sender=Listing)
+def remove_from_similar_index(sender, instance: Listing, **kwargs):
+    similar.listing_deleted(instance.pk)
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_homepage_feed(sender, instance: Listing, **kwargs):
+    if _unchanged_save(instance, kwargs):
+        return
+    invalidate_feed()
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_map_clusters(sender, instance: Listing, **kwargs):
+    if _unchanged_save(instance, kwargs):
+        return
+    invalidate_clusters()
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_search_facets(sender, instance: Listing, **kwargs):
+    if _unchanged_save(instance, kwargs):
+        return
+    invalidate_facets()
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_map_tiles(sender, instance: Listing, **kwargs):
+    if _unchanged_save(instance, kwargs):
+        return
+    # Post-save the snapshot still holds the coordinates before this save.
+    previous = (instance.loaded_value('latitude'), instance.loaded_value('longitude'))
+    current = (instance.latitude, instance.longitude)
+    tiles.invalidate_points([previous, current] if previous != current else [current])
+
+
+@receiver(post_save, sender=Listing)
+@receiver(post_delete, sender=Listing)
+def invalidate_listing_pages(sender, instance: Listing, **kwargs):
+    if _unchanged_save(instance, kwargs):
+        return
+    invalidate_tags('listing:%s' % instance.pk, 'listings')
+
+
+@receiver(post_save, sender=ListingPhoto)
+def build_photo_derivatives(sender, instance: ListingPhoto, created, **kwargs):
+    if not instance.image or not _changed(instance, created, ('image',)):
+        return
+    if uploads.needs_processing(instance.image.name):
+        # The processed upload gets its variants (see listings/uploads.py).
+        uploads.enqueue(instance.image.name)
+    else:
+        jobs.enqueue('image_derivatives', names=[instance.image.name], listing_id=instance.listing_id)
+
+
+@receiver(post_save, sender=ListingPhoto)
+@receiver(post_delete, sender=ListingPhoto)
+def invalidate_photo_pages(sender, instance: ListingPhoto, **kwargs):
+    if _unchanged_save(instance, kwargs):
+        return
+    # Cards, detail pages and map markers show the photos.
+    coordinates = Listing.objects.filter(pk=instance.listing_id).values_list('latitude', 'longitude').first()
+    if coordinates:
+        tiles.invalidate_point(*coordinates)
+    invalidate_feed()
+    invalidate_tags('listing:%s' % instance.listing_id, 'listings')
+
+
+@receiver(post_save, sender=Realtor)
+def build_realtor_photo_derivatives(sender, instance: Realtor, **kwargs):
+    # Realtors do not track changes; variants that exist are not rebuilt.
+    if not instance.photo:
         return
+    if uploads.needs_processing(instance.photo.name):
+        uploads.enqueue(instance.photo.name)
+    elif not images.has_derivatives(instance.photo.name):
+        jobs.enqueue(
+            'image_derivatives', key='realtor:%s' % instance.pk,
+            names=[instance.photo.name], realtor_id=instance.pk,
+        )
+
+
+@receiver(post_save, sender=Realtor)
+@receiver(post_delete, sender=Realtor)
+def invalidate_realtor_pages(sender, instance: Realtor, **kwargs):
+    # The realtor's contact card is shown on each of their listings' pages.
+    listing_ids = Listing.objects.filter(realtor_id=instance.pk).values_list('id', flat=True)
+    invalidate_tags('realtors', *['listing:%s' % pk for pk in listing_ids])
+
 
+@receiver(post_save, sender=AgesVerification)
+def process_uploaded_document(sender, instance: AgesVerification, **kwargs):
+    if instance.upload_file:
+        uploads.enqueue(instance.upload_file.name)
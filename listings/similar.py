@@ -0,0 +1,217 @@
+"""Similar-properties recommendations for the listing detail pages.
+
+Every published listing is a row in a NumPy matrix of normalized features:
+log price and log sqft, bedrooms and bathrooms (z-scored), a one-hot
+property type and the position on the unit sphere. Each feature group is
+scaled by its weight, so finding the most similar listings is a single
+matrix-vector product against precomputed row norms plus ``argpartition``:
+well under a millisecond for tens of thousands of listings, with no
+per-request ORM queries beyond fetching the winners by primary key.
+
+The matrix lives in each worker process (see ``localindex``): built on
+first use, updated in place by the Listing signals, rebuilt when another
+process (a web worker, ``run_workers``, ``import_listings``) changed a
+listing, which it learns from the shared ``IndexVersion`` table. Without
+NumPy installed the block is simply not shown.
+"""
+import math
+import threading
+
+from django.conf import settings
+
+from .localindex import LocalIndex
+from .models import Listing
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SIMILAR_VERSION_KEY = 'listings:similar:version'
+
+FIELDS = ('id', 'price', 'sqft', 'bedrooms', 'bathrooms', 'property_type', 'latitude', 'longitude')
+
+# Relative importance of each feature group in the distance.
+WEIGHTS = {
+    'price': 3.0,
+    'sqft': 1.5,
+    'bedrooms': 1.0,
+    'bathrooms': 0.5,
+    'property_type': 2.0,
+    'location': 2.0,
+}
+
+# Two listings this far apart differ by one unit of location distance,
+# comparable to one standard deviation of the numeric features.
+LOCATION_SCALE_KM = 25.0
+EARTH_RADIUS_KM = 6371.0088
+
+NUMERIC = ('price', 'sqft', 'bedrooms', 'bathrooms')
+
+
+def similar_count():
+    return getattr(settings, 'SIMILAR_LISTINGS_COUNT', 4)
+
+
+def _numeric(row):
+    _pk, price, sqft, bedrooms, bathrooms = row[:5]
+    return [math.log1p(max(price, 0)), math.log1p(max(sqft, 0)), bedrooms, bathrooms]
+
+
+def _unit_vector(latitude, longitude):
+    lat = math.radians(latitude)
+    lng = math.radians(longitude)
+    return [math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat)]
+
+
+class SimilarityIndex:
+    """Feature matrix of the published listings, keyed by listing id."""
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.types = {kind: i for i, kind in enumerate(sorted({row[5] for row in rows}))}
+        numeric = np.array([_numeric(row) for row in rows], dtype=np.float64).reshape(-1, len(NUMERIC))
+        self.mean = numeric.mean(axis=0) if len(rows) else np.zeros(len(NUMERIC))
+        scale = numeric.std(axis=0) if len(rows) else np.ones(len(NUMERIC))
+        scale[scale == 0] = 1.0
+        self.scale = scale
+
+        # Listings without coordinates sit at the centroid of the others so
+        # they are neither near nor far from everything.
+        located = [_unit_vector(row[6], row[7]) for row in rows if row[6] is not None and row[7] is not None]
+        centroid = np.mean(located, axis=0) if located else np.zeros(3)
+        self.centroid = centroid
+
+        self.weights = np.sqrt(np.array(
+            [WEIGHTS[name] for name in NUMERIC]
+            + [WEIGHTS['property_type']] * len(self.types)
+            + [WEIGHTS['location'] * EARTH_RADIUS_KM / LOCATION_SCALE_KM] * 3
+        ))
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        matrix = np.array([self.vector(row) for row in rows], dtype=np.float32).reshape(-1, len(self.weights))
+        self._lock = threading.Lock()
+        self._state = self._make_state(ids, matrix)
+
+    @staticmethod
+    def _make_state(ids, matrix, positions=None):
+        # Squared distance |m - v|^2 = |m|^2 - 2 m.v + |v|^2; the last term is
+        # the same for every row, so ranking needs only the row norms and
+        # one matrix-vector product.
+        norms = np.einsum('ij,ij->i', matrix, matrix)
+        if positions is None:
+            positions = {int(pk): i for i, pk in enumerate(ids)}
+        return ids, matrix, norms, positions
+
+    def __len__(self):
+        return len(self._state[0])
+
+    def vector(self, row):
+        """The weighted feature vector of a ``FIELDS`` row."""
+        features = (np.array(_numeric(row)) - self.mean) / self.scale
+        kind = np.zeros(len(self.types))
+        if row[5] in self.types:
+            kind[self.types[row[5]]] = 1.0
+        if row[6] is not None and row[7] is not None:
+            location = np.array(_unit_vector(row[6], row[7]))
+        else:
+            location = self.centroid
+        return np.concatenate([features, kind, location]) * self.weights
+
+    def accepts(self, row):
+        """Whether ``row`` can be added without renormalizing (known property type)."""
+        return row[5] in self.types
+
+    def upsert(self, row):
+        with self._lock:
+            ids, matrix, _norms, positions = self._state
+            vector = self.vector(row).astype(np.float32)
+            position = positions.get(row[0])
+            if position is None:
+                ids = np.append(ids, np.int64(row[0]))
+                matrix = np.vstack([matrix, vector])
+                positions = {**positions, row[0]: len(ids) - 1}
+            else:
+                matrix = matrix.copy()
+                matrix[position] = vector
+            self._state = self._make_state(ids, matrix, positions)
+
+    def remove(self, pk):
+        with self._lock:
+            ids, matrix, _norms, positions = self._state
+            position = positions.get(pk)
+            if position is None:
+                return
+            self._state = self._make_state(np.delete(ids, position), np.delete(matrix, position, axis=0))
+
+    def nearest(self, row, count):
+        """Ids of the ``count`` listings closest to ``row``, nearest first."""
+        ids, matrix, norms, positions = self._state
+        position = positions.get(row[0])
+        vector = matrix[position] if position is not None else self.vector(row).astype(np.float32)
+        distances = norms - 2 * (matrix @ vector)
+        if position is not None:
+            distances[position] = np.inf
+        count = min(count, len(ids) - (position is not None))
+        if count <= 0:
+            return []
+        candidates = np.argpartition(distances, count - 1)[:count]
+        candidates = candidates[np.argsort(distances[candidates])]
+        return [int(pk) for pk in ids[candidates]]
+
+
+def build_index():
+    rows = Listing.objects.filter(is_published=True).values_list(*FIELDS).iterator(chunk_size=2000)
+    return SimilarityIndex(rows)
+
+
+_local = LocalIndex(SIMILAR_VERSION_KEY, build_index)
+
+
+def get_index():
+    return _local.get()
+
+
+def version():
+    """What cached results computed from the matrix are keyed on (see ``pagecache``)."""
+    return _local.version() if np is not None else None
+
+
+def _row(listing):
+    return tuple(getattr(listing, field) for field in FIELDS)
+
+
+def listing_changed(listing):
+    if np is None:
+        return
+    row = _row(listing)
+
+    def change(index):
+        if not listing.is_published:
+            index.remove(listing.pk)
+        elif not index.accepts(row):
+            # A new property type adds a column; renormalize from scratch.
+            return False
+        else:
+            index.upsert(row)
+
+    _local.apply(change)
+
+
+def listing_deleted(listing_id):
+    if np is None:
+        return
+    _local.apply(lambda index: index.remove(listing_id))
+
+
+def invalidate():
+    """Rebuild from the database on next use, in every process (after bulk writes)."""
+    _local.invalidate()
+
+
+def similar_listings(listing, count=None):
+    """The listings most similar to ``listing``; empty without NumPy."""
+    if np is None:
+        return []
+    ids = get_index().nearest(_row(listing), count or similar_count())
+    found = Listing.objects.filter(is_published=True).prefetch_related('photos').in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
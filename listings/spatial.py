@@ -0,0 +1,207 @@
+"""Spatial index and radius ("near me") search over Listing coordinates.
+
+``lat``, ``lng`` and ``radius`` (kilometres) restrict a listing query to a
+circle around a point. The circle's bounding box is looked up in an index
+first and only those candidates get the exact great-circle distance:
+
+* SQLite (the default ``db.sqlite3``) keeps an R*Tree virtual table,
+  ``listings_listing_rtree``, whose id is the listing id. It is created by
+  migration ``0007_listing_rtree`` and kept in sync by the Listing signals
+  in ``listings/signals.py``.
+* Any other backend filters the bounding box on ``latitude``/``longitude``
+  directly, which the ``listing_pub_lat_lng_idx`` index covers.
+
+``sort=distance`` orders the results nearest first.
+"""
+import math
+
+from django.db import connection
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+from .clustering import filter_bbox
+from .params import ParameterError, parse_float
+
+RTREE_TABLE = 'listings_listing_rtree'
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def is_supported(conn=None):
+    conn = conn or connection
+    return conn.vendor == 'sqlite'
+
+
+def parse_near(params):
+    """``(latitude, longitude, radius_km)`` from ``params``, or ``None``.
+
+    Raise ``ParameterError`` if only some of the parameters are given or a
+    value is malformed or out of range.
+    """
+    values = [params.get(name) for name in ('lat', 'lng', 'radius')]
+    if not any(values):
+        return None
+    if not all(values):
+        raise ParameterError('lat, lng and radius must be given together')
+    latitude, longitude, radius = (
+        parse_float(value, name) for value, name in zip(values, ('lat', 'lng', 'radius'))
+    )
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ParameterError('lat must be within -90..90 and lng within -180..180')
+    if radius <= 0:
+        raise ParameterError('radius must be a positive number of kilometres')
+    return latitude, longitude, radius
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """``(west, south, east, north)`` enclosing the circle.
+
+    ``west`` is greater than ``east`` when the box crosses the antimeridian.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    south = latitude - math.degrees(angle)
+    north = latitude + math.degrees(angle)
+    if south <= -90 or north >= 90 or angle >= math.pi / 2:
+        # The circle contains a pole: every longitude is in range.
+        return -180.0, max(south, -90.0), 180.0, min(north, 90.0)
+    delta = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+    west = (longitude - delta + 180) % 360 - 180
+    east = (longitude + delta + 180) % 360 - 180
+    return west, south, east, north
+
+
+def distance_expression(latitude, longitude):
+    """Haversine distance in kilometres from the point to each row."""
+    lat1 = math.radians(latitude)
+    lng1 = math.radians(longitude)
+    lat2 = Radians(F('latitude'))
+    lng2 = Radians(F('longitude'))
+    a = (
+        Power(Sin((lat2 - Value(lat1)) / 2), 2)
+        + Value(math.cos(lat1)) * Cos(lat2) * Power(Sin((lng2 - Value(lng1)) / 2), 2)
+    )
+    # Least() guards against rounding just above 1 for antipodal points.
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)), output_field=FloatField())
+
+
+# --- Schema ---------------------------------------------------------------
+
+def create_index(conn=None):
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} "
+            "USING rtree(id, min_lat, max_lat, min_lng, max_lng)"
+        )
+
+
+def drop_index(conn=None):
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {RTREE_TABLE}")
+
+
+# --- Sync -----------------------------------------------------------------
+
+def index_listing(listing, conn=None):
+    """Insert, move or (without coordinates) remove a listing's point."""
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    if listing.latitude is None or listing.longitude is None:
+        unindex_listing(listing.pk, conn)
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"INSERT OR REPLACE INTO {RTREE_TABLE} VALUES (%s, %s, %s, %s, %s)",
+            [listing.pk, listing.latitude, listing.latitude, listing.longitude, listing.longitude],
+        )
+
+
+def index_listings(listings, conn=None):
+    """``index_listing()`` for many listings in a few statements."""
+    conn = conn or connection
+    if not is_supported(conn) or not listings:
+        return
+    located = [
+        (listing.pk, listing.latitude, listing.latitude, listing.longitude, listing.longitude)
+        for listing in listings if listing.latitude is not None and listing.longitude is not None
+    ]
+    unlocated = [listing.pk for listing in listings if listing.latitude is None or listing.longitude is None]
+    with conn.cursor() as cursor:
+        for start in range(0, len(unlocated), 500):
+            ids = unlocated[start:start + 500]
+            cursor.execute(f"DELETE FROM {RTREE_TABLE} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+        if located:
+            cursor.executemany(f"INSERT OR REPLACE INTO {RTREE_TABLE} VALUES (%s, %s, %s, %s, %s)", located)
+
+
+def unindex_listing(listing_id, conn=None):
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {RTREE_TABLE} WHERE id = %s", [listing_id])
+
+
+def rebuild_index(conn=None, listing_model=None):
+    """Repopulate the whole index from the Listing table in one statement."""
+    conn = conn or connection
+    if not is_supported(conn):
+        return
+    table = listing_model._meta.db_table if listing_model else 'listings_listing'
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {RTREE_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {RTREE_TABLE} "
+            f"SELECT id, latitude, latitude, longitude, longitude FROM {table} "
+            "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+        )
+
+
+# --- Querying -------------------------------------------------------------
+
+def _filter_rtree(queryset, bbox):
+    west, south, east, north = bbox
+    table = queryset.model._meta.db_table
+    # R*Tree stores 32-bit floats rounded outwards, so the box lookup never
+    # misses a point; the exact distance filter removes the extra ones.
+    box = "min_lat <= %s AND max_lat >= %s"
+    params = [north, south]
+    if west <= east:
+        box += " AND min_lng <= %s AND max_lng >= %s"
+        params += [east, west]
+    else:
+        box += " AND (max_lng >= %s OR min_lng <= %s)"
+        params += [west, east]
+    return queryset.extra(
+        where=[f"{table}.id IN (SELECT id FROM {RTREE_TABLE} WHERE {box})"],
+        params=params,
+    )
+
+
+def filter_near(queryset, near, sort=False):
+    """Restrict ``queryset`` to listings within ``near = (lat, lng, radius_km)``.
+
+    When ``sort`` is true the queryset is annotated with ``distance``
+    (kilometres) and ordered by it, nearest first.
+    """
+    latitude, longitude, radius = near
+    bbox = bounding_box(latitude, longitude, radius)
+    if is_supported():
+        queryset = _filter_rtree(queryset, bbox)
+    else:
+        queryset = filter_bbox(queryset, bbox)
+
+    distance = distance_expression(latitude, longitude)
+    if not sort:
+        return queryset.alias(distance=distance).filter(distance__lte=radius)
+    return (
+        queryset.annotate(distance=distance)
+        .filter(distance__lte=radius)
+        .order_by('distance', *queryset.query.order_by)
+    )
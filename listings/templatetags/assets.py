@@ -0,0 +1,17 @@
+"""``<link>``/``<script>`` tags of the CSS and JS bundles (see listings/assets.py)."""
+from django import template
+
+from listings.assets import render_tags
+
+register = template.Library()
+
+
+@register.simple_tag
+def bundle(name):
+    """The tags including bundle ``name``: the built bundle, or else its sources.
+
+    Usage::
+
+        {% bundle 'site.css' %}
+    """
+    return render_tags(name)
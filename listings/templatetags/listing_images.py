@@ -0,0 +1,54 @@
+"""Responsive ``<img>`` markup for listing and realtor photos (see listings/images.py)."""
+from django import template
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from listings import thumbnails
+from listings.images import derivative_name, derivative_widths, has_derivatives, srcset
+
+register = template.Library()
+
+# Listing cards: three per row on large screens, two on medium, one below.
+CARD_SIZES = '(min-width: 992px) 350px, (min-width: 768px) 50vw, 100vw'
+
+
+@register.simple_tag
+def responsive_image(image, sizes=CARD_SIZES, **attrs):
+    """A ``<picture>`` offering the WebP and JPEG variants of ``image`` to the browser.
+
+    Usage::
+
+        {% responsive_image listing.photo_main class="card-img-top" alt=listing.title %}
+
+    Until the variants exist the sizes come from the on-demand thumbnails
+    (see listings/thumbnails.py), with the original as ``src``.
+    """
+    if not image:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    name = image.name
+    if not has_derivatives(name):
+        fallback_srcset = thumbnails.srcset(name, derivative_widths())
+        if not fallback_srcset:
+            return format_html('<img src="{}"{}>', image.url, flatatt(attrs))
+        return format_html(
+            '<img src="{}" srcset="{}" sizes="{}"{}>', image.url, fallback_srcset, sizes, flatatt(attrs),
+        )
+    widths = derivative_widths()
+    fallback = default_storage.url(derivative_name(name, widths[len(widths) // 2], 'jpeg'))
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        srcset(name, 'webp'), sizes, fallback, srcset(name, 'jpeg'), sizes, flatatt(attrs),
+    )
+
+
+@register.filter
+def image_srcset(image, fmt='webp'):
+    """``srcset`` value for the ``fmt`` variants of ``image`` (thumbnails until they exist)."""
+    if not image:
+        return ''
+    if not has_derivatives(image.name):
+        return thumbnails.srcset(image.name, derivative_widths())
+    return srcset(image.name, fmt)
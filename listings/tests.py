@@ -1,3 +1,1065 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission, User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from listings import (
+    assets, clustering, facets, feed, fulltext, geocache, geocoding, geojson, images, jobs, pagecache,
+    readmodel, similar, thumbnails, tiles,
+)
+from listings.management.commands.explain_listing_queries import full_scans
+from listings.management.commands.import_listings import REQUIRED_HEADERS, row_hash
+from listings.localindex import LocalIndex, bump_version
+from listings.models import GeocodeCacheEntry, IndexVersion, Job, Listing
+from listings.pagination import KeysetPaginator, paginate_listings
+from listings.queries import filter_fingerprint, mapped_listings, search_results
+from realtors.models import Realtor
+
+# Tests must not share the page cache or the tiles of the running site.
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-default'},
+    'pages': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-pages'},
+}
+
+
+def make_realtor(**fields):
+    values = {'name': 'Test Realtor', 'photo': 'photos/realtor.jpg', 'phone': '0', 'email': 'r@example.com'}
+    values.update(fields)
+    return Realtor.objects.create(**values)
+
+
+def make_listing(realtor, **fields):
+    values = {
+        'realtor': realtor, 'title': 'Sea view flat', 'address': '1 Test Street', 'city': 'Istanbul',
+        'state': 'Istanbul', 'zipcode': '34000', 'latitude': 41.0, 'longitude': 29.0, 'price': 1000000,
+        'bedrooms': 2, 'property_type': 'Apartment', 'bathrooms': 1, 'sqft': 900, 'lot_size': Decimal('0.0'),
+    }
+    values.update(fields)
+    return Listing.objects.create(**values)
+
+
+calls = []
+
+
+@jobs.task('tests.record')
+def record(value, fail=False):
+    calls.append(value)
+    if fail:
+        raise RuntimeError('task failed')
+
+
+class TempDirMixin:
+    """A fresh temporary directory per test, removed afterwards."""
+
+    def make_temp_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        return path
+
+
+@override_settings(CACHES=TEST_CACHES)
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        self.realtor = make_realtor()
+        self.flat = make_listing(self.realtor, description='A short walk to the public garden.')
+        self.villa = make_listing(self.realtor, title='Garden villa', city='Bağdat')
+
+    def search(self, keywords):
+        return list(fulltext.filter_queryset(Listing.objects.all(), keywords))
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('garden'), [self.villa, self.flat])
+
+    def test_every_token_must_match_as_a_prefix(self):
+        self.assertEqual(self.search('gard walk'), [self.flat])
+        self.assertEqual(self.search('bagdat'), [self.villa])
+        # Query syntax is searched for, never parsed.
+        self.assertEqual(self.search('villa OR "flat'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.villa.title = 'Stone cottage'
+        self.villa.save()
+        self.assertEqual(self.search('villa'), [])
+        self.assertEqual(self.search('cottage'), [self.villa])
+        self.villa.delete()
+        self.assertEqual(self.search('cottage'), [])
+
+    def test_rebuild_indexes_rows_written_without_signals(self):
+        Listing.objects.filter(pk=self.flat.pk).update(title='Harbour loft')
+        self.assertEqual(self.search('harbour'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('harbour'), [self.flat])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ChangeTrackingTests(TestCase):
+    def setUp(self):
+        self.realtor = make_realtor()
+        self.listing = make_listing(self.realtor)
+
+    def test_saved_instance_has_no_changes(self):
+        self.assertFalse(self.listing.has_changed())
+        loaded = Listing.objects.get(pk=self.listing.pk)
+        self.assertEqual(loaded.changed_fields(), set())
+
+    def test_new_instance_counts_every_field_as_changed(self):
+        listing = Listing(realtor=self.realtor, title='New')
+        self.assertIn('title', listing.changed_fields())
+        self.assertIn('price', listing.changed_fields())
+
+    def test_changed_fields_lists_modified_fields(self):
+        loaded = Listing.objects.get(pk=self.listing.pk)
+        loaded.title = 'Garden flat'
+        loaded.price = 2000000
+        self.assertEqual(loaded.changed_fields(), {'title', 'price'})
+        self.assertTrue(loaded.has_changed('title'))
+        self.assertFalse(loaded.has_changed('city'))
+
+    def test_save_changes_writes_only_modified_fields(self):
+        loaded = Listing.objects.get(pk=self.listing.pk)
+        # Written by someone else after ``loaded`` was read.
+        Listing.objects.filter(pk=self.listing.pk).update(price=5)
+        loaded.title = 'Garden flat'
+        self.assertEqual(loaded.save_changes(), {'title'})
+        stored = Listing.objects.get(pk=self.listing.pk)
+        self.assertEqual((stored.title, stored.price), ('Garden flat', 5))
+        self.assertFalse(loaded.has_changed())
+
+    def test_save_changes_without_changes_writes_nothing(self):
+        loaded = Listing.objects.get(pk=self.listing.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(loaded.save_changes(), set())
+
+    def test_new_address_clears_coordinates(self):
+        loaded = Listing.objects.get(pk=self.listing.pk)
+        loaded.address = '2 Other Street'
+        loaded.save_changes()
+        stored = Listing.objects.get(pk=self.listing.pk)
+        self.assertIsNone(stored.latitude)
+        self.assertIsNone(stored.longitude)
+
+
+@override_settings(JOB_MAX_ATTEMPTS=2)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_claimed_job_runs_once_and_is_deleted(self):
+        job = jobs.enqueue('tests.record', key='a', value=1)
+        self.assertIsNone(jobs.enqueue('tests.record', key='a', value=2))
+        claimed = jobs.claim('worker-1')
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (job.pk, Job.RUNNING, 1))
+        self.assertIsNone(jobs.claim('worker-2'))
+        self.assertTrue(jobs.run_job(claimed))
+        self.assertEqual(calls, [1])
+        self.assertFalse(Job.objects.filter(kind='tests.record').exists())
+
+    def test_failing_job_is_retried_then_kept_as_failed(self):
+        jobs.enqueue('tests.record', value=1, fail=True)
+        with self.assertLogs('listings.jobs', 'WARNING'):
+            self.assertFalse(jobs.run_job(jobs.claim('worker-1')))
+        job = Job.objects.get(kind='tests.record')
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIsNone(jobs.claim('worker-1'))
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('listings.jobs', 'WARNING'):
+            self.assertFalse(jobs.run_job(jobs.claim('worker-1')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertIn('task failed', job.last_error)
+
+    def test_unknown_kind_is_refused(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('tests.unknown')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SyncImportTests(TempDirMixin, TestCase):
+    def setUp(self):
+        self.realtor = make_realtor()
+        self.rows = [self.row(str(i)) for i in range(3)]
+
+    def row(self, external_id, **values):
+        row = {header: '' for header in REQUIRED_HEADERS}
+        row.update({
+            'external_id': external_id, 'realtor': str(self.realtor.pk), 'title': f'Listing {external_id}',
+            'address': f'{external_id} Feed Street', 'city': 'Istanbul', 'state': 'Istanbul',
+            'zipcode': '34000', 'price': '100000', 'bedrooms': '2', 'property_type': 'Apartment',
+            'bathrooms': '1', 'garage': '0', 'sqft': '800', 'lot_size': '0.0', 'is_published': 'true',
+        })
+        row.update(values)
+        return row
+
+    def import_rows(self, rows, *options):
+        path = os.path.join(self.make_temp_dir(), 'feed.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['external_id'] + REQUIRED_HEADERS)
+            writer.writeheader()
+            writer.writerows(rows)
+        out = StringIO()
+        call_command('import_listings', path, *options, stdout=out)
+        return out.getvalue()
+
+    def sync(self, rows):
+        return self.import_rows(rows, '--sync')
+
+    def test_row_hash_follows_the_imported_columns(self):
+        row = self.row('1')
+        self.assertEqual(row_hash(row), row_hash(dict(row)))
+        self.assertEqual(row_hash(row), row_hash({**row, 'title': f" {row['title']} "}))
+        self.assertNotEqual(row_hash(row), row_hash({**row, 'price': '200000'}))
+
+    def test_first_sync_creates_every_listing(self):
+        output = self.sync(self.rows)
+        self.assertIn('Created 3, updated 0, unpublished 0 listings; 0 unchanged.', output)
+        listing = Listing.objects.get(external_id='1')
+        self.assertEqual(listing.content_hash, row_hash(self.rows[1]))
+
+    def test_unchanged_feed_writes_nothing(self):
+        self.sync(self.rows)
+        updated_at = dict(Listing.objects.values_list('external_id', 'updated_at'))
+        output = self.sync(self.rows)
+        self.assertIn('Created 0, updated 0, unpublished 0 listings; 3 unchanged.', output)
+        self.assertEqual(dict(Listing.objects.values_list('external_id', 'updated_at')), updated_at)
+
+    def test_changed_and_missing_rows(self):
+        self.sync(self.rows)
+        changed = self.row('0', price='250000')
+        output = self.sync([changed, self.rows[1]])
+        self.assertIn('Created 0, updated 1, unpublished 1 listings; 1 unchanged.', output)
+        listing = Listing.objects.get(external_id='0')
+        self.assertEqual((listing.price, listing.content_hash), (250000, row_hash(changed)))
+        self.assertFalse(Listing.objects.get(external_id='2').is_published)
+
+    def test_changed_rows_do_not_load_their_realtors(self):
+        rows = [self.row(str(i)) for i in range(20)]
+        self.sync(rows)
+        other = make_realtor(name='Other Realtor')
+        rows = [self.row(str(i), realtor=str(other.pk), price='150000') for i in range(20)]
+        with CaptureQueriesContext(connection) as queries:
+            output = self.sync(rows)
+        self.assertIn('Created 0, updated 20, unpublished 0 listings; 0 unchanged.', output)
+        self.assertEqual(set(Listing.objects.values_list('realtor_id', flat=True)), {other.pk})
+        realtor_queries = [query['sql'] for query in queries if 'FROM "realtors_realtor"' in query['sql']]
+        self.assertEqual(len(realtor_queries), 1, realtor_queries)
+
+    def test_caches_are_dropped_and_geocoding_queued_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.sync(self.rows)
+        self.assertFalse(Job.objects.filter(kind='geocode_listing').exists())
+        self.assertFalse(IndexVersion.objects.filter(key=readmodel.READ_MODEL_VERSION_KEY).exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(Job.objects.filter(kind='geocode_listing').count(), 3)
+        self.assertTrue(IndexVersion.objects.filter(key=readmodel.READ_MODEL_VERSION_KEY).exists())
+
+    def test_bulk_mode_indexes_each_batch_and_queues_geocoding(self):
+        rows = [self.row(str(i), title=f'Harbour loft {i}') for i in range(5)]
+        rows.append(self.row('5', realtor='999999'))
+        with self.captureOnCommitCallbacks(execute=True):
+            output = self.import_rows(rows, '--bulk', '--batch-size', '2')
+        self.assertIn('Created 5 listings. Skipped 1 rows.', output)
+        self.assertIn('Skipped rows due to missing Realtor IDs: [7]', output)
+        self.assertEqual(fulltext.filter_queryset(Listing.objects.all(), 'harbour').count(), 5)
+        self.assertEqual(Job.objects.filter(kind='geocode_listing').count(), 5)
+
+    def test_returning_row_is_published_again(self):
+        self.sync(self.rows)
+        self.sync(self.rows[:2])
+        output = self.sync(self.rows)
+        self.assertIn('updated 1', output)
+        self.assertTrue(Listing.objects.get(external_id='2').is_published)
+
+
+@override_settings(CACHES=TEST_CACHES, MAP_TILE_MAX_ZOOM=5)
+class TileInvalidationTests(TempDirMixin, TestCase):
+    def setUp(self):
+        self.tile_root = self.make_temp_dir()
+        override = override_settings(MAP_TILE_ROOT=self.tile_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.realtor = make_realtor()
+        self.listing = make_listing(self.realtor, latitude=41.0, longitude=29.0)
+
+    def tile(self, latitude, longitude, z):
+        return (z, *tiles.tile_for(latitude, longitude, z))
+
+    def test_missing_tile_is_built_and_stored(self):
+        tile = self.tile(41.0, 29.0, 5)
+        body, etag = tiles.get_tile(*tile)
+        self.assertIn(b'"type":"FeatureCollection"', body)
+        self.assertTrue(os.path.exists(tiles.tile_path(*tile)))
+        self.assertEqual(tiles.get_tile(*tile), (body, etag))
+
+    def test_invalidate_point_drops_the_tiles_containing_it(self):
+        here = [self.tile(41.0, 29.0, z) for z in range(6)]
+        elsewhere = self.tile(-33.9, 18.4, 5)
+        for tile in here + [elsewhere]:
+            tiles.get_tile(*tile)
+        tiles.invalidate_point(41.0, 29.0)
+        for tile in here:
+            self.assertFalse(os.path.exists(tiles.tile_path(*tile)), tile)
+        self.assertTrue(os.path.exists(tiles.tile_path(*elsewhere)))
+
+    def test_tile_invalidated_while_it_is_built_is_not_stored(self):
+        tile = self.tile(41.0, 29.0, 5)
+        build_tile = tiles.build_tile
+
+        def build_during_a_save(*args):
+            body = build_tile(*args)
+            tiles.invalidate_point(41.0, 29.0)
+            return body
+
+        with mock.patch.object(tiles, 'build_tile', build_during_a_save):
+            body, _etag = tiles.get_tile(*tile)
+        self.assertIn(b'"type":"FeatureCollection"', body)
+        self.assertFalse(os.path.exists(tiles.tile_path(*tile)))
+        tiles.get_tile(*tile)
+        self.assertTrue(os.path.exists(tiles.tile_path(*tile)))
+
+    def test_invalidation_is_repeated_after_commit(self):
+        tile = self.tile(41.0, 29.0, 5)
+        with self.captureOnCommitCallbacks() as callbacks:
+            tiles.invalidate_point(41.0, 29.0)
+        # Built by another process from the rows as they were before the commit.
+        tiles.get_tile(*tile)
+        for callback in callbacks:
+            callback()
+        self.assertFalse(os.path.exists(tiles.tile_path(*tile)))
+
+    def test_moving_a_listing_drops_its_old_and_new_tiles(self):
+        old_tile = self.tile(41.0, 29.0, 5)
+        new_tile = self.tile(-33.9, 18.4, 5)
+        tiles.get_tile(*old_tile)
+        tiles.get_tile(*new_tile)
+        self.listing.latitude, self.listing.longitude = -33.9, 18.4
+        self.listing.save()
+        self.assertFalse(os.path.exists(tiles.tile_path(*old_tile)))
+        self.assertFalse(os.path.exists(tiles.tile_path(*new_tile)))
+        body, _etag = tiles.get_tile(*new_tile)
+        self.assertIn(b'"count":1', body)
+
+
+@override_settings(CACHES=TEST_CACHES, MAP_TILE_MAX_ZOOM=15)
+class SaveCoordinatesTests(TempDirMixin, TestCase):
+    def setUp(self):
+        override = override_settings(MAP_TILE_ROOT=self.make_temp_dir())
+        override.enable()
+        self.addCleanup(override.disable)
+        self.realtor = make_realtor()
+
+    def test_tiles_at_the_old_and_new_position_are_dropped(self):
+        listing = make_listing(self.realtor)
+        old_tile = (15, *tiles.tile_for(41.0, 29.0, 15))
+        new_tile = (15, *tiles.tile_for(41.5, 29.5, 15))
+        self.assertIn(f'"id":{listing.pk}'.encode(), tiles.get_tile(*old_tile)[0])
+        tiles.get_tile(*new_tile)
+        listing.latitude, listing.longitude = 41.5, 29.5
+        geocoding.save_coordinates([listing])
+        self.assertFalse(os.path.exists(tiles.tile_path(*old_tile)))
+        self.assertFalse(os.path.exists(tiles.tile_path(*new_tile)))
+        self.assertNotIn(f'"id":{listing.pk}'.encode(), tiles.get_tile(*old_tile)[0])
+
+    def test_batch_rebuilds_the_in_memory_indexes_once(self):
+        listings = [make_listing(self.realtor, latitude=None, longitude=None) for _ in range(3)]
+        for listing in listings:
+            listing.latitude, listing.longitude = 41.0, 29.0
+        with mock.patch.object(readmodel, 'listing_changed') as changed, \
+                mock.patch.object(readmodel, 'invalidate') as invalidate:
+            geocoding.save_coordinates(listings)
+        changed.assert_not_called()
+        invalidate.assert_called_once_with()
+
+
+class GeocodeCacheTests(TestCase):
+    def test_equivalent_spellings_share_a_key(self):
+        self.assertEqual(
+            geocache.cache_key('12 Main St., Apt 4B, Orlando'),
+            geocache.cache_key('12 MAIN STREET  Suite 300 orlando'),
+        )
+        self.assertEqual(geocache.normalize('Bağdat Cd. No 5 Daire 3'), 'bagdat caddesi no 5')
+
+    def test_state_and_zipcode_are_kept(self):
+        self.assertEqual(geocache.normalize('12 Main St, Orlando, FL 32801'), '12 main street orlando fl 32801')
+        self.assertNotEqual(
+            geocache.cache_key('12 Main St, Orlando, FL 32801'),
+            geocache.cache_key('12 Main St, Orlando, FL 32802'),
+        )
+
+    def test_answers_are_cached_until_they_expire(self):
+        geocache.store_many({'1 Found Street': (41.0, 29.0), '2 Nowhere Street': None})
+        self.assertEqual(
+            geocache.lookup_many(['1 found st', '2 Nowhere Street', '3 New Street']),
+            {'1 found st': (41.0, 29.0), '2 Nowhere Street': geocache.NOT_FOUND},
+        )
+        self.assertEqual(GeocodeCacheEntry.objects.get(latitude=41.0).hits, 1)
+        GeocodeCacheEntry.objects.update(expires_at=timezone.now())
+        self.assertIsNone(geocache.lookup('1 Found Street'))
+        self.assertEqual(geocache.purge_expired(), 2)
+
+
+class QueryPlanTests(TestCase):
+    def test_full_scans_spots_a_table_scan(self):
+        plan = '3 0 0 SCAN listings_listing\n5 0 0 SCAN realtors_realtor'
+        self.assertEqual(full_scans(plan, 'sqlite', 'listings_listing'), ['3 0 0 SCAN listings_listing'])
+        plan = '3 0 0 SCAN listings_listing USING INDEX listing_pub_date_id_idx'
+        self.assertEqual(full_scans(plan, 'sqlite', 'listings_listing'), [])
+
+    def test_listing_queries_use_an_index(self):
+        out, err = StringIO(), StringIO()
+        try:
+            call_command('explain_listing_queries', stdout=out, stderr=err)
+        except CommandError as e:
+            self.fail(f'{e}\n{err.getvalue()}')
+        self.assertNotIn('FULL SCAN', err.getvalue())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LocalIndexTests(TestCase):
+    def setUp(self):
+        self.builds = 0
+
+        def build():
+            self.builds += 1
+            return [self.builds]
+
+        self.index = LocalIndex('tests:index', build)
+
+    @override_settings(LOCAL_INDEX_CHECK_INTERVAL=0)
+    def test_change_in_another_process_rebuilds(self):
+        self.assertEqual(self.index.get(), [1])
+        self.assertEqual(self.index.get(), [1])
+        # What another process's bump_version() leaves in the table.
+        IndexVersion.objects.create(key='tests:index', version=7)
+        self.assertEqual(self.index.get(), [2])
+
+    @override_settings(LOCAL_INDEX_CHECK_INTERVAL=0)
+    def test_own_change_is_applied_in_place(self):
+        index = self.index.get()
+        self.index.apply(lambda index: index.append('changed'))
+        self.assertIs(self.index.get(), index)
+        self.assertEqual(index, [1, 'changed'])
+        IndexVersion.objects.filter(key='tests:index').update(version=F('version') + 1)
+        self.index.apply(lambda index: index.append('lost'))
+        self.assertEqual(self.index.get(), [2])
+
+    @override_settings(LOCAL_INDEX_CHECK_INTERVAL=3600)
+    def test_shared_version_is_read_once_per_interval(self):
+        self.index.get()
+        with self.assertNumQueries(0):
+            self.index.get()
+
+    @override_settings(LOCAL_INDEX_CHECK_INTERVAL=3600)
+    def test_search_leaves_out_listings_unpublished_elsewhere(self):
+        realtor = make_realtor()
+        shown, hidden = make_listing(realtor), make_listing(realtor)
+        readmodel.invalidate()
+        self.assertEqual({listing.pk for listing in search_results({})}, {shown.pk, hidden.pk})
+        # Unpublished without the signals, as seen by a worker whose read model is behind.
+        Listing.objects.filter(pk=hidden.pk).update(is_published=False)
+        self.assertEqual([listing.pk for listing in search_results({})], [shown.pk])
+
+
+@override_settings(CACHES=TEST_CACHES, LOCAL_INDEX_CHECK_INTERVAL=0)
+class SimilarListingsTests(TestCase):
+    def test_listings_added_by_another_process_are_recommended(self):
+        realtor = make_realtor()
+        listing = make_listing(realtor)
+        other = make_listing(realtor, price=1100000)
+        similar.invalidate()
+        self.assertEqual(similar.similar_listings(listing), [other])
+        # Written without the signals, like another process's rows.
+        twin = Listing.objects.bulk_create([Listing(**{
+            field.attname: getattr(listing, field.attname)
+            for field in Listing._meta.concrete_fields if not field.primary_key
+        })])[0]
+        self.assertEqual(similar.similar_listings(listing), [other])
+        bump_version(similar.SIMILAR_VERSION_KEY)
+        self.assertEqual(similar.similar_listings(listing), [twin, other])
+
+
+# Pages render without a collectstatic manifest.
+@override_settings(
+    CACHES=TEST_CACHES, LOCAL_INDEX_CHECK_INTERVAL=0,
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class PageCacheTests(TestCase):
+    def test_tags_bumped_in_a_transaction_are_bumped_again_on_commit(self):
+        before, = pagecache.tag_versions(['listings'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            pagecache.invalidate_tags('listings')
+        bumped, = pagecache.tag_versions(['listings'])
+        self.assertGreater(bumped, before)
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertGreater(pagecache.tag_versions(['listings'])[0], bumped)
+
+    def test_search_page_is_keyed_on_the_read_model_version(self):
+        realtor = make_realtor()
+        listing = make_listing(realtor)
+        readmodel.invalidate()
+        self.assertContains(self.client.get('/en/listings/search/'), 'Sea view flat')
+        # Another worker publishes a listing; this one learns it from IndexVersion.
+        Listing.objects.bulk_create([Listing(**{
+            **{field.attname: getattr(listing, field.attname)
+               for field in Listing._meta.concrete_fields if not field.primary_key},
+            'title': 'Garden villa',
+        })])
+        bump_version(readmodel.READ_MODEL_VERSION_KEY)
+        self.assertContains(self.client.get('/en/listings/search/'), 'Garden villa')
+
+
+@override_settings(CACHES=TEST_CACHES, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class HomepageFeedTests(TestCase):
+    def setUp(self):
+        self.realtor = make_realtor()
+        self.listing = make_listing(self.realtor)
+
+    def test_feed_is_bounded_and_newest_first(self):
+        with self.settings(HOMEPAGE_FEED_SIZE=2):
+            newer = [make_listing(self.realtor, title=f'Newer {i}') for i in range(2)]
+            self.assertEqual(feed.homepage_feed(), newer[::-1])
+
+    def test_feed_follows_the_shared_tag_version(self):
+        self.assertEqual(feed.homepage_feed(), [self.listing])
+        Listing.objects.filter(pk=self.listing.pk).update(is_published=False)
+        self.assertEqual(feed.homepage_feed(), [self.listing])
+        # What a save in any worker does to the shared cache.
+        pagecache.invalidate_tags(feed.FEED_TAG)
+        self.assertEqual(feed.homepage_feed(), [])
+
+    def test_homepage_shows_a_saved_listing(self):
+        self.assertContains(self.client.get('/en/'), 'Sea view flat')
+        self.listing.title = 'Garden villa'
+        self.listing.save()
+        response = self.client.get('/en/')
+        self.assertContains(response, 'Garden villa')
+        self.assertNotContains(response, 'Sea view flat')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        realtor = make_realtor()
+        for day in (1, 2, 2, 2, 3):
+            listing = make_listing(realtor)
+            Listing.objects.filter(pk=listing.pk).update(list_date=datetime(2024, 1, day, tzinfo=dt_timezone.utc))
+        self.expected = list(Listing.objects.order_by('-list_date', '-pk'))
+
+    def test_pages_walk_through_ties_both_ways(self):
+        paginator = KeysetPaginator(Listing.objects.all(), 2)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual([listing for page in pages for listing in page], self.expected)
+        self.assertFalse(pages[0].has_previous())
+
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = paginator.get_page(page.previous_cursor)
+            self.assertEqual(list(page), list(expected))
+        self.assertFalse(page.has_previous())
+
+    def test_invalid_cursor_shows_the_first_page(self):
+        page = KeysetPaginator(Listing.objects.all(), 2).get_page('not-a-cursor')
+        self.assertEqual(list(page), self.expected[:2])
+
+    def test_page_numbers_still_work(self):
+        request = RequestFactory().get('/en/listings/', {'page': 3})
+        page = paginate_listings(request, Listing.objects.order_by('-list_date', '-pk'), 2)
+        self.assertEqual(list(page), self.expected[4:])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MapDataStreamTests(TestCase):
+    def setUp(self):
+        self.realtor = make_realtor()
+        self.listing = make_listing(self.realtor, photo_main='photos/house.jpg')
+        make_listing(self.realtor, title='Unmapped', latitude=None, longitude=None)
+        make_listing(self.realtor, title='Withdrawn', is_published=False)
+
+    def test_map_data_streams_the_mapped_listings(self):
+        response = self.client.get('/en/listings/map-data/')
+        self.assertTrue(response.streaming)
+        collection = json.loads(b''.join(response.streaming_content))
+        feature, = collection['features']
+        self.assertEqual(feature['geometry'], {'type': 'Point', 'coordinates': [29.0, 41.0]})
+        properties = feature['properties']
+        self.assertEqual((properties['id'], properties['title']), (self.listing.pk, 'Sea view flat'))
+        self.assertEqual(properties['url'], f'/listings/{self.listing.pk}/')
+        self.assertEqual(properties['photos'], ['/media/photos/house.jpg'])
+        self.assertEqual(properties['photo_url'], '/media/photos/house.jpg')
+
+    def test_collection_is_written_in_chunks(self):
+        for i in range(4):
+            make_listing(self.realtor, title=f'Flat {i}')
+        chunks = list(geojson.stream_feature_collection(geojson.map_rows(mapped_listings({})), chunk_size=2))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(len(json.loads(''.join(chunks))['features']), 5)
+
+    def test_queries_do_not_grow_with_the_listings(self):
+        def query_count():
+            with CaptureQueriesContext(connection) as queries:
+                list(geojson.map_rows(mapped_listings({})))
+            return len(queries)
+
+        one = query_count()
+        for i in range(5):
+            make_listing(self.realtor, title=f'Flat {i}', photo_main=f'photos/flat{i}.jpg')
+        self.assertEqual(query_count(), one)
+
+
+@override_settings(CACHES=TEST_CACHES, LOCAL_INDEX_CHECK_INTERVAL=0)
+class MapViewportTests(TestCase):
+    def setUp(self):
+        realtor = make_realtor()
+        make_listing(realtor, price=100)
+        make_listing(realtor, latitude=41.01, longitude=29.01, price=300)
+        self.sydney = make_listing(realtor, title='Harbour loft', latitude=-33.9, longitude=151.2)
+
+    def features(self, query):
+        response = self.client.get(f'/en/listings/map-data/?{query}')
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return json.loads(content)['features']
+
+    def test_bbox_limits_the_listings(self):
+        self.assertEqual(len(self.features('bbox=28,40,30,42&zoom=16')), 2)
+        # Panned across the antimeridian: Leaflet reports east as 190.
+        feature, = self.features('bbox=150,-40,190,-30&zoom=16')
+        self.assertEqual(feature['properties']['id'], self.sydney.pk)
+
+    def test_zoomed_out_listings_are_clustered(self):
+        for read_model in (True, False):
+            with self.settings(LISTING_READ_MODEL=read_model):
+                clusters = sorted(self.features('zoom=3'), key=lambda feature: -feature['properties']['count'])
+                self.assertEqual([feature['properties']['count'] for feature in clusters], [2, 1], read_model)
+                properties = clusters[0]['properties']
+                self.assertEqual((properties['min_price'], properties['max_price']), (100, 300), read_model)
+                self.assertEqual(len(self.features('zoom=3&bbox=28,40,30,42')), 1, read_model)
+
+
+@override_settings(CACHES=TEST_CACHES, LOCAL_INDEX_CHECK_INTERVAL=0)
+class NearSearchTests(TestCase):
+    def setUp(self):
+        self.realtor = make_realtor()
+        self.besiktas = make_listing(self.realtor, title='Besiktas', latitude=41.043, longitude=29.005)
+        self.kadikoy = make_listing(self.realtor, title='Kadikoy', latitude=40.990, longitude=29.029)
+        self.ankara = make_listing(self.realtor, title='Ankara', latitude=39.933, longitude=32.860)
+
+    def search(self, **params):
+        return [listing.title for listing in search_results(params)]
+
+    def test_listings_within_the_radius_nearest_first(self):
+        near = {'lat': '41.0', 'lng': '29.0', 'radius': '10', 'sort': 'distance'}
+        for read_model in (True, False):
+            with self.settings(LISTING_READ_MODEL=read_model):
+                self.assertEqual(self.search(**near), ['Kadikoy', 'Besiktas'], read_model)
+                self.assertEqual(self.search(**{**near, 'radius': '4'}), ['Kadikoy'], read_model)
+
+    def test_circle_across_the_antimeridian(self):
+        make_listing(self.realtor, title='Taveuni', latitude=-16.8, longitude=179.95)
+        for read_model in (True, False):
+            with self.settings(LISTING_READ_MODEL=read_model):
+                self.assertEqual(self.search(lat='-16.8', lng='-179.95', radius='20'), ['Taveuni'], read_model)
+
+    def test_index_follows_moved_listings(self):
+        self.ankara.latitude, self.ankara.longitude = 41.0, 29.01
+        self.ankara.save()
+        near = {'lat': '41.0', 'lng': '29.0', 'radius': '2'}
+        with self.settings(LISTING_READ_MODEL=False):
+            self.assertEqual(self.search(**near), ['Ankara'])
+        self.ankara.delete()
+        with self.settings(LISTING_READ_MODEL=False):
+            self.assertEqual(self.search(**near), [])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ClusterCacheTests(TestCase):
+    def clusters(self):
+        collection = clustering.cached_cluster_collection(mapped_listings({}), 3, None, filter_fingerprint({}))
+        return sum(feature['properties']['count'] for feature in collection['features'])
+
+    def test_cached_clusters_are_not_served_after_their_version_was_evicted(self):
+        realtor = make_realtor()
+        make_listing(realtor)
+        with mock.patch.object(pagecache, '_initial_version', side_effect=[1000, 2000]):
+            self.assertEqual(self.clusters(), 1)
+            pagecache.page_cache().delete(pagecache.TAG_VERSION_KEY % clustering.CLUSTERS_TAG)
+            # Written without the signals; only the invalidation below tells.
+            Listing.objects.bulk_create([Listing(**{
+                field.attname: getattr(listing, field.attname)
+                for field in Listing._meta.concrete_fields if not field.primary_key
+            }) for listing in Listing.objects.all()])
+            clustering.invalidate_clusters()
+            self.assertEqual(self.clusters(), 2)
+
+
+@override_settings(CACHES=TEST_CACHES, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.realtor = make_realtor()
+        self.listing = make_listing(self.realtor)
+
+    def assertRevalidates(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_listing_pages_answer_304_until_a_listing_changes(self):
+        for url in ('/en/listings/', f'/en/listings/{self.listing.pk}/'):
+            etag = self.assertRevalidates(url)
+            self.listing.title = f'{self.listing.title}!'
+            self.listing.save()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_map_data_answers_304(self):
+        self.assertRevalidates('/en/listings/map-data/')
+
+
+@override_settings(CACHES=TEST_CACHES, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class MalformedParameterTests(TestCase):
+    def assertRejected(self, url, message):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 400, url)
+        self.assertIn(message, response.content.decode())
+        self.assertNotIn('literal', response.content.decode())
+
+    def test_search_explains_the_bad_parameter(self):
+        for read_model in (True, False):
+            with self.settings(LISTING_READ_MODEL=read_model):
+                self.assertRejected('/en/listings/search/?price=x', 'price must be a whole number')
+                self.assertRejected('/en/listings/search/?bedrooms=2.5', 'bedrooms must be a whole number')
+                self.assertRejected('/en/listings/search/?lat=x&lng=29&radius=5', 'lat must be a number')
+
+    def test_map_data_explains_the_bad_parameter(self):
+        self.assertRejected('/en/listings/map-data/?zoom=x', 'zoom must be a whole number')
+        self.assertRejected('/en/listings/map-data/?bbox=a,b,c,d', 'bbox must be a number')
+        self.assertRejected('/en/listings/map-data/?bbox=1,2,3', 'bbox must be four numbers')
+        self.assertRejected('/en/listings/map-data/?price=nan', 'price must be a whole number')
+
+
+@override_settings(CACHES=TEST_CACHES, LOCAL_INDEX_CHECK_INTERVAL=0)
+class FacetTests(TestCase):
+    def setUp(self):
+        realtor = make_realtor()
+        for bedrooms, state in ((1, 'NG-ABIA'), (2, 'NG-ABIA'), (3, 'NG-ADA')):
+            make_listing(realtor, bedrooms=bedrooms, state=state, price=bedrooms * 500000)
+        # A state spelled by its label does not match the state filter.
+        make_listing(realtor, bedrooms=3, state='Abia', price=1500000)
+        readmodel.invalidate()
+
+    def compute(self, params):
+        results = []
+        for read_model in (True, False):
+            with self.settings(LISTING_READ_MODEL=read_model):
+                results.append(facets.compute_facets(params))
+        # Both backends count alike; only the order of equal counts may differ.
+        self.assertEqual(*[
+            {name: sorted(value) if isinstance(value, list) else value for name, value in result.items()}
+            for result in results
+        ])
+        return results[0]
+
+    def options(self, options):
+        return {key: count for key, _label, count in options if count}
+
+    def test_facet_counts_leave_out_their_own_filter(self):
+        result = self.compute({'bedrooms': '1'})
+        self.assertEqual(result['total'], 1)
+        self.assertEqual(self.options(result['bedroom_options'])['1'], 1)
+        self.assertEqual(self.options(result['bedroom_options'])['3'], 4)
+        self.assertEqual(self.options(result['state_options']), {'NG-ABIA': 1})
+
+        result = self.compute({'state': 'NG-ABIA'})
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(self.options(result['state_options']), {'NG-ABIA': 2, 'NG-ADA': 1})
+        self.assertEqual(self.options(result['bedroom_options'])['3'], 2)
+
+    def test_states_are_counted_by_key(self):
+        self.assertEqual(self.options(self.compute({})['state_options']), {'NG-ABIA': 2, 'NG-ADA': 1})
+
+    def test_cached_counts_are_not_served_after_their_version_was_evicted(self):
+        with mock.patch.object(pagecache, '_initial_version', side_effect=[1000, 2000]):
+            self.assertEqual(facets.search_facets({})['total'], 4)
+            pagecache.page_cache().delete(pagecache.TAG_VERSION_KEY % facets.FACETS_TAG)
+            Listing.objects.filter(state='Abia').delete()
+            facets.invalidate_facets()
+            self.assertEqual(facets.search_facets({})['total'], 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExportTests(TempDirMixin, TestCase):
+    def setUp(self):
+        realtor = make_realtor()
+        self.flat = make_listing(realtor)
+        self.villa = make_listing(realtor, title='Garden villa', city='Bodrum', price=3000000)
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def export(self, query):
+        return self.client.get(f'/exports/listings/?{query}')
+
+    def test_export_needs_the_view_permission(self):
+        self.assertEqual(self.export('format=csv').status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.export('format=csv').status_code, 302)
+
+    def test_csv_and_ndjson_with_fields_and_filters(self):
+        self.staff.user_permissions.add(Permission.objects.get(codename='view_listing'))
+        response = self.export('format=csv&fields=id,title&price__gte=2000000')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="listings.csv"')
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows, [['id', 'title'], [str(self.villa.pk), 'Garden villa']])
+
+        response = self.export('format=ndjson&fields=id,city&city__in=Istanbul,Bodrum')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'id': self.flat.pk, 'city': 'Istanbul'}, {'id': self.villa.pk, 'city': 'Bodrum'},
+        ])
+
+    def test_bad_requests_are_refused(self):
+        self.staff.user_permissions.add(Permission.objects.get(codename='view_listing'))
+        for query in ('format=xml', 'fields=secret', 'password__exact=x', 'price__regex=1', 'price=cheap'):
+            self.assertEqual(self.export(query).status_code, 400, query)
+        self.assertEqual(self.client.get('/exports/passwords/').status_code, 400)
+
+    def test_command_writes_the_export(self):
+        path = os.path.join(self.make_temp_dir(), 'listings.ndjson')
+        call_command('export_data', 'listings', '--format', 'ndjson', '--fields', 'title',
+                     '--filter', 'city=Bodrum', '--output', path, stderr=StringIO())
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), '{"title":"Garden villa"}\n')
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'listings', '--filter', 'city')
+
+
+@override_settings(CACHES=TEST_CACHES, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ListingPhotoTests(TestCase):
+    def setUp(self):
+        self.realtor = make_realtor()
+
+    def photos(self, listing):
+        return list(listing.photos.values_list('field', 'position', 'image', 'url'))
+
+    def test_photo_columns_are_mirrored(self):
+        listing = make_listing(self.realtor, photo_main='photos/front.jpg', photo_2='photos/garden.jpg')
+        self.assertEqual(self.photos(listing), [
+            ('photo_main', 0, 'photos/front.jpg', '/media/photos/front.jpg'),
+            ('photo_2', 2, 'photos/garden.jpg', '/media/photos/garden.jpg'),
+        ])
+        listing.photo_main = 'photos/street.jpg'
+        listing.photo_2 = ''
+        listing.save()
+        self.assertEqual(self.photos(listing), [('photo_main', 0, 'photos/street.jpg', '/media/photos/street.jpg')])
+
+    def test_listing_pages_query_photos_once(self):
+        def query_count():
+            pagecache.page_cache().clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get('/en/listings/').status_code, 200)
+            return len(queries)
+
+        make_listing(self.realtor, photo_main='photos/front.jpg', photo_1='photos/hall.jpg')
+        one = query_count()
+        for i in range(3):
+            make_listing(self.realtor, photo_main=f'photos/front{i}.jpg', photo_1=f'photos/hall{i}.jpg')
+        self.assertEqual(query_count(), one)
+
+
+@override_settings(CACHES=TEST_CACHES, IMAGE_DERIVATIVE_WIDTHS=(32, 640), THUMBNAIL_SIZES=(32, 160))
+class ImageDerivativeTests(TempDirMixin, TestCase):
+    def setUp(self):
+        from PIL import Image
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+
+        override = override_settings(MEDIA_ROOT=self.make_temp_dir())
+        override.enable()
+        self.addCleanup(override.disable)
+        for known in (images._available, images._missing):
+            known.clear()
+            self.addCleanup(known.clear)
+        buffer = BytesIO()
+        Image.new('RGB', (200, 100), (120, 80, 40)).save(buffer, 'JPEG')
+        self.storage = default_storage
+        self.name = default_storage.save('photos/house.jpg', ContentFile(buffer.getvalue()))
+
+    def render(self):
+        from django.template import Context, Template
+
+        listing = make_listing(make_realtor(), photo_main=self.name)
+        template = Template('{% load listing_images %}{% responsive_image listing.photo_main alt="House" %}')
+        return template.render(Context({'listing': listing}))
+
+    def test_variants_are_written_once_and_never_enlarged(self):
+        from PIL import Image
+
+        self.assertEqual(images.generate_derivatives(self.name), 4)
+        self.assertEqual(images.generate_derivatives(self.name), 0)
+        for width, size in ((32, (32, 16)), (640, (200, 100))):
+            for fmt in ('webp', 'jpeg'):
+                with self.storage.open(images.derivative_name(self.name, width, fmt)) as f:
+                    self.assertEqual(Image.open(f).size, size)
+        self.assertEqual(images.derivative_name(self.name, 32, 'jpeg'), 'derivatives/photos/house.w32.jpg')
+
+    def test_cards_switch_to_the_variants_once_they_exist(self):
+        html = self.render()
+        self.assertNotIn('<picture>', html)
+        self.assertIn('/media-thumb/32/photos/house.jpg 32w', html)
+        images.generate_derivatives(self.name)
+        html = self.render()
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/photos/house.w32.webp 32w, ', html)
+        self.assertIn('src="/media/derivatives/photos/house.w640.jpg"', html)
+        self.assertIn('alt="House"', html)
+
+
+@override_settings(CACHES=TEST_CACHES, UPLOAD_MAX_DIMENSION=64, IMAGE_DERIVATIVE_WIDTHS=(32,))
+class UploadProcessingTests(TempDirMixin, TestCase):
+    def setUp(self):
+        from PIL import Image
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+
+        override = override_settings(MEDIA_ROOT=self.make_temp_dir())
+        override.enable()
+        self.addCleanup(override.disable)
+        exif = Image.Exif()
+        exif[0x010f] = 'PhoneMaker'
+        buffer = BytesIO()
+        Image.new('RGB', (200, 100), (120, 80, 40)).save(buffer, 'JPEG', exif=exif.tobytes())
+        self.storage = default_storage
+        self.first = default_storage.save('photos/2026/01/01/upload.jpg', ContentFile(buffer.getvalue()))
+        self.second = default_storage.save('photos/2026/01/01/copy.jpg', ContentFile(buffer.getvalue()))
+        self.realtor = make_realtor(photo=self.second)
+        self.listing = make_listing(self.realtor, photo_main=self.first)
+
+    def test_identical_uploads_share_one_processed_file(self):
+        from PIL import Image
+        from listings import uploads
+
+        updated_at = self.listing.updated_at
+        uploads.process_upload(self.first)
+        uploads.process_upload(self.second)
+        self.listing.refresh_from_db()
+        # A new ETag for the pages showing the photo.
+        self.assertGreater(self.listing.updated_at, updated_at)
+        self.realtor.refresh_from_db()
+        photo = self.listing.photos.get()
+        name = self.listing.photo_main.name
+        self.assertTrue(uploads.is_processed(name))
+        self.assertEqual(self.realtor.photo.name, name)
+        self.assertEqual((photo.image.name, photo.url), (name, self.storage.url(name)))
+        self.assertFalse(self.storage.exists(self.first))
+        self.assertFalse(self.storage.exists(self.second))
+        with self.storage.open(name) as f:
+            image = Image.open(f)
+            self.assertEqual(image.size, (64, 32))
+            self.assertEqual(dict(image.getexif()), {})
+        self.assertEqual((photo.width, photo.height), (64, 32))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ThumbnailSourceTests(TempDirMixin, TestCase):
+    def setUp(self):
+        from PIL import Image
+
+        media_root = self.make_temp_dir()
+        override = override_settings(MEDIA_ROOT=media_root, THUMBNAIL_CACHE_ROOT=self.make_temp_dir())
+        override.enable()
+        self.addCleanup(override.disable)
+        for name in ('photos/house.jpg', 'documents/passport.jpg'):
+            path = os.path.join(media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Image.new('RGB', (400, 300), (10, 20, 30)).save(path, 'JPEG')
+
+    def test_photos_are_served(self):
+        response = self.client.get('/media-thumb/160/photos/house.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        response.close()
+
+    def test_documents_are_not_served(self):
+        for path in ('documents/passport.jpg', 'photos/../documents/passport.jpg'):
+            response = self.client.get(f'/media-thumb/160/{path}')
+            self.assertEqual(response.status_code, 404, path)
+
+    def test_thumbnails_are_revalidated_by_etag(self):
+        response = self.client.get('/media-thumb/160/photos/house.jpg')
+        response.close()
+        self.assertNotIn('immutable', response['Cache-Control'])
+        response = self.client.get('/media-thumb/160/photos/house.jpg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_images_that_cannot_be_resized_are_not_found(self):
+        from concurrent.futures.process import BrokenProcessPool
+
+        from PIL import Image
+
+        for error in (Image.DecompressionBombError('too many pixels'), BrokenProcessPool('worker died')):
+            with mock.patch.object(thumbnails, 'get_thumbnail', side_effect=error):
+                response = self.client.get('/media-thumb/160/photos/house.jpg')
+            self.assertEqual(response.status_code, 404, error)
+
+    def test_a_broken_pool_is_replaced(self):
+        from concurrent.futures import Future
+        from concurrent.futures.process import BrokenProcessPool
+
+        future = Future()
+        future.set_exception(BrokenProcessPool('worker died'))
+        pool = mock.Mock(**{'submit.return_value': future})
+        with mock.patch.object(thumbnails, '_executor', pool):
+            with self.assertRaises(BrokenProcessPool):
+                thumbnails.get_thumbnail(thumbnails.source_path('photos/house.jpg'), 160, 'jpeg')
+            self.assertIsNone(thumbnails._executor)
+        pool.shutdown.assert_called_once_with(wait=False)
+
+
+@override_settings(CACHES=TEST_CACHES, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class AssetBundleTests(TempDirMixin, TestCase):
+    def setUp(self):
+        pagecache.page_cache().clear()
+
+    def script_order(self, html, *names):
+        return [html.index(name) for name in names]
+
+    def test_jquery_loads_before_bootstrap(self):
+        with override_settings(ASSET_BUNDLES_ENABLED=False):
+            html = self.client.get('/en/').content.decode()
+        positions = self.script_order(html, 'js/jquery-3.3.1.min.js', 'bootstrap.bundle.min.js', 'js/main.js')
+        self.assertEqual(positions, sorted(positions))
+
+    def test_built_bundles_replace_their_sources(self):
+        static_root = self.make_temp_dir()
+        with override_settings(STATIC_ROOT=static_root, ASSET_BUNDLES_ENABLED=True):
+            call_command('build_assets', bundle=['jquery.js', 'site.js'], stdout=StringIO())
+            names = assets.read_manifest()
+            self.assertEqual(set(names), {'jquery.js', 'site.js'})
+            for name in names.values():
+                self.assertRegex(name, r'^bundles/\w+\.[0-9a-f]{12}\.js$')
+                self.assertTrue(os.path.exists(os.path.join(static_root, f'{name}.gz')))
+            html = self.client.get('/en/').content.decode()
+        self.assertNotIn('js/main.js', html)
+        positions = self.script_order(html, names['jquery.js'], 'bootstrap.bundle.min.js', names['site.js'])
+        self.assertEqual(positions, sorted(positions))
@@ -0,0 +1,341 @@
+"""On-demand photo thumbnails: ``/media-thumb/<width>/<path under MEDIA_ROOT>``.
+
+Photos uploaded before the derivative pipeline (see ``images``) have no
+precomputed variants. This endpoint resizes any media image to one of the
+``THUMBNAIL_SIZES`` widths on first request and keeps the result in a disk
+cache under ``THUMBNAIL_CACHE_ROOT``:
+
+* Resizing runs in a process pool (``THUMBNAIL_WORKERS`` processes), so it
+  neither holds the GIL nor the request thread's CPU. Requests of this
+  process for the same missing thumbnail share one resize job.
+* The cache is capped at ``THUMBNAIL_CACHE_MAX_BYTES``. Hits refresh a
+  file's mtime, and when the cap is exceeded the least recently used files
+  are deleted until the cache is back under 90% of it.
+* Only images under ``THUMBNAIL_SOURCE_DIRS`` (listing and realtor photos)
+  are served; any other media path is a 404.
+* A name freed by upload processing (see ``uploads``) can later hold
+  another image, so responses are cached for ``THUMBNAIL_MAX_AGE`` seconds,
+  not for good. Their ETag, like the cache file name, is made of the
+  source's size and mtime: browsers revalidate with a cheap 304, and a
+  replaced source is resized again.
+* A broken process pool (a worker killed by the OOM killer, say) is
+  replaced by a new one on the next request.
+
+WebP is sent to browsers that accept it, JPEG otherwise. ``stats`` counts
+hits, misses, coalesced requests and evictions in this process.
+
+The Pillow helpers here touch no Django models, so the pool's worker
+processes only import this module.
+"""
+import functools
+import hashlib
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.encoding import filepath_to_uri
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+
+# A hit only rewrites the file's mtime when it is older than this, which
+# keeps the LRU order accurate enough without a write per request.
+TOUCH_INTERVAL = 3600
+
+# Seconds a request waits for its resize job.
+RENDER_TIMEOUT = 30
+
+_lock = threading.Lock()
+_pool_lock = threading.Lock()
+_pending = {}
+_executor = None
+_cache_bytes = None
+stats = Counter()
+
+
+def thumbnail_sizes():
+    return tuple(getattr(settings, 'THUMBNAIL_SIZES', (160, 320, 640, 1280)))
+
+
+def cache_root():
+    return getattr(settings, 'THUMBNAIL_CACHE_ROOT', os.path.join(settings.BASE_DIR, 'thumb_cache'))
+
+
+def cache_max_bytes():
+    return getattr(settings, 'THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+
+
+def worker_count():
+    return getattr(settings, 'THUMBNAIL_WORKERS', 2)
+
+
+def max_age():
+    return getattr(settings, 'THUMBNAIL_MAX_AGE', 24 * 3600)
+
+
+def thumbnail_quality():
+    return getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80)
+
+
+@functools.lru_cache(maxsize=None)
+def _url_prefix():
+    # reverse() once; map_data builds these URLs for thousands of photos.
+    return reverse('media_thumbnail', args=[1, 'x'])[:-len('1/x')]
+
+
+def thumbnail_url(name, width):
+    """URL of the ``width`` thumbnail of the media file ``name``."""
+    return f'{_url_prefix()}{width}/{filepath_to_uri(name)}'
+
+
+def srcset(name, widths):
+    """``srcset`` value of the thumbnails of ``name`` at those ``widths`` that are allowed."""
+    return ', '.join(
+        f'{thumbnail_url(name, width)} {width}w' for width in widths if width in thumbnail_sizes()
+    )
+
+
+def _count(name, amount=1):
+    with _lock:
+        stats[name] += amount
+
+
+# --- Pillow ---------------------------------------------------------------
+
+def resize(image, width):
+    """``image`` scaled down to ``width`` pixels wide (never scaled up)."""
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def encode(image, fmt, quality):
+    """``image`` encoded as ``fmt`` ('webp' or 'jpeg') bytes."""
+    buffer = BytesIO()
+    if fmt == 'jpeg':
+        if image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, fmt.upper(), quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def open_image(f):
+    """The upright, fully loaded image in file ``f``, in a mode the encoders take."""
+    image = ImageOps.exif_transpose(Image.open(f))
+    image.load()
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    return image
+
+
+def render(source, target, width, fmt, quality):
+    """Write the ``width`` thumbnail of the file ``source`` to ``target``; returns its size.
+
+    Runs in the pool's worker processes.
+    """
+    with open(source, 'rb') as f:
+        body = encode(resize(open_image(f), width), fmt, quality)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f'{target}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, target)
+    return len(body)
+
+
+# --- Cache ----------------------------------------------------------------
+
+def source_dirs():
+    """Top-level media directories thumbnails may be made of: photos, not documents."""
+    return tuple(getattr(settings, 'THUMBNAIL_SOURCE_DIRS', ('photos',)))
+
+
+def source_path(path):
+    """Absolute path of the media image ``path``, or None if it is not one.
+
+    Only images under ``THUMBNAIL_SOURCE_DIRS`` qualify: the endpoint is
+    public, while other uploads (the ``Ages`` identity documents) are not.
+    """
+    root = os.path.realpath(settings.MEDIA_ROOT)
+    full = os.path.realpath(os.path.join(root, path))
+    if not full.startswith(root + os.sep):
+        return None
+    if os.path.relpath(full, root).split(os.sep, 1)[0] not in source_dirs():
+        return None
+    if os.path.splitext(full)[1].lower() not in IMAGE_EXTENSIONS or not os.path.isfile(full):
+        return None
+    return full
+
+
+def cache_path(source, width, fmt):
+    stat = os.stat(source)
+    digest = hashlib.sha1(f'{source}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()
+    return os.path.join(cache_root(), str(width), digest[:2], f'{digest}.{fmt}')
+
+
+def etag(source, width, fmt):
+    """ETag of the ``width`` thumbnail of ``source``; changes when the source does."""
+    return f'"{width}-{os.path.basename(cache_path(source, width, fmt))}"'
+
+
+def _cache_files():
+    for directory, _dirs, files in os.walk(cache_root()):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, stat.st_size, stat.st_mtime
+
+
+def cache_usage():
+    """``(files, bytes)`` currently in the cache."""
+    files = total = 0
+    for _path, size, _mtime in _cache_files():
+        files += 1
+        total += size
+    return files, total
+
+
+def evict(max_bytes=None):
+    """Delete the least recently used files until the cache is below 90% of ``max_bytes``."""
+    global _cache_bytes
+    max_bytes = cache_max_bytes() if max_bytes is None else max_bytes
+    entries = sorted(_cache_files(), key=lambda entry: entry[2])
+    total = sum(size for _path, size, _mtime in entries)
+    evicted = 0
+    for path, size, _mtime in entries:
+        if total <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    with _lock:
+        _cache_bytes = total
+        stats['evictions'] += evicted
+    return evicted
+
+
+def _added(size):
+    """Account for a new cache file; evict once the cache outgrows its cap."""
+    global _cache_bytes
+    with _lock:
+        known = _cache_bytes is not None
+        if known:
+            _cache_bytes += size
+    if not known:
+        # First write in this process: count what is already there.
+        total = cache_usage()[1]
+        with _lock:
+            _cache_bytes = total
+    if _cache_bytes > cache_max_bytes():
+        evict()
+
+
+def clear():
+    global _cache_bytes
+    shutil.rmtree(cache_root(), ignore_errors=True)
+    with _lock:
+        _cache_bytes = 0
+
+
+# --- Requests -------------------------------------------------------------
+
+def _pool():
+    global _executor
+    with _pool_lock:
+        if _executor is None:
+            # Spawned, not forked: forking a threaded server process is unsafe.
+            _executor = ProcessPoolExecutor(
+                max_workers=worker_count(), mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+
+def _discard_pool(pool):
+    """Start a new pool on the next request if ``pool`` is still the current one."""
+    global _executor
+    with _pool_lock:
+        if _executor is pool:
+            _executor = None
+    pool.shutdown(wait=False)
+
+
+def _touch(path, mtime):
+    """Mark ``path`` as recently used (see ``TOUCH_INTERVAL``)."""
+    if time.time() - mtime > TOUCH_INTERVAL:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+
+def _open_hit(target):
+    """The cached ``target`` opened for reading, or None if it is not cached."""
+    try:
+        f = open(target, 'rb')
+    except FileNotFoundError:
+        return None
+    _touch(target, os.fstat(f.fileno()).st_mtime)
+    return f
+
+
+def get_thumbnail(source, width, fmt):
+    """The cached ``width`` thumbnail of ``source`` as an open file, resizing it if needed.
+
+    Returns ``(file, outcome)`` with outcome 'hit', 'miss' or 'coalesced'.
+    The file is opened before anything is evicted, so it stays readable.
+    """
+    target = cache_path(source, width, fmt)
+    f = _open_hit(target)
+    if f is not None:
+        _count('hits')
+        return f, 'hit'
+
+    with _lock:
+        future = _pending.get(target)
+        if future is not None:
+            outcome = 'coalesced'
+        else:
+            outcome = 'miss'
+            pool = _pool()
+            future = pool.submit(render, source, target, width, fmt, thumbnail_quality())
+            _pending[target] = future
+    _count('misses' if outcome == 'miss' else 'coalesced')
+    try:
+        size = future.result(timeout=RENDER_TIMEOUT)
+    except BrokenProcessPool:
+        if outcome == 'miss':
+            _discard_pool(pool)
+        raise
+    finally:
+        if outcome == 'miss':
+            with _lock:
+                _pending.pop(target, None)
+    f = open(target, 'rb')
+    if outcome == 'miss':
+        _added(size)
+    return f, outcome
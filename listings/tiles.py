@@ -0,0 +1,235 @@
+"""Precomputed Web Mercator tiles of listing markers.
+
+``/listings/map-tiles/<z>/<x>/<y>`` serves the published listings inside one
+slippy-map tile as GeoJSON: grid cluster aggregates up to
+``MAP_CLUSTER_MAX_ZOOM`` and individual markers above it. Tiles are built on
+first request and written to ``MAP_TILE_ROOT``; the Listing signals delete
+only the tiles (one per zoom level) that contain a saved or deleted
+listing's old or new position, so everything else keeps being served from
+disk. Each tile carries a strong ETag derived from its bytes, so browsers and
+CDNs revalidate with ``If-None-Match`` and get a 304 without any database work.
+
+Every invalidation also bumps a tile generation counter in the shared
+``IndexVersion`` table. A tile is only kept on disk if the generation did
+not change while it was built, so a tile built from rows that were changed
+meanwhile is served once and then rebuilt. Invalidations made inside a
+transaction are repeated once it commits, since until then other processes
+still build tiles from the old rows.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+
+from django.conf import settings
+from django.db.models import Avg, Case, Count, F, IntegerField, Max, Min, When
+from django.db.models.functions import Floor
+
+from . import geojson
+from .clustering import cluster_grid, cluster_max_zoom
+from .localindex import bump_version, shared_version
+from .pagecache import now_and_on_commit
+from .queries import mapped_listings
+
+MAX_LATITUDE = 85.0511287798  # Web Mercator cut-off
+
+TILE_VERSION_KEY = 'listings:map_tiles:version'
+
+
+def tile_max_zoom():
+    return getattr(settings, 'MAP_TILE_MAX_ZOOM', 16)
+
+
+def tile_root():
+    return getattr(settings, 'MAP_TILE_ROOT', os.path.join(settings.BASE_DIR, 'map_tiles'))
+
+
+def tile_max_age():
+    return getattr(settings, 'MAP_TILE_MAX_AGE', 60)
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= tile_max_zoom() and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+# --- Tile math ------------------------------------------------------------
+
+def tile_for(latitude, longitude, z):
+    latitude = max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE)
+    n = 2 ** z
+    x = int((longitude + 180.0) / 360.0 * n)
+    lat_rad = math.radians(latitude)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_latitude(y, z):
+    """Latitude of the top (north) edge of tile row ``y``; ``y`` may be fractional."""
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2 ** z))))
+
+
+def tile_bbox(z, x, y):
+    """``(west, south, east, north)`` of a tile."""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    return west, tile_latitude(y + 1, z), east, tile_latitude(y, z)
+
+
+# --- Building -------------------------------------------------------------
+
+def tile_queryset(z, x, y):
+    """Published, mapped listings inside the tile.
+
+    Edges are assigned the same way as ``tile_for()``: a tile owns its west
+    and north edges. The outermost rows and column are left open so points
+    beyond the Mercator cut-off still land in a tile.
+    """
+    n = 2 ** z
+    west, south, east, north = tile_bbox(z, x, y)
+    queryset = mapped_listings({}).filter(longitude__gte=west)
+    if x < n - 1:
+        queryset = queryset.filter(longitude__lt=east)
+    if y > 0:
+        queryset = queryset.filter(latitude__lte=north)
+    if y < n - 1:
+        queryset = queryset.filter(latitude__gt=south)
+    return queryset
+
+
+def _cluster_features(queryset, z, x, y):
+    # Cells are a grid x grid split of the tile in Mercator space: columns
+    # are linear in longitude, rows are assigned from precomputed latitude
+    # boundaries so the aggregation still happens in a single SQL query.
+    grid = cluster_grid()
+    west, _south, east, _north = tile_bbox(z, x, y)
+    width = (east - west) / grid
+    row_edges = [tile_latitude(y + (row + 1) / grid, z) for row in range(grid - 1)]
+    rows = (
+        queryset.order_by()
+        .annotate(
+            cell_x=Floor((F('longitude') - west) / width),
+            cell_y=Case(
+                *[When(latitude__gt=edge, then=row) for row, edge in enumerate(row_edges)],
+                default=grid - 1,
+                output_field=IntegerField(),
+            ),
+        )
+        .values('cell_x', 'cell_y')
+        .annotate(
+            count=Count('id'),
+            latitude_avg=Avg('latitude'),
+            longitude_avg=Avg('longitude'),
+            min_price=Min('price'),
+            max_price=Max('price'),
+        )
+    )
+    return [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [row['longitude_avg'], row['latitude_avg']]},
+            'properties': {
+                'cluster': True,
+                'count': row['count'],
+                'min_price': row['min_price'],
+                'max_price': row['max_price'],
+            },
+        }
+        for row in rows
+    ]
+
+
+def build_tile(z, x, y):
+    """Return the encoded tile body."""
+    queryset = tile_queryset(z, x, y)
+    if z <= cluster_max_zoom():
+        features = _cluster_features(queryset, z, x, y)
+    else:
+        photo_url = geojson.photo_url_builder()
+        features = [geojson.feature(row, photo_url) for row in geojson.map_rows(queryset)]
+    collection = {'type': 'FeatureCollection', 'features': features}
+    return json.dumps(collection, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+# --- Storage --------------------------------------------------------------
+
+def tile_path(z, x, y):
+    return os.path.join(tile_root(), str(z), str(x), f'{y}.json')
+
+
+def make_etag(body):
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def write_tile(z, x, y, body):
+    path = tile_path(z, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(body)
+    os.replace(tmp_path, path)
+
+
+def get_tile(z, x, y):
+    """Return ``(body, etag)``, building and storing the tile if it is missing."""
+    path = tile_path(z, x, y)
+    try:
+        with open(path, 'rb') as f:
+            body = f.read()
+    except FileNotFoundError:
+        generation = shared_version(TILE_VERSION_KEY)
+        body = build_tile(z, x, y)
+        write_tile(z, x, y, body)
+        if shared_version(TILE_VERSION_KEY) != generation:
+            # Invalidated while it was built: possibly from the old rows.
+            _remove(path)
+    return body, make_etag(body)
+
+
+def occupied_tiles(max_zoom):
+    """Every ``(z, x, y)`` up to ``max_zoom`` that contains at least one listing."""
+    found = set()
+    points = mapped_listings({}).values_list('latitude', 'longitude').iterator(chunk_size=2000)
+    for latitude, longitude in points:
+        for z in range(max_zoom + 1):
+            found.add((z, *tile_for(latitude, longitude, z)))
+    return sorted(found)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def clear_tiles():
+    def clear():
+        bump_version(TILE_VERSION_KEY)
+        shutil.rmtree(tile_root(), ignore_errors=True)
+
+    now_and_on_commit(clear)
+
+
+def invalidate_points(points):
+    """Drop every stored tile, at each zoom level, that contains one of the points."""
+    points = [
+        (latitude, longitude) for latitude, longitude in points
+        if latitude is not None and longitude is not None
+    ]
+    if not points:
+        return
+
+    def invalidate():
+        bump_version(TILE_VERSION_KEY)
+        for latitude, longitude in points:
+            for z in range(tile_max_zoom() + 1):
+                _remove(tile_path(z, *tile_for(latitude, longitude, z)))
+
+    now_and_on_commit(invalidate)
+
+
+def invalidate_point(latitude, longitude):
+    """Drop every stored tile, at each zoom level, that contains the point."""
+    invalidate_points([(latitude, longitude)])
@@ -0,0 +1,290 @@
+"""Post-processing of uploaded photos and documents.
+
+Admin uploads (listing photos, realtor photos, ``Ages`` documents) used to
+stay in ``MEDIA_ROOT`` exactly as received, often as 10+ MB phone photos
+carrying their GPS position in the EXIF data. Saving a model with a new
+upload now queues a ``process_upload`` job (see ``jobs``), so the save
+returns at once and a ``run_workers`` thread does the work:
+
+* Images are turned upright, scaled down to fit ``UPLOAD_MAX_DIMENSION``
+  and re-encoded without their metadata (the colour profile is kept):
+  JPEG, or WebP for WebP uploads and images with transparency, at
+  ``UPLOAD_IMAGE_QUALITY``. A re-encoding that is larger than an upload
+  that had neither metadata nor excess pixels is discarded. Animated and
+  unreadable images, and other files, are stored unchanged.
+* The result is stored under a name derived from the SHA-256 of the
+  upload::
+
+      photos/sha256/3f/3f2a...c1.jpg
+
+  so identical uploads share one file and are processed once.
+* Every model field that referenced the upload is pointed at the new
+  name, the upload is deleted and the pages showing it are dropped.
+
+Names under a ``sha256`` directory are processed already. The
+``process_uploads`` command processes the existing uploads in parallel.
+"""
+import collections
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from Ages.models import AgesVerification
+from realtors.models import Realtor
+
+from . import images, jobs
+from .models import PHOTO_FIELDS, Listing, ListingPhoto
+from .thumbnails import IMAGE_EXTENSIONS
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+HASHED_DIR = 'sha256'
+
+# The model fields holding uploads, by model, and whether they are photos
+# shown on the site (which get resized variants, see ``images``).
+UPLOAD_FIELDS = (
+    (Listing, PHOTO_FIELDS, True),
+    (ListingPhoto, ('image',), True),
+    (Realtor, ('photo',), True),
+    (AgesVerification, ('upload_file',), False),
+)
+
+_lock = threading.Lock()
+_digest_locks = {}
+
+Stored = collections.namedtuple('Stored', 'name original_size size width height deduplicated')
+
+
+def processing_enabled():
+    return getattr(settings, 'UPLOAD_PROCESSING', True)
+
+
+def max_dimension():
+    return getattr(settings, 'UPLOAD_MAX_DIMENSION', 2560)
+
+
+def image_quality():
+    return getattr(settings, 'UPLOAD_IMAGE_QUALITY', 85)
+
+
+def is_processed(name):
+    """Whether ``name`` is a stored, processed upload."""
+    return f'/{HASHED_DIR}/' in f'/{name}'
+
+
+def needs_processing(name):
+    return bool(name) and processing_enabled() and not is_processed(name)
+
+
+def hashed_name(name, digest, extension):
+    """``<top directory of name>/sha256/<ab>/<digest><extension>``."""
+    top = name.split('/', 1)[0] if '/' in name else 'uploads'
+    return f'{top}/{HASHED_DIR}/{digest[:2]}/{digest}{extension}'
+
+
+# --- Processing -------------------------------------------------------------
+
+def process_image(data):
+    """``(body, extension, width, height)`` of the processed image ``data``.
+
+    Returns ``data`` itself (with the extension None) when it is not an
+    image Pillow can re-encode, or re-encoding would not help.
+    """
+    if Image is None:
+        return data, None, None, None
+    try:
+        source = Image.open(BytesIO(data))
+        if getattr(source, 'is_animated', False):
+            return data, None, source.width, source.height
+        has_metadata = bool(source.getexif()) or any(
+            key in source.info for key in ('xmp', 'XML:com.adobe.xmp', 'comment')
+        )
+        fmt = 'webp' if source.format == 'WEBP' else 'jpeg'
+        # A CMYK profile does not describe the RGB pixels written below.
+        icc_profile = source.info.get('icc_profile') if source.mode != 'CMYK' else None
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return data, None, None, None
+
+    limit = max_dimension()
+    resized = image.width > limit or image.height > limit
+    if resized:
+        image.thumbnail((limit, limit), Image.LANCZOS)
+    if image.mode not in ('RGB', 'L'):
+        if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+            image = image.convert('RGBA')
+            fmt = 'webp'
+        else:
+            image = image.convert('RGB')
+
+    buffer = BytesIO()
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if fmt == 'jpeg':
+        image.save(buffer, 'JPEG', quality=image_quality(), optimize=True, progressive=True, **options)
+    else:
+        image.save(buffer, 'WEBP', quality=image_quality(), method=4, **options)
+    body = buffer.getvalue()
+    if not (resized or has_metadata) and len(body) >= len(data):
+        return data, None, image.width, image.height
+    return body, '.jpg' if fmt == 'jpeg' else '.webp', image.width, image.height
+
+
+def _dimensions(name, storage):
+    if Image is None:
+        return None, None
+    try:
+        with storage.open(name, 'rb') as f:
+            return Image.open(f).size
+    except (OSError, ValueError):
+        return None, None
+
+
+def store(name, storage=default_storage, variants=False):
+    """Process the upload ``name`` and store the result under its hashed name.
+
+    With ``variants`` the resized variants of a stored image are written
+    too. Touches no model; the upload itself is left in place.
+    """
+    with storage.open(name, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    with _lock:
+        entry = _digest_locks.setdefault(digest, [threading.Lock(), 0])
+        entry[1] += 1
+    # Identical uploads processed at the same time would write the same files.
+    try:
+        with entry[0]:
+            return _store(name, data, digest, storage, variants)
+    finally:
+        with _lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _digest_locks[digest]
+
+
+def _store(name, data, digest, storage, variants):
+    extension = os.path.splitext(name)[1].lower()
+    processed_extension = None
+    if extension in IMAGE_EXTENSIONS:
+        # Identical uploads were processed into the same hashed name.
+        for candidate in ('.jpg', '.webp', extension):
+            existing = hashed_name(name, digest, candidate)
+            if storage.exists(existing):
+                if variants and images.Image is not None:
+                    # Usually written with the first copy already.
+                    images.generate_derivatives(existing, storage)
+                width, height = _dimensions(existing, storage)
+                return Stored(existing, len(data), storage.size(existing), width, height, True)
+        data_out, processed_extension, width, height = process_image(data)
+    else:
+        data_out, width, height = data, None, None
+        existing = hashed_name(name, digest, extension)
+        if storage.exists(existing):
+            return Stored(existing, len(data), len(data), None, None, True)
+    target = hashed_name(name, digest, processed_extension or extension)
+    saved = storage.save(target, ContentFile(data_out))
+    if saved != target:
+        # An identical upload was stored meanwhile; share its file.
+        storage.delete(saved)
+    if variants and width and images.Image is not None:
+        images.generate_derivatives(target, storage)
+    return Stored(target, len(data), len(data_out), width, height, False)
+
+
+# --- References -------------------------------------------------------------
+
+def referenced_names(prefix=''):
+    """``{name: is a photo}`` of the unprocessed uploads referenced under ``prefix``."""
+    names = {}
+    for model, fields, photo in UPLOAD_FIELDS:
+        for field in fields:
+            values = model._default_manager.filter(**{f'{field}__startswith': prefix}).exclude(**{field: ''})
+            for name in values.values_list(field, flat=True).iterator(chunk_size=2000):
+                if not is_processed(name):
+                    names[name] = names.get(name, False) or photo
+    return names
+
+
+def is_photo(name):
+    """Whether a photo field references the upload ``name``."""
+    return any(
+        model._default_manager.filter(**{field: name}).exists()
+        for model, fields, photo in UPLOAD_FIELDS if photo for field in fields
+    )
+
+
+def replace_references(name, stored, storage=default_storage):
+    """Point every field holding ``name`` at ``stored.name``.
+
+    Rows are updated with ``update()``: no signals, so no new jobs. The
+    listings showing the upload get a new ``updated_at``, or their pages
+    would still be answered with a 304 pointing at the deleted file (see
+    ``conditional``). Returns the ids of the listings and realtors whose
+    photos changed.
+    """
+    listing_ids = set()
+    realtor_ids = set()
+    with transaction.atomic():
+        for model, fields, _photo in UPLOAD_FIELDS:
+            for field in fields:
+                rows = model._default_manager.filter(**{field: name})
+                values = {field: stored.name}
+                if model is ListingPhoto:
+                    listing_ids.update(rows.values_list('listing_id', flat=True))
+                    values['url'] = storage.url(stored.name)
+                    if stored.width:
+                        values.update(width=stored.width, height=stored.height)
+                elif model is Listing:
+                    listing_ids.update(rows.values_list('id', flat=True))
+                elif model is Realtor:
+                    realtor_ids.update(rows.values_list('id', flat=True))
+                rows.update(**values)
+        if listing_ids:
+            Listing.objects.filter(pk__in=listing_ids).update(updated_at=timezone.now())
+    return listing_ids, realtor_ids
+
+
+def remove_upload(name, storage=default_storage):
+    """Delete the replaced upload ``name`` and any variants made of it."""
+    for derivative in [name] + [
+        images.derivative_name(name, width, fmt)
+        for width in images.derivative_widths() for fmt in images.derivative_formats()
+    ]:
+        if storage.exists(derivative):
+            storage.delete(derivative)
+
+
+@jobs.task('process_upload')
+def process_upload(name):
+    """Process a fresh upload (see the module docstring)."""
+    if is_processed(name) or not default_storage.exists(name):
+        return
+    stored = store(name, variants=is_photo(name))
+    listing_ids, realtor_ids = replace_references(name, stored)
+    images.invalidate_pages(listing_ids, realtor_ids)
+    # Last, so cached pages showing the upload work until they are dropped.
+    remove_upload(name)
+    logger.info(
+        'Processed upload %s -> %s (%d -> %d bytes%s)', name, stored.name,
+        stored.original_size, stored.size, ', deduplicated' if stored.deduplicated else '',
+    )
+
+
+def enqueue(name):
+    """Queue the processing of the upload ``name`` unless it is processed already."""
+    if needs_processing(name):
+        jobs.enqueue('process_upload', key=hashlib.sha1(name.encode()).hexdigest(), name=name)
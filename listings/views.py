@@ -1,73 +1,85 @@
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render, redirect, get_object_or_404
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.http import HttpResponse, JsonResponse
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.conf import settings
 
 from listings.choices import price_choices , bedroom_choices , state_choices, type_choices
 
+from . import clustering, export as exports, facets, geojson, readmodel, similar, thumbnails, tiles
+from .conditional import (
+    collection_etag, collection_last_modified, conditional, data_etag, data_last_modified,
+    listing_etag, listing_last_modified,
+)
+from .pagecache import cache_page, fragment_version, page_cache_timeout
 from .models import Listing
+from .pagination import paginate_listings
+from .params import ParameterError
+from .queries import filter_fingerprint, published_listings, search_results, mapped_listings, with_photos
+
+# Sent for a malformed request whose error message was not written for visitors.
+INVALID_PARAMETERS = 'Invalid search parameters.'
+
+
+def _detail_context(listing):
+	# similar_listings is only evaluated when its cached fragment is stale.
+	return {
+		'listing': listing,
+		'similar_listings': partial(similar.similar_listings, listing),
+		'fragment_version': f"{fragment_version('listings')}.{similar.version()}",
+		'fragment_timeout': page_cache_timeout(),
+	}
+
 
 # Create your views here
+@conditional(collection_etag, collection_last_modified)
+@cache_page('listings')
 def index(request):
-	listings = Listing.objects.all().order_by('-list_date').filter(is_published=True)
-	paginator = Paginator(listings, 6)
-	page = request.GET.get('page')
-	paged_listings = paginator.get_page(page)
+	paged_listings = paginate_listings(request, with_photos(published_listings()), 6)
 	return render(request,'listings/listings.html',{'listings' : paged_listings})
 
 
+@conditional(collection_etag, collection_last_modified)
+@cache_page('listings')
 def new_properties(request):
 	"""Render the new frontend properties page with the same listings data/pagination."""
-	listings = Listing.objects.all().order_by('-list_date').filter(is_published=True)
-	paginator = Paginator(listings, 6)
-	page = request.GET.get('page')
-	paged_listings = paginator.get_page(page)
+	paged_listings = paginate_listings(request, with_photos(published_listings()), 6)
 	return render(request, 'newfrontend/properties.html', {'listings': paged_listings})
 
 
+@conditional(listing_etag, listing_last_modified)
+@cache_page('listing:{listing_id}', 'listings', versions=(similar.version,))
 def new_listing_detail(request, listing_id):
-	listing = get_object_or_404(Listing, pk=listing_id)
-	return render(request, 'newfrontend/property-details.html', {'listing': listing})
+	listing = get_object_or_404(Listing.objects.prefetch_related('photos'), pk=listing_id)
+	return render(request, 'newfrontend/property-details.html', _detail_context(listing))
 
 
+@conditional(listing_etag, listing_last_modified)
+@cache_page('listing:{listing_id}', 'listings', versions=(similar.version,))
 def listing(request , listing_id):
-	listing = get_object_or_404(Listing , pk=listing_id)
-	context = {
-	  'listing' : listing
-	}
-	return render(request,'listings/listing.html',context)
+	listing = get_object_or_404(Listing.objects.select_related('realtor').prefetch_related('photos'), pk=listing_id)
+	return render(request,'listings/listing.html',_detail_context(listing))
 
 
+@cache_page('listings', versions=(readmodel.version,))
 def search(request):
-	queryset_list = Listing.objects.order_by('-list_date')
-	if 'keywords' in request.GET:
-		keywords = request.GET['keywords']
-		if keywords:
-			queryset_list = queryset_list.filter(description__icontains=keywords)
-
-	if 'city' in request.GET:
-		city = request.GET['city']
-		if city:
-			queryset_list = queryset_list.filter(city__iexact=city)
-
-	if 'state' in request.GET:
-		state = request.GET['state']
-		if state:
-			queryset_list = queryset_list.filter(state__iexact=state)
-
-	if 'bedrooms' in request.GET:
-		bedrooms = request.GET['bedrooms']
-		if bedrooms:
-			queryset_list = queryset_list.filter(bedrooms__lte=bedrooms)
-
-	if 'price' in request.GET:
-		price = request.GET['price']
-		if price:
-			queryset_list = queryset_list.filter(price__lte=price)
-
+	try:
+		queryset_list = search_results(request.GET)
+		search_facets = facets.search_facets(request.GET)
+	except ParameterError as e:
+		return HttpResponseBadRequest(str(e))
+	except ValueError:
+		return HttpResponseBadRequest(INVALID_PARAMETERS)
 
 	return render(request,'listings/search.html',{
 		'listings' : queryset_list,
+		'facets' : search_facets,
         'state_choices' : state_choices,
         'bedroom_choices' : bedroom_choices,
         'price_choices' : price_choices,
@@ -77,106 +89,95 @@ def search(request):
 
 
 def map_view(request):
-    return render(request, 'listings/map.html')
+    return render(request, 'listings/map.html', {'map_tile_max_zoom': tiles.tile_max_zoom()})
 
 
+@conditional(data_etag, data_last_modified, private=False)
 def map_data(request):
-    # Get initial queryset and check total count
-    qs = Listing.objects.filter(is_published=True)
-    initial_count = qs.count()
-    print(f"Initial published listings count: {initial_count}")
-
-    # Check how many have coordinates
-    has_coords = qs.exclude(latitude__isnull=True).exclude(longitude__isnull=True).count()
-    print(f"Listings with coordinates: {has_coords}")
-
-    # Print a sample of listings to check coordinate values
-    sample = qs[:5]
-    print("\nSample listings:")
-    for listing in sample:
-        print(f"ID: {listing.id}, Title: {listing.title}, Lat: {listing.latitude}, Lng: {listing.longitude}")
-
-    # Optional filters to mirror search behavior
-    keywords = request.GET.get('keywords')
-    if keywords:
-        qs = qs.filter(description__icontains=keywords)
-
-    city = request.GET.get('city')
-    if city:
-        qs = qs.filter(city__iexact=city)
-
-    state = request.GET.get('state')
-    if state:
-        qs = qs.filter(state__iexact=state)
-
-    bedrooms = request.GET.get('bedrooms')
-    if bedrooms:
-        qs = qs.filter(bedrooms__lte=bedrooms)
-
-    price = request.GET.get('price')
-    if price:
-        qs = qs.filter(price__lte=price)
-
-    # Filter for listings with coordinates
-    qs = qs.exclude(latitude__isnull=True).exclude(longitude__isnull=True)
-    final_count = qs.count()
-    print(f"\nFinal filtered listings count: {final_count}")
-
-    features = []
-    for obj in qs:
-        properties = {
-            "id": obj.id,
-            "title": obj.title,
-            "price": obj.price,
-            "bedrooms": obj.bedrooms,
-            "bathrooms": obj.bathrooms,
-            "city": obj.city,
-            "state": obj.state,
-            "address": obj.address,
-            "url": f"/listings/{obj.id}/",
-        }
-        # Collect available photos for swipeable gallery in popup
-        photos = []
+    try:
+        bbox = clustering.parse_bbox(request.GET['bbox']) if request.GET.get('bbox') else None
+        zoom = clustering.parse_zoom(request.GET['zoom']) if request.GET.get('zoom') else None
+        qs = mapped_listings(request.GET)
+
+        # Zoomed out: per-cell aggregates instead of individual listings.
+        if zoom is not None and zoom <= clustering.cluster_max_zoom():
+            if readmodel.is_enabled():
+                features = readmodel.get_model().cluster_features(request.GET, zoom, bbox)
+                return JsonResponse({'type': 'FeatureCollection', 'features': features})
+            return JsonResponse(clustering.cached_cluster_collection(qs, zoom, bbox, filter_fingerprint(request.GET)))
+    except ParameterError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except ValueError:
+        return JsonResponse({'error': INVALID_PARAMETERS}, status=400)
+
+    if bbox is not None:
+        qs = clustering.filter_bbox(qs, bbox)
+    rows = geojson.map_rows(qs)
+    return StreamingHttpResponse(
+        geojson.stream_feature_collection(rows),
+        content_type='application/json',
+    )
+
+
+def map_tile(request, z, x, y):
+    if not tiles.is_valid_tile(z, x, y):
+        raise Http404('No such map tile')
+    body, etag = tiles.get_tile(z, x, y)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=tiles.tile_max_age())
+    return response
+
+
+def media_thumbnail(request, size, path):
+    if size not in thumbnails.thumbnail_sizes() or thumbnails.Image is None:
+        raise Http404('No such thumbnail size')
+    source = thumbnails.source_path(path)
+    if source is None:
+        raise Http404('No such image')
+    fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    etag = thumbnails.etag(source, size, fmt)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
         try:
-            if obj.photo_main:
-                photos.append(obj.photo_main.url)
-        except Exception:
-            pass
-        for field in [
-            "photo_1",
-            "photo_2",
-            "photo_3",
-            "photo_4",
-            "photo_5",
-            "photo_6",
-        ]:
-            try:
-                img = getattr(obj, field)
-                if img:
-                    photos.append(img.url)
-            except Exception:
-                # Skip if file missing or storage not accessible
-                continue
-        if photos:
-            properties["photos"] = photos
-            # Keep legacy single photo key for backward-compat
-            properties["photo_url"] = photos[0]
-
-        features.append({
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": [obj.longitude, obj.latitude],
-            },
-            "properties": properties,
-        })
-
-    return JsonResponse({
-        "type": "FeatureCollection",
-        "features": features,
-    })
+            f, outcome = thumbnails.get_thumbnail(source, size, fmt)
+        except (OSError, ValueError, thumbnails.Image.DecompressionBombError, BrokenProcessPool):
+            # Unreadable or oversized image, the resize timed out, or its
+            # worker process died.
+            thumbnails.stats['errors'] += 1
+            raise Http404('Thumbnail unavailable')
+        response = FileResponse(f, content_type=thumbnails.CONTENT_TYPES[fmt])
+        response['X-Thumbnail-Cache'] = outcome
+    response['ETag'] = etag
+    response['Vary'] = 'Accept'
+    patch_cache_control(response, public=True, max_age=thumbnails.max_age())
+    return response
 
 
 def new_map_view(request):
 	"""Render the new frontend map page."""
-	return render(request, 'newfrontend/map.html')
+	return render(request, 'newfrontend/map.html', {'map_tile_max_zoom': tiles.tile_max_zoom()})
+
+
+@staff_member_required
+def export(request, dataset):
+	"""Stream a dataset as CSV or NDJSON: ?format=csv|ndjson&fields=a,b plus field filters."""
+	params = request.GET.dict()
+	fmt = params.pop('format', 'csv')
+	fields = params.pop('fields', None)
+	try:
+		model = exports.get_model(dataset)
+		if fmt not in exports.FORMATS:
+			raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(exports.FORMATS)}.")
+		if not request.user.has_perm(f'{model._meta.app_label}.view_{model._meta.model_name}'):
+			return HttpResponseForbidden()
+		fields, rows = exports.export_rows(dataset, fields, params)
+	except ValueError as e:
+		return HttpResponseBadRequest(str(e))
+
+	response = StreamingHttpResponse(exports.stream(fmt, fields, rows), content_type=exports.FORMATS[fmt])
+	response['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+	patch_cache_control(response, private=True, no_store=True)
+	return response
@@ -1,13 +1,18 @@
 from django.shortcuts import render,redirect
 
 from listings.choices import price_choices , bedroom_choices , state_choices
-from listings.models import Listing
+from listings.feed import homepage_feed, feed_timeout, feed_version
+from listings.pagecache import cache_page
+from listings.queries import published_listings, with_photos
 from realtors.models import Realtor
 
 # Create your views here.
+@cache_page('listings')
 def index(request):
-	listings = Listing.objects.order_by('-list_date').filter(is_published=True);
+	listings = homepage_feed()
 	return render(request , 'pages/index.html',{'listings' : listings ,
+        'feed_timeout' : feed_timeout(),
+        'feed_version' : feed_version(),
         'state_choices' : state_choices,
         'bedroom_choices' : bedroom_choices,
         'price_choices' : price_choices,
@@ -15,6 +20,7 @@ def index(request):
 		})
 
 
+@cache_page('realtors')
 def about(request):
 	realtors = Realtor.objects.order_by('-hire_date')
 	mvp_realtors = Realtor.objects.all().filter(is_mvp=True)
@@ -25,8 +31,9 @@ def about(request):
 	return render(request , 'pages/about.html',context)
 
 
+@cache_page('listings')
 def financing(request):
-	listings = Listing.objects.order_by('-list_date').filter(is_published=True)
+	listings = with_photos(published_listings())
 	return render(request , 'newfrontend/financing.html',{'listings' : listings ,
         'state_choices' : state_choices,
         'bedroom_choices' : bedroom_choices,